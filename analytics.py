@@ -0,0 +1,105 @@
+"""
+Summary statistics of finished games, worked out in one pass over a stream of game records (see
+export.py) without keeping the games. Everything is a running total, a running mean and variance,
+or a count per game length, and games never last more than a few hundred turns, so the memory
+used is the same for ten games or ten million.
+"""
+import os
+
+from bakery import assert_equal
+
+endings = ["deck", "hand", "limit"] # How a game can end: the deck ran out, a hand was emptied, or it was called off
+
+
+class GameStats:
+    """ Running statistics of a stream of game records """
+
+    def __init__(self):
+        self.games = 0
+        self.wins = [0, 0, 0]       # Player 1, Player 2, ties
+        self.endings = {ending: 0 for ending in endings}
+        self.points = [0, 0]        # Each player's points, added up
+        self.pickups = 0            # Turns where a player picked up from the discard pile
+        self.pickup_chances = 0     # Turns where the discard pile had a card that could be picked up
+        self.pickups_melded = 0     # Pickups whose card went into a set the same turn
+        self.draws = 0              # Turns where a player drew from the deck
+        self.length_counts = {}     # Number of turns -> how many games lasted that long
+        self.margin_mean = 0.0      # The mean and the sum of squared differences from it of the margins,
+        self.margin_squares = 0.0   # updated one game at a time (Welford's method) so they don't drift
+
+    def add(self, record : dict) -> None:
+        """ Adds one finished game
+        Args:
+            record (dict): The game, with at least its "scores", "turns", "ending", "pickups",
+                           "pickup_chances", "pickups_melded" and "draws"
+        """
+        scores = record["scores"]
+        self.games += 1
+        self.wins[-1 if scores[0] == scores[1] else int(scores[1] > scores[0])] += 1
+        self.endings[record["ending"]] += 1
+        self.points[0] += scores[0]
+        self.points[1] += scores[1]
+        self.pickups += record["pickups"]
+        self.pickup_chances += record["pickup_chances"]
+        self.pickups_melded += record["pickups_melded"]
+        self.draws += record["draws"]
+        self.length_counts[record["turns"]] = self.length_counts.get(record["turns"], 0) + 1
+        margin = abs(scores[0] - scores[1])
+        difference = margin - self.margin_mean
+        self.margin_mean += difference / self.games
+        self.margin_squares += difference * (margin - self.margin_mean)
+
+    def get_length_percentile(self, fraction : float) -> int:
+        """ Args:
+                fraction (float): How far through the games, sorted by length, to look (0.5 is the median)
+            Returns:
+                int: The number of turns of the game that far through, or 0 if there are no games
+        """
+        seen = 0
+        for turns in sorted(self.length_counts):
+            seen += self.length_counts[turns]
+            if seen >= fraction * self.games:
+                return turns
+        return 0
+
+    def get_summary(self) -> dict:
+        """ Returns:
+                dict: The statistics, ready to be printed or saved as JSON
+        """
+        games = self.games or 1 # So an empty stream gives zeros instead of dividing by zero
+        return {
+            "games": self.games,
+            "wins": {"player_1": self.wins[0], "player_2": self.wins[1], "ties": self.wins[-1]},
+            "endings": {ending: count / games for ending, count in self.endings.items()},
+            "average_points": [self.points[0] / games, self.points[1] / games],
+            "average_margin": self.margin_mean,
+            "margin_stdev": (self.margin_squares / (self.games - 1)) ** 0.5 if self.games > 1 else 0.0,
+            "pickup_rate": self.pickups / self.pickup_chances if self.pickup_chances else 0.0,
+            "pickup_success": self.pickups_melded / self.pickups if self.pickups else 0.0,
+            "pickups_per_game": self.pickups / games,
+            "draws_per_game": self.draws / games,
+            "average_turns": sum(turns * count for turns, count in self.length_counts.items()) / games,
+            "median_turns": self.get_length_percentile(0.5),
+            "longest_turns": max(self.length_counts, default=0),
+        }
+
+
+# Tests (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    test_stats = GameStats()
+    assert_equal(test_stats.get_summary()["median_turns"], 0)
+    for test_record in [{"scores": [20, -5], "turns": 10, "ending": "hand", "pickups": 2, "pickup_chances": 4,
+                         "pickups_melded": 2, "draws": 8},
+                        {"scores": [0, 15], "turns": 30, "ending": "deck", "pickups": 1, "pickup_chances": 4,
+                         "pickups_melded": 0, "draws": 29},
+                        {"scores": [5, 5], "turns": 12, "ending": "hand", "pickups": 0, "pickup_chances": 0,
+                         "pickups_melded": 0, "draws": 12}]:
+        test_stats.add(test_record)
+    test_summary = test_stats.get_summary()
+    assert_equal(test_summary["wins"], {"player_1": 1, "player_2": 1, "ties": 1})
+    assert_equal(test_summary["endings"], {"deck": 1 / 3, "hand": 2 / 3, "limit": 0.0})
+    assert_equal([test_summary["pickup_rate"], test_summary["pickup_success"]], [0.375, 2 / 3])
+    assert_equal(test_summary["average_margin"], 40 / 3)
+    assert_equal(test_summary["margin_stdev"], 12.583057392117917)
+    assert_equal([test_summary["median_turns"], test_summary["longest_turns"]], [12, 30])
+    assert_equal(test_summary["average_turns"], 52 / 3)
@@ -0,0 +1,306 @@
+"""
+Benchmarks for Gin Rummy's hot paths: the set rules, building each route's Page with realistic
+hands and discard piles, and complete seeded games (both straight through the GameEngine and
+through the routes). Every benchmark is timed several times and the fastest time per call is
+kept, since slower runs are just the computer being busy with something else.
+
+The times are compared with a saved JSON baseline and the run fails if any benchmark got slower
+by more than the threshold. Baselines depend on the machine, so save a new one when switching.
+
+Example:
+    python benchmark.py                  # Compare with benchmark_baseline.json
+    python benchmark.py --save           # Save this run as the new baseline
+    python benchmark.py --filter routes  # Only run the benchmarks with "routes" in their name
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("GIN_RUMMY_PRODUCTION", "1") # Skip the self-tests when importing the game
+from gin_rummy import (Action, Deck, Player, State, card_backing_id, check_standard_suit_set,
+                       confirm_sets, deal_cards, discard, encode_state, game_engine, get_card_coordinates,
+                       get_card_id, get_hand, get_hand_mask, greedy_policy, lay_off, make_set, pick_discard_card,
+                       pick_up_card, play_turn, render_caches, rule_variants, save_game, select_sets, valid_set,
+                       win_conditions)
+import gin_rummy
+from storage import GameDatabase
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+benchmarks = {}
+
+
+def benchmark(name : str):
+    """ Adds a function to the benchmarks. The function sets up whatever it needs and returns
+        the function to be timed, which is called with no arguments.
+    Args:
+        name (str): The name of the benchmark, grouped like "rules/valid_set"
+    """
+    def add_benchmark(setup):
+        benchmarks[name] = setup
+        return setup
+    return add_benchmark
+
+def time_call(function, repeats : int, min_seconds : float) -> float:
+    """ Times a function, calling it enough times in a row for the clock to be accurate
+    Args:
+        function: The function to time
+        repeats (int): How many times to time it
+        min_seconds (float): The shortest each timing should take
+    Returns:
+        float: The fastest time per call, in microseconds
+    """
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for i in range(repeats - 1):
+        start = time.perf_counter()
+        for j in range(calls):
+            function()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best * 1e6
+
+
+def new_state() -> State:
+    """ Returns:
+            State: A game that hasn't been dealt yet
+    """
+    return State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id], "pick", [])
+
+def play_until(seed : int, pile_size : int, phase : str) -> State:
+    """ Plays a seeded greedy game until the discard pile is big enough and it is the given phase
+    Args:
+        seed (int): The game's seed
+        pile_size (int): How many cards the discard pile should have (counting the card backing)
+        phase (str): The phase to stop in
+    Returns:
+        State: The game part way through
+    """
+    state = new_state()
+    game_engine.deal(state, "Player 1", "Player 2", False, seed)
+    rng = random.Random(seed)
+    while not (len(state.discard_pile) >= pile_size and state.current_phase == phase):
+        action = greedy_policy(game_engine, state, rng)
+        if action.kind == "pick" and action.index > 0:
+            action = Action("pick", 0) # Pick from the deck so the discard pile keeps growing
+        game_engine.apply(state, action)
+        if game_engine.is_over(state):
+            raise ValueError("seed " + str(seed) + " ended before the discard pile had " + str(pile_size) + " cards")
+    return state
+
+def play_to_end(seed : int) -> State:
+    """ Plays a seeded greedy game until the deal is over, without scoring it
+    Args:
+        seed (int): The game's seed
+    Returns:
+        State: The game, ready to be scored
+    """
+    state = new_state()
+    game_engine.deal(state, "Player 1", "Player 2", False, seed)
+    rng = random.Random(seed)
+    while not game_engine.is_over(state):
+        game_engine.apply(state, greedy_policy(game_engine, state, rng))
+    return state
+
+def clear_render_caches() -> None:
+    for cache in render_caches:
+        cache.cache_clear()
+
+
+@benchmark("startup/import")
+def bench_import():
+    # A new process each time, the same as a server or simulator worker starting up
+    command = [sys.executable, "-c", "import gin_rummy"]
+    folder = os.path.dirname(os.path.abspath(__file__))
+    return lambda: subprocess.run(command, cwd=folder, check=True, stdout=subprocess.DEVNULL)
+
+@benchmark("rules/get_card_coordinates")
+def bench_get_card_coordinates():
+    hand = [get_card_id(rank, rank % 4) for rank in range(7)]
+    return lambda: get_card_coordinates(hand)
+
+@benchmark("rules/valid_set")
+def bench_valid_set():
+    cards = [get_card_id(3, 1), get_card_id(4, 1), get_card_id(5, 1), get_card_id(6, 1)]
+    return lambda: valid_set(True, cards, 3, 1)
+
+@benchmark("rules/check_standard_suit_set")
+def bench_check_standard_suit_set():
+    hand_mask = get_hand_mask([get_card_id(3, 1), get_card_id(4, 1), get_card_id(5, 1), get_card_id(9, 2),
+                               get_card_id(0, 0), get_card_id(12, 3), get_card_id(7, 1)])
+    return lambda: check_standard_suit_set(False, hand_mask, 4, 1)
+
+@benchmark("rules/win_conditions")
+def bench_win_conditions():
+    state = play_to_end(1)
+    def run():
+        state.finished = False # So every call scores the deal instead of only showing it again
+        return win_conditions(state)
+    if run().content[0] != "Game OVER":
+        raise ValueError("seed 1 didn't give the end-of-deal page")
+    return run
+
+@benchmark("routes/play_turn")
+def bench_play_turn():
+    state = play_until(2, 16, "pick")
+    return lambda: play_turn(state)
+
+@benchmark("routes/play_turn_uncached")
+def bench_play_turn_uncached():
+    state = play_until(2, 16, "pick")
+    def run():
+        clear_render_caches()
+        play_turn(state)
+    return run
+
+@benchmark("routes/make_set")
+def bench_make_set():
+    state = play_until(3, 16, "discard")
+    state.selected_cards = [0, 2]
+    return lambda: make_set(state)
+
+@benchmark("routes/make_set_uncached")
+def bench_make_set_uncached():
+    state = play_until(3, 16, "discard")
+    state.selected_cards = [0, 2]
+    def run():
+        clear_render_caches()
+        make_set(state)
+    return run
+
+@benchmark("routes/pick_discard_card")
+def bench_pick_discard_card():
+    state = play_until(4, 16, "discard")
+    return lambda: pick_discard_card(state)
+
+@benchmark("routes/pick_discard_card_uncached")
+def bench_pick_discard_card_uncached():
+    state = play_until(4, 16, "discard")
+    def run():
+        clear_render_caches()
+        pick_discard_card(state)
+    return run
+
+@benchmark("storage/save_game")
+def bench_save_game():
+    state = play_until(7, 16, "pick")
+    state.game_id = "benchmark"
+    database = GameDatabase(":memory:")
+    def run():
+        gin_rummy.game_database = database # Only while timing, so the other benchmarks don't save their games
+        save_game(state)
+        gin_rummy.game_database = None
+    return run
+
+@benchmark("storage/flush_1000_games")
+def bench_flush():
+    database = GameDatabase(":memory:")
+    state = play_until(7, 16, "pick")
+    snapshot = encode_state(state)
+    def run():
+        for game in range(1000):
+            database.save(str(game), snapshot, state.action_log)
+        database.flush()
+    return run
+
+@benchmark("games/engine_playthrough")
+def bench_engine_playthrough():
+    def run():
+        state = new_state()
+        game_engine.deal(state, "Player 1", "Player 2", False, 5)
+        rng = random.Random(5)
+        while not game_engine.is_over(state):
+            game_engine.apply(state, greedy_policy(game_engine, state, rng))
+        game_engine.score(state)
+    return run
+
+@benchmark("games/engine_playthrough_variants")
+def bench_engine_playthrough_variants():
+    # The same game played once with each variant's rules, so a variant's tables can be compared with the standard ones
+    def run():
+        for rules in rule_variants.values():
+            state = new_state()
+            game_engine.deal(state, "Player 1", "Player 2", False, 5, rules)
+            rng = random.Random(5)
+            while not game_engine.is_over(state):
+                game_engine.apply(state, greedy_policy(game_engine, state, rng))
+            game_engine.score(state)
+    return run
+
+@benchmark("games/route_playthrough")
+def bench_route_playthrough():
+    def run():
+        state = new_state()
+        random.seed(6) # deal_cards picks the game's seed with the random module
+        page = deal_cards(state, "", "Player 1", "Player 2")
+        rng = random.Random(6)
+        while page.content[0] != "Game OVER":
+            state = page.state
+            action = greedy_policy(game_engine, state, rng)
+            if action.kind == "pick":
+                page = pick_up_card(state, action.index)
+            elif action.kind == "meld":
+                for card_index in action.selected:
+                    select_sets(state, card_index, True)
+                page = confirm_sets(state)
+            elif action.kind == "layoff":
+                page = lay_off(state, action.index)
+            else:
+                page = discard(state, action.index)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time Gin Rummy's hot paths and compare them with a baseline.")
+    parser.add_argument("--baseline", default=baseline_path, help="the JSON baseline to compare with or save to")
+    parser.add_argument("--save", action="store_true", help="save this run as the baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="how much slower a benchmark may get before the run fails (0.25 is 25%%)")
+    parser.add_argument("--repeats", type=int, default=5, help="how many times to time each benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="the shortest each timing should take, in seconds")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["microseconds"]
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':36} {'us/call':>12} {'baseline':>12} {'change':>8}")
+    for name, setup in benchmarks.items():
+        if args.filter not in name:
+            continue
+        results[name] = time_call(setup(), args.repeats, args.min_time)
+        line = f"{name:36} {results[name]:12.2f}"
+        if name in baseline:
+            change = results[name] / baseline[name] - 1
+            line += f" {baseline[name]:12.2f} {change:+8.1%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({"python": sys.version.split()[0], "microseconds": results}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Saved the baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) got more than {args.threshold:.0%} slower: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
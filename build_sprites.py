@@ -0,0 +1,31 @@
+"""
+Build step for the card sprite sheet (see sprites.py). Downloads all 52 card faces and the card
+backing, and packs them into cards.png next to gin_rummy.py. The website uses the sheet whenever
+the file is there. Needs Pillow.
+
+Example:
+    python build_sprites.py            # Download the card images
+    python build_sprites.py --offline  # Draw plain cards instead
+"""
+import argparse
+import os
+
+# The self-tests are skipped when importing the game (see production_mode)
+os.environ.setdefault("GIN_RUMMY_PRODUCTION", "1")
+from gin_rummy import card_backing_id, card_names, card_suits, card_urls
+from sprites import build_sprite_sheet, sprite_sheet_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the card images into one sprite sheet.")
+    parser.add_argument("--output", default=sprite_sheet_path, help="where to save the sprite sheet")
+    parser.add_argument("--offline", action="store_true", help="draw every card instead of downloading it")
+    args = parser.parse_args()
+
+    red = [card_suits[card] < 2 for card in range(card_backing_id)]
+    drawn = build_sprite_sheet(card_urls, card_names + [""], red + [False], args.output, not args.offline)
+    print(f"Saved {len(card_urls)} cards to {args.output} ({drawn} drawn instead of downloaded)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Lets a page be patched in place instead of being sent again in full after every click. The
+parts of a page that change on their own (the hand, the discard pile, the counters) are marked
+as regions with Div(..., id="region-<name>"). Every region is sent with a version (a hash of its
+HTML), and the rest of the page (the layout) gets one too. When a button is clicked the browser
+sends back the versions it has, and the server answers with JSON holding only the regions that
+changed. If the layout changed as well, the whole page is sent in the JSON instead. Browsers
+without JavaScript still get normal pages.
+"""
+import hashlib
+import json
+import os
+import re
+
+from bakery import assert_equal
+from bottle import request, response
+from drafter.server import Server
+
+# Regions are never nested and never contain other divs, so the first </div> closes the region
+region_pattern = re.compile(r"<div id='(region-[\w-]+)'>(.*?)</div>", re.DOTALL)
+layout_header = "X-Delta-Layout"
+regions_header = "X-Delta-Regions"
+
+# Sends every click with fetch() and patches the regions that came back
+delta_script = """<script>
+document.addEventListener("submit", function (event) {
+    var form = event.target, button = event.submitter;
+    var layout = document.getElementById("delta-layout");
+    if (!window.fetch || !button || !button.formAction || !layout) {
+        return;
+    }
+    event.preventDefault();
+    var versions = [];
+    document.querySelectorAll("[id^='region-']").forEach(function (region) {
+        versions.push(region.id + "=" + region.dataset.version);
+    });
+    var headers = {"X-Delta-Layout": layout.dataset.version, "X-Delta-Regions": versions.join(",")};
+    fetch(button.formAction, {method: "POST", body: new FormData(form, button), headers: headers})
+        .then(function (reply) {
+            var isJson = (reply.headers.get("Content-Type") || "").indexOf("json") !== -1;
+            return reply.text().then(function (text) {
+                if (!isJson) {
+                    document.open(); document.write(text); document.close();
+                    return;
+                }
+                var delta = JSON.parse(text);
+                if (delta.html !== undefined) {
+                    document.querySelector(".btlw").innerHTML = delta.html;
+                    return;
+                }
+                Object.keys(delta.regions).forEach(function (id) {
+                    var region = document.getElementById(id);
+                    region.innerHTML = delta.regions[id].html;
+                    region.dataset.version = delta.regions[id].version;
+                });
+            });
+        });
+});
+</script>"""
+
+
+def get_version(html : str) -> str:
+    """ Gets a short hash of some HTML so the browser and server can tell if it changed
+    Args:
+        html (str): The HTML
+    Returns:
+        str: The version
+    """
+    return hashlib.blake2b(html.encode(), digest_size=6).hexdigest()
+
+def split_page(content : str) -> tuple[str, dict[str, str]]:
+    """ Takes the regions out of a page
+    Args:
+        content (str): The page's HTML, before Drafter wraps it in the rest of the website
+    Returns:
+        tuple[str, dict[str, str]]: The page with every region emptied out (the layout) and the
+                                    HTML of each region by its id
+    """
+    # Drafter's debug information comes after the form and changes every time, so it is a region too
+    form_end = content.find("</form>")
+    form_end = len(content) if form_end == -1 else form_end + len("</form>")
+    regions = {}
+    def take_region(match):
+        regions[match.group(1)] = match.group(2)
+        return "<div id='" + match.group(1) + "'></div>"
+    layout = region_pattern.sub(take_region, content[:form_end])
+    if content[form_end:]:
+        layout += "<div id='region-debug'></div>"
+        regions["region-debug"] = content[form_end:]
+    return layout, regions
+
+def join_page(layout : str, regions : dict[str, str]) -> str:
+    """ Puts the regions back into the layout, along with their versions
+    Args:
+        layout (str): The page with every region emptied out
+        regions (dict[str, str]): The HTML of each region by its id
+    Returns:
+        str: The page's HTML
+    """
+    content = layout
+    for region_id, html in regions.items():
+        content = content.replace("<div id='" + region_id + "'></div>",
+                                  "<div id='" + region_id + "' data-version='" + get_version(html) + "'>" +
+                                  html + "</div>", 1)
+    return content + "<div id='delta-layout' data-version='" + get_version(layout) + "' hidden></div>"
+
+def get_delta(layout : str, regions : dict[str, str], layout_version : str, region_versions : str) -> dict:
+    """ Works out what the browser needs to bring its page up to date
+    Args:
+        layout (str): The new page with every region emptied out
+        regions (dict[str, str]): The HTML of each region of the new page by its id
+        layout_version (str): The version of the layout the browser has
+        region_versions (str): The versions of the regions the browser has, like "region-hand=abc,..."
+    Returns:
+        dict: Either {"html": the whole page} or {"regions": {id: {"html": ..., "version": ...}}}
+    """
+    if layout_version != get_version(layout):
+        return {"html": join_page(layout, regions)}
+    known = dict(pair.split("=", 1) for pair in region_versions.split(",") if "=" in pair)
+    changed = {}
+    for region_id, html in regions.items():
+        version = get_version(html)
+        if known.get(region_id) != version:
+            changed[region_id] = {"html": html, "version": version}
+    return {"regions": changed}
+
+
+def enable_deltas(server : Server) -> None:
+    """ Makes a Drafter server send only the changed regions of a page when the browser asks for it.
+        Must be called before the server is started.
+    Args:
+        server (Server): The Drafter server
+    """
+    wrap_page = server.wrap_page
+    def wrap_delta_page(content):
+        layout, regions = split_page(content)
+        layout_version = request.get_header(layout_header)
+        if layout_version is None:
+            return wrap_page(join_page(layout, regions))
+        response.content_type = "application/json"
+        return json.dumps(get_delta(layout, regions, layout_version, request.get_header(regions_header, "")))
+    server.wrap_page = wrap_delta_page
+    server.configuration.additional_header_content.append(delta_script)
+
+
+
+# Tests (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    test_page = "<form><p>Hand</p><div id='region-hand'><table></table></div></form><div>Debug</div>"
+    test_layout, test_regions = split_page(test_page)
+    assert_equal(test_layout, "<form><p>Hand</p><div id='region-hand'></div></form><div id='region-debug'></div>")
+    assert_equal(test_regions, {"region-hand": "<table></table>", "region-debug": "<div>Debug</div>"})
+    assert_equal(join_page(test_layout, test_regions).startswith(
+        "<form><p>Hand</p><div id='region-hand' data-version='" + get_version("<table></table>") + "'><table></table>"), True)
+    # Only the debug region changed since the browser's copy
+    assert_equal(get_delta(test_layout, test_regions, get_version(test_layout),
+                           "region-hand=" + get_version("<table></table>")),
+                 {"regions": {"region-debug": {"html": "<div>Debug</div>", "version": get_version("<div>Debug</div>")}}})
+    # The layout changed, so the whole page is sent
+    assert_equal(get_delta(test_layout, test_regions, "old", ""), {"html": join_page(test_layout, test_regions)})
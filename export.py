@@ -0,0 +1,346 @@
+"""
+Exports finished games for analysis, one game at a time, so there is never more than one chunk
+of games in memory however many there are. Games are read from the game database a batch at a
+time (or played by bots on the spot), turned into records (the seed, the variant, the action log,
+the final hands and sets, the scores, and a few counts worked out by replaying the log), and
+written to numbered chunk files: JSON lines, or columnar numpy arrays (.npz) where the lists
+that differ in length from game to game are stored flat with an array of where each one ends.
+Every record also goes through a GameStats (see analytics.py) on the way, so the summary comes
+for free. Exported chunks can be summarized again later without playing or loading any games.
+
+Examples:
+    python export.py --database games.db --output exports            # Every finished saved game as JSON lines
+    python export.py --play 100000 --rules "Ten cards" --format columns --output exports
+    python export.py --summarize exports                               # Summary of games exported earlier
+"""
+import argparse
+import json
+import os
+import time
+
+# The self-tests are skipped when importing the game (see production_mode)
+os.environ.setdefault("GIN_RUMMY_PRODUCTION", "1")
+from analytics import GameStats, endings
+from gin_rummy import (Deck, Player, State, card_backing_id, decode_action, decode_state, game_engine, get_hand,
+                       rule_variant_names, rule_variants)
+from simulate import play_game_state, policies
+from storage import GameDatabase
+try:
+    import numpy     # Only needed for columnar files
+except ImportError:
+    numpy = None
+
+# The arrays in each columnar chunk. Each list column (like "hands") is every game's lists one after
+# another, and its "_offsets" array holds where each list ends, starting with a 0. Hands, laid-off
+# cards and set counts have one entry per player, so the second player of game i is entry 2 * i + 1.
+column_types = {"seed": "int64", "variant": "uint8", "auto_meld": "bool", "scores": "int32", "turns": "int32",
+                "ending": "uint8", "pickups": "int32", "pickup_chances": "int32", "pickups_melded": "int32",
+                "draws": "int32",
+                "action_log": "int64", "action_log_offsets": "int64", "hands": "uint8", "hands_offsets": "int64",
+                "laid_off": "uint8", "laid_off_offsets": "int64", "sets": "uint8", "sets_offsets": "int64",
+                "set_counts": "int32"}
+# The columns with one number per game, which are all a GameStats needs
+summary_columns = ("scores", "turns", "ending", "pickups", "pickup_chances", "pickups_melded", "draws")
+
+
+def iter_saved_games(database : GameDatabase, batch_size : int = 500):
+    """ Reads the finished games in a game database, scoring the ones that weren't scored yet
+    Args:
+        database (GameDatabase): The game database
+        batch_size (int): How many games are read from the database at a time
+    Yields:
+        State: Each finished game, in order of game id. Games still being played are skipped.
+    """
+    for game_id, snapshot, action_log in database.iter_games(batch_size):
+        state = decode_state(snapshot)
+        if not game_engine.is_over(state):
+            continue
+        if not state.finished:
+            game_engine.score(state)
+        yield state
+
+def iter_played_games(games : int, seed : int = 0, policy_names : tuple[str, str] = ("greedy", "greedy"),
+                      auto_meld : bool = False, variant : str = "Standard"):
+    """ Plays games between bots one at a time (see simulate.py)
+    Args:
+        games (int): How many games to play
+        seed (int): The seed of the first game
+        policy_names (tuple[str, str]): The strategy for Player 1 and for Player 2
+        auto_meld (bool): Whether to score the leftover cards in each hand as the best sets possible
+        variant (str): The name of the rules to play with
+    Yields:
+        State: Each scored game, including games that were called off
+    """
+    for game_seed in range(seed, seed + games):
+        state, turns = play_game_state(game_seed, policy_names, auto_meld, variant)
+        game_engine.score(state)
+        yield state
+
+def get_game_record(state : State) -> dict:
+    """ Describes a scored game as a record that can be written as JSON. The log is replayed from
+        the seed to count how often each player could have picked up from the discard pile, and
+        how often the card they picked up went into a set that same turn.
+    Args:
+        state (State): The game, which is not changed
+    Returns:
+        dict: The game's seed, variant, auto-meld setting, action log, final hands, sets, laid-off
+              cards and scores, along with its number of turns, how it ended, and how many turns
+              picked up from the discard pile, could have, made a set with the card picked up,
+              and drew from the deck instead
+    """
+    replay_state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False,
+                         [card_backing_id], "pick", [])
+    game_engine.deal(replay_state, "", "", state.auto_meld, state.seed, state.rules)
+    turns = pickups = pickup_chances = pickups_melded = draws = 0
+    picked_card = None # The card picked up from the discard pile this turn, until it goes into a set
+    for code in state.action_log:
+        action = decode_action(code)
+        if action.kind == "pick":
+            pickup_chances += replay_state.pickup_index != 0
+            pickups += action.index > 0
+            draws += action.index == 0
+            picked_card = replay_state.discard_pile[action.index] if action.index > 0 else None
+        elif action.kind == "meld":
+            if picked_card is not None and picked_card in [get_hand(replay_state)[card_index]
+                                                           for card_index in action.selected]:
+                pickups_melded += 1
+                picked_card = None
+        elif action.kind == "discard":
+            turns += 1
+        game_engine.apply(replay_state, action)
+    if not game_engine.is_over(state):
+        ending = "limit"
+    elif state.deck.remaining() <= state.rules.end_deck_size:
+        ending = "deck"
+    else:
+        ending = "hand"
+    return {
+        "seed": state.seed,
+        "variant": state.rules.name,
+        "auto_meld": state.auto_meld,
+        "action_log": state.action_log,
+        "hands": [player.hand for player in state.players],
+        "sets": [player.sets for player in state.players],
+        "laid_off": [player.laid_off for player in state.players],
+        "scores": [player.points for player in state.players],
+        "turns": turns,
+        "ending": ending,
+        "pickups": pickups,
+        "pickup_chances": pickup_chances,
+        "pickups_melded": pickups_melded,
+        "draws": draws,
+    }
+
+def add_to_stats(records, stats : GameStats):
+    """ Passes records along unchanged, adding each one to a GameStats on the way
+    Args:
+        records: The game records
+        stats (GameStats): The statistics to update
+    Yields:
+        dict: Each record
+    """
+    for record in records:
+        stats.add(record)
+        yield record
+
+
+def get_chunk_path(directory : str, chunk : int, extension : str) -> str:
+    """ Args:
+            directory (str): Where the chunks are written
+            chunk (int): The chunk's number
+            extension (str): The file extension, like ".jsonl"
+        Returns:
+            str: The chunk's file name. The numbers are padded so the files sort in order.
+    """
+    return os.path.join(directory, "games-" + format(chunk, "05d") + extension)
+
+def write_jsonl_chunks(records, directory : str, chunk_size : int = 100000):
+    """ Writes records as JSON lines, starting a new file every chunk_size records. Each file is
+        written under a temporary name and renamed when it is done, so a chunk file is never half written.
+    Args:
+        records: The game records, which can be a generator
+        directory (str): Where to write the chunks, made if it doesn't exist
+        chunk_size (int): How many records go in each file
+    Yields:
+        str: The path of each chunk once it is written
+    """
+    os.makedirs(directory, exist_ok=True)
+    output = None
+    chunk = written = 0
+    try:
+        for record in records:
+            if output is None:
+                path = get_chunk_path(directory, chunk, ".jsonl")
+                output = open(path + ".partial", "w")
+            output.write(json.dumps(record, separators=(",", ":")) + "\n")
+            written += 1
+            if written == chunk_size:
+                output.close()
+                os.replace(path + ".partial", path)
+                yield path
+                output = None
+                chunk += 1
+                written = 0
+        if output is not None:
+            output.close()
+            os.replace(path + ".partial", path)
+            yield path
+    finally:
+        if output is not None and not output.closed:
+            output.close()
+
+def new_columns() -> dict[str, list]:
+    """ Returns:
+            dict[str, list]: An empty list for every column, with the offsets starting at 0
+    """
+    return {name: [0] if name.endswith("_offsets") else [] for name in column_types}
+
+def add_record_columns(columns : dict[str, list], record : dict) -> None:
+    """ Adds one record to the end of each column
+    Args:
+        columns (dict[str, list]): The columns of the chunk being built
+        record (dict): The game record
+    """
+    for name in ("seed", "auto_meld", "scores", "turns", "pickups", "pickup_chances", "pickups_melded", "draws"):
+        columns[name].append(record[name])
+    columns["variant"].append(rule_variant_names.index(record["variant"]))
+    columns["ending"].append(endings.index(record["ending"]))
+    columns["action_log"].extend(record["action_log"])
+    columns["action_log_offsets"].append(len(columns["action_log"]))
+    for player_index in range(2):
+        for name in ("hands", "laid_off"):
+            columns[name].extend(record[name][player_index])
+            columns[name + "_offsets"].append(len(columns[name]))
+        columns["set_counts"].append(len(record["sets"][player_index]))
+        for card_set in record["sets"][player_index]:
+            columns["sets"].extend(card_set)
+            columns["sets_offsets"].append(len(columns["sets"]))
+
+def write_column_chunks(records, directory : str, chunk_size : int = 100000):
+    """ Writes records as compressed numpy arrays (see column_types), one .npz file per chunk_size
+        records. Only the chunk being built is kept in memory.
+    Args:
+        records: The game records, which can be a generator
+        directory (str): Where to write the chunks, made if it doesn't exist
+        chunk_size (int): How many records go in each file
+    Yields:
+        str: The path of each chunk once it is written
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = new_columns()
+    chunk = written = 0
+    for record in records:
+        add_record_columns(columns, record)
+        written += 1
+        if written == chunk_size:
+            yield write_column_chunk(columns, get_chunk_path(directory, chunk, ".npz"))
+            columns = new_columns()
+            chunk += 1
+            written = 0
+    if written:
+        yield write_column_chunk(columns, get_chunk_path(directory, chunk, ".npz"))
+
+def write_column_chunk(columns : dict[str, list], path : str) -> str:
+    """ Writes one chunk of columns as a .npz file, under a temporary name until it is done
+    Args:
+        columns (dict[str, list]): The columns
+        path (str): Where to write them
+    Returns:
+        str: The path
+    """
+    with open(path + ".partial", "wb") as output:
+        numpy.savez_compressed(output, **{name: numpy.asarray(values, dtype=column_types[name])
+                                          for name, values in columns.items()})
+    os.replace(path + ".partial", path)
+    return path
+
+def read_chunks(directory : str):
+    """ Reads back the chunks written by write_jsonl_chunks or write_column_chunks, one file at a time
+    Args:
+        directory (str): Where the chunks are
+    Yields:
+        dict: Each game record. Records from columnar chunks only have the summary_columns.
+    """
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".jsonl"):
+            with open(path) as chunk:
+                for line in chunk:
+                    yield json.loads(line)
+        elif name.endswith(".npz"):
+            if numpy is None:
+                raise ValueError("Reading " + path + " needs numpy")
+            with numpy.load(path) as chunk:
+                columns = [chunk[column].tolist() for column in summary_columns]
+            for values in zip(*columns):
+                record = dict(zip(summary_columns, values))
+                record["ending"] = endings[record["ending"]]
+                yield record
+
+
+def print_summary(summary : dict) -> None:
+    """ Prints the statistics from GameStats.get_summary
+    Args:
+        summary (dict): The statistics
+    """
+    games = summary["games"]
+    wins = summary["wins"]
+    print(f"{games} games: Player 1 won {wins['player_1']}, Player 2 won {wins['player_2']}, {wins['ties']} ties")
+    print(f"Average margin {summary['average_margin']:.1f} points (standard deviation {summary['margin_stdev']:.1f})")
+    print(f"Length: average {summary['average_turns']:.1f} turns, median {summary['median_turns']}, "
+          f"longest {summary['longest_turns']}")
+    print(f"Discard pile pickups: {summary['pickups_per_game']:.2f} per game, taken on {summary['pickup_rate']:.1%} "
+          f"of the turns one was allowed, and {summary['pickup_success']:.1%} made a set that turn "
+          f"({summary['draws_per_game']:.2f} draws from the deck per game)")
+    endings_seen = summary["endings"]
+    print(f"Endings: {endings_seen['deck']:.1%} deck depleted, {endings_seen['hand']:.1%} empty hand, "
+          f"{endings_seen['limit']:.1%} turn limit")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export finished Gin Rummy games and summarize them.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--database", help="export the finished games in this game database")
+    source.add_argument("--play", type=int, help="export this many games played by bots")
+    source.add_argument("--summarize", help="summarize the chunks exported to this directory earlier")
+    parser.add_argument("--output", default="exports", help="the directory to write the chunks to")
+    parser.add_argument("--format", default="jsonl", choices=["jsonl", "columns"],
+                        help="JSON lines, or columnar numpy arrays (needs numpy)")
+    parser.add_argument("--chunk", type=int, default=100000, help="how many games go in each file")
+    parser.add_argument("--batch", type=int, default=500, help="how many games are read from the database at a time")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the first game (with --play)")
+    parser.add_argument("--policies", nargs=2, default=["greedy", "greedy"], choices=sorted(policies),
+                        help="the strategies for Player 1 and Player 2 (with --play)")
+    parser.add_argument("--auto-meld", action="store_true", help="use auto-meld scoring (with --play)")
+    parser.add_argument("--rules", default="Standard", choices=list(rule_variants), help="the variant to play (with --play)")
+    args = parser.parse_args()
+    if numpy is None and args.format == "columns":
+        parser.error("columnar files need numpy")
+    if args.database and not os.path.exists(args.database):
+        parser.error("there is no game database at " + args.database)
+
+    stats = GameStats()
+    start = time.perf_counter()
+    if args.summarize:
+        for record in read_chunks(args.summarize):
+            stats.add(record)
+    else:
+        database = None
+        if args.database:
+            database = GameDatabase(args.database)
+            games = iter_saved_games(database, args.batch)
+        else:
+            games = iter_played_games(args.play, args.seed, tuple(args.policies), args.auto_meld, args.rules)
+        records = add_to_stats((get_game_record(state) for state in games), stats)
+        write_chunks = write_column_chunks if args.format == "columns" else write_jsonl_chunks
+        for path in write_chunks(records, args.output, args.chunk):
+            print("Wrote " + path)
+        if database is not None:
+            database.close()
+    elapsed = time.perf_counter() - start
+    print(f"Went through {stats.games} games in {elapsed:.2f}s ({stats.games / max(elapsed, 1e-9):.0f} games/second)")
+    print_summary(stats.get_summary())
+
+
+if __name__ == "__main__":
+    main()
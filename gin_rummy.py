@@ -2,16 +2,37 @@
 2-Player card game Gin Rummy. Not the official rules, but essentially the way I've
 played. This project certainly took a lot of effort, but I am glad to have made
 something more unique and replayable. I want to add more features in the future that
-are left out for now, such as the ability to play off of the other player's sets and
-the ability to add to your existing sets, but it is definitely playable in its
-current state.  As for the code, I've tried to use as many functions as necessary
+are left out for now, such as knocking before your hand is empty, but it is definitely
+playable in its current state.  As for the code, I've tried to use as many functions as necessary
 to make it more understandable. Almost all functions can be unit tested, but most
 of the routes cannot since they all rely on the deck being shuffled. 
 """    
+import time
+import_started = time.perf_counter() # To report how long importing and starting up took
 from drafter import *
 from bakery import assert_equal
-from dataclasses import dataclass
+import bisect
+from dataclasses import dataclass, field
+import functools
+import json
+import math
+import os
 import random
+import secrets
+from deltas import enable_deltas
+from metrics import Counter, Gauge, Histogram, enable_metrics
+from ratings import Leaderboard
+from sessions import SessionStore, enable_sessions, get_deep_size
+from sprites import enable_sprite_sheet, get_sprite_html, sprite_sheet_path
+from storage import GameDatabase
+try:
+    import numpy     # Only used to score many games at once, and isn't available in the browser
+except ImportError:
+    numpy = None
+
+# Production mode (GIN_RUMMY_PRODUCTION=1) skips the self-tests at the bottom of this file and in the
+# helper modules, so that server and simulator processes start quickly
+production_mode = bool(os.environ.get("GIN_RUMMY_PRODUCTION"))
 
 # The unshuffled deck below follows this format for reference 
 """
@@ -87,102 +108,532 @@ deck = [  ['https://tinyurl.com/26navyx5',
           'https://tinyurl.com/223o6ukn',
           'https://tinyurl.com/27m74ys7']]
 
+# Cards are stored everywhere as small integer ids instead of their URLs. A card's id is
+# rank * 4 + suit, which is the same order as the unshuffled deck above, so the Ace of Hearts
+# is 0 and the King of Spades is 51. The id 52 is saved for the card backing, which sits at the
+# front of the discard pile to stand in for the deck. The URLs are only looked up when a card
+# is drawn on screen. These tables are also NOT GLOBAL VARIABLES; they are built once and only read.
+# Building all of them takes well under a tenth of a millisecond, so they are built on import.
+card_backing_id = 52
+card_urls = [url for row in deck for url in row] + [card_backing]  # id -> URL
+card_ids = {url: card_id for card_id, url in enumerate(card_urls)} # URL -> id
+card_ranks = [card_id // 4 for card_id in range(52)]               # id -> rank
+card_suits = [card_id % 4 for card_id in range(52)]                # id -> suit
+card_names = [rank + suit for rank in "A23456789TJQK" for suit in "HDCS"] # id -> name, like "QH"
+card_images = [Image(url, 82, 140) for url in card_urls]          # id -> what the page shows
+
+
+def get_card_id(rank: int, suit: int) -> int:
+    """ Gets the id of the card with the given rank and suit
+    Args:
+        rank (int): The rank of the card (its row in the unshuffled deck)
+        suit (int): The suit of the card (its column in the unshuffled deck)
+    Returns:
+        int: The id of the card
+    """
+    return rank * 4 + suit
+
+def next_random(rng_state: int) -> tuple[int, int]:
+    """ A small random number generator (SplitMix64) whose whole state is one int, so that
+        it can be stored in the State like everything else.
+    Args:
+        rng_state (int): The current state of the generator
+    Returns:
+        tuple[int, int]: The next state of the generator and a random 64-bit number
+    """
+    rng_state = (rng_state + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    random_bits = ((rng_state ^ (rng_state >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    random_bits = ((random_bits ^ (random_bits >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return rng_state, random_bits ^ (random_bits >> 31)
+
+@dataclass
+class Deck:
+    """ Dataclass for the face-down deck. The deck is shuffled as it is drawn from: each draw
+        swaps a random card that hasn't been drawn yet into the top spot (one step of a
+        Fisher-Yates shuffle), so drawing is O(1) and cards that are never drawn are never shuffled.
+    """
+    cards : list[int]   # The ids of every card. The ones before 'top' have already been drawn
+    top : int           # How many cards have been drawn
+    rng_state : int     # The state of the deck's own random number generator (see next_random)
+    
+    def draw(self) -> int:
+        """ Draws the top card of the deck
+        Returns:
+            int: The id of the card
+        """
+        self.rng_state, random_bits = next_random(self.rng_state)
+        swap_index = self.top + (random_bits * (len(self.cards) - self.top) >> 64)
+        card = self.cards[swap_index]
+        self.cards[swap_index] = self.cards[self.top]
+        self.cards[self.top] = card
+        self.top += 1
+        return card
+    
+    def remaining(self) -> int:
+        """ Gets how many cards are left in the deck
+        Returns:
+            int: The number of cards that haven't been drawn
+        """
+        return len(self.cards) - self.top
+    
+    def __len__(self) -> int:
+        return self.remaining()
 
-def shuffle_deck(deck: list[list[str]]) -> list[str]:
-    """ Shuffles the deck of cards.
-        Cannot make unit test since the deck will be randomized.
+def shuffle_deck(deck: list[list[str]], seed: int) -> Deck:
+    """ Gets a new deck of cards that is shuffled as it is drawn from, using a game's own seed,
+        so the same seed always gives the same cards in the same order.
     Args:
         deck (list[list[str]]): The 2D list of cards
+        seed (int): The game's seed
     Returns:
-        list[str]: A single list of all cards shuffled
+        Deck: A deck of the ids of all cards
     """
     new_deck = []
     for row in deck:
         for card in row:
-            new_deck.append(card)
-    random.shuffle(new_deck)
-    return new_deck
+            new_deck.append(card_ids[card])
+    return Deck(new_deck, 0, seed & 0xFFFFFFFFFFFFFFFF)
 
-def display_sets(sets: list[list[str]]) -> Table:
+def display_sets(sets: list[list[int]]) -> Table:
     """ Converts a 2D list of cards (sets) to be displayed as a 1-row table
     Args:
-        sets (list[list[str]]): The 2D list of sets of cards
+        sets (list[list[int]]): The 2D list of sets of card ids
     Returns:
         Table: The 1-row table to be displayed on screen
     """
-    set_images = []
-    for y, set in enumerate(sets):
-        set_images.append([])
-        for url in set:
-            set_images[y].append(Image(url, 82, 140))
-    return Table(set_images)
+    cards_rendered.inc(sum(len(set) for set in sets))
+    return render_sets(tuple(tuple(set) for set in sets))
     
-def format_cards(urls: list[str]) -> list[list[str]]:
+def format_cards(cards: list[int]) -> list[list[str]]:
     """ Gets a list of cards ready to be displayed with their respective buttons
         by converting a list of cards into a 2D list with the first row being
         the Images of the card's urls.
     Args:
-        urls (list[str]): The list of cards as urls of their PNGs
+        cards (list[int]): The list of card ids
     Returns:
         list[list[str]]: The 2D list of Images be returned
     """
-    cards = [[],[]]
-    for url in urls:
-        cards[0].append(Image(url, 82, 140))
-    return cards
-def display_cards(urls: list[str]) -> Table:
+    images = [[],[]]
+    for card in cards:
+        images[0].append(card_images[card])
+    return images
+def display_cards(cards: list[int]) -> Table:
     """ Displays all cards in a list in Drafter
     Args:
-        urls (list[str]): The list of URLs of the images of the cards
+        cards (list[int]): The list of card ids
     Returns:
         Table: A 1-row Table of cards to be displayed in drafter
     """
-    cards = format_cards(urls)
-    return Table(cards)
+    cards_rendered.inc(len(cards))
+    return render_cards(tuple(cards))
+
+# Counted for /metrics (see metrics.py). The histogram gets how many cards each request drew.
+cards_rendered = Counter("gin_rummy_cards_rendered_total", "How many cards have been drawn on pages")
+cards_per_page = Histogram("gin_rummy_cards_per_page", "How many cards each page drew",
+                           (5, 10, 15, 20, 25, 30, 40, 50), counted=cards_rendered)
+
+def region(name : str, content) -> Div:
+    """ Marks part of a page that can be sent to the browser on its own when it changes (see deltas.py)
+    Args:
+        name (str): The name of the region, which must be unique on the page
+        content: The Table or text in the region
+    Returns:
+        Div: The region
+    """
+    return Div(content, id="region-" + name)
+
+# The same hands and discard piles are shown over and over, so the Tables are cached by the
+# cards (and buttons) they show. A Table turns its cells into HTML as soon as it is made,
+# so the same Table can safely be put on any number of pages.
+render_cache_size = 4096
+
+@functools.lru_cache(maxsize=render_cache_size)
+def render_sets(sets : tuple[tuple[int, ...], ...]) -> Table:
+    """ Makes the Table for display_sets
+    Args:
+        sets (tuple[tuple[int, ...], ...]): The sets of card ids
+    Returns:
+        Table: The 1-row table to be displayed on screen
+    """
+    set_images = []
+    for y, set in enumerate(sets):
+        set_images.append([])
+        for card in set:
+            set_images[y].append(card_images[card])
+    return Table(set_images)
+
+@functools.lru_cache(maxsize=render_cache_size)
+def render_cards(cards : tuple[int, ...]) -> Table:
+    """ Makes the Table for display_cards
+    Args:
+        cards (tuple[int, ...]): The card ids
+    Returns:
+        Table: A 1-row Table of cards to be displayed in drafter
+    """
+    return Table(format_cards(cards))
+
+@functools.lru_cache(maxsize=render_cache_size)
+def render_pick_buttons(cards : tuple[int, ...], route : str, legal : int) -> Table:
+    """ Makes the Table for display_pick_buttons
+    Args:
+        cards (tuple[int, ...]): The card ids
+        route (str): The route that is attached to the buttons
+        legal (int): A bitmask of the indexes that get a button
+    Returns:
+        Table: A 2-row table of cards and buttons
+    """
+    cards_and_buttons = format_cards(cards)
+    for card_index in range(len(cards)):
+        if legal >> card_index & 1:
+            cards_and_buttons[1].append(Button("Pick"+str(card_index), route,
+                                              [Argument("card_index", card_index)]))
+        else:
+            cards_and_buttons[1].append("")
+    return Table(cards_and_buttons)
+
+@functools.lru_cache(maxsize=render_cache_size)
+def render_select_buttons(cards : tuple[int, ...], selected_cards : frozenset[int]) -> Table:
+    """ Makes the Table for display_select_buttons
+    Args:
+        cards (tuple[int, ...]): The card ids in the player's hand
+        selected_cards (frozenset[int]): The indexes of the cards that are selected
+    Returns:
+        Table: A 2-row table of cards and buttons
+    """
+    cards_and_buttons = format_cards(cards)
+    for card_index in range(len(cards)):
+        if card_index in selected_cards:
+            cards_and_buttons[1].append(Button("Unselect"+str(card_index), "/select_sets",
+                                [Argument("card_index", card_index), Argument("selected", False)]))
+        else:
+            cards_and_buttons[1].append(Button("Select"+str(card_index), "/select_sets",
+                                [Argument("card_index", card_index), Argument("selected", True)]))
+    return Table(cards_and_buttons)
+
+render_caches = [render_sets, render_cards, render_pick_buttons, render_select_buttons]
+
+def get_render_cache_info() -> tuple[int, int, int]:
+    """ Adds up how well the render caches are doing
+    Returns:
+        tuple[int, int, int]: The number of hits, misses, and Tables currently cached
+    """
+    hits = misses = size = 0
+    for cache in render_caches:
+        info = cache.cache_info()
+        hits += info.hits
+        misses += info.misses
+        size += info.currsize
+    return hits, misses, size
+
+def use_sprite_sheet(server : Server) -> None:
+    """ Shows every card from the local sprite sheet made by build_sprites.py instead of from its
+        remote image. Must be called before the server is started.
+    Args:
+        server (Server): The Drafter server
+    """
+    enable_sprite_sheet(server)
+    card_images[:] = [get_sprite_html(card) for card in range(len(card_urls))]
+    for cache in render_caches:
+        cache.cache_clear()
+
+#  ---------------------- RULE VARIANT FUNCTIONS --------------------------
+
+# Sets are checked with "bitboards". A hand is stored as one int made up of four 13-bit
+# suit masks, so the card with a given rank and suit is bit (suit * 13 + rank). Suit sets
+# (runs) are then found by shifting a suit's mask and ANDing it with itself, and rank sets
+# are found by counting how many of the four suit masks have the rank's bit set.
+suit_mask = 0b1111111111111                                  # The 13 bits of one suit
+rank_column = 1 | 1 << 13 | 1 << 26 | 1 << 39                # The Ace bit of every suit
+card_bits = [1 << (card_suits[card] * 13 + card_ranks[card]) for card in range(52)] # id -> bit
+bit_cards = [get_card_id(bit % 13, bit // 13) for bit in range(52)]                 # bit -> id
+
+# Everything that changes between variants of the game is in a Rules object. A variant's rules are
+# compiled once into tables of bitboards and points, and the functions that check sets and score
+# hands only ever read the tables they are given. So playing a variant doesn't add any ifs to a move.
+# Compiling is cheap (about 25 microseconds a variant) and done when this file is imported. Only
+# the tables of every possible set are built the first time they are needed, since they cost far more.
+
+@dataclass(frozen=True)
+class Rules:
+    """ Dataclass for the rules that can be changed to play a variant of the game """
+    hand_size : int = 7             # How many cards each player is dealt
+    min_set_size : int = 3          # The fewest cards in a rank set or suit set
+    ace_low : bool = True           # Whether an Ace can start a suit set (A-2-3)
+    ace_high : bool = False         # Whether an Ace can end a suit set (Q-K-A)
+    rank_points : tuple[int, ...] = (5, 5, 5, 5, 5, 5, 5, 5, 5, 10, 10, 10, 10) # Each rank's points, Ace to King
+    end_deck_size : int = 0         # The game ends when the deck has this many cards left
+    going_out_bonus : int = 0       # Extra points for the player who ends the game by emptying their hand
+    layoffs : bool = True           # Whether cards can be laid off on the sets already on the table
+
+
+class CompiledRules:
+    """ A variant's rules along with the tables that the set and scoring functions read """
+
+    def __init__(self, name : str, rules : Rules):
+        """
+        Args:
+            name (str): The variant's name
+            rules (Rules): The rules
+        Raises:
+            ValueError: If the rules can't be played, such as hands too big for the deck
+        """
+        size = rules.min_set_size
+        if not 3 <= size <= 13 or len(rules.rank_points) != 13 or rules.hand_size < 1 or \
+           rules.end_deck_size < 0 or 2 * rules.hand_size + 1 + rules.end_deck_size >= 52:
+            raise ValueError("The rules of " + repr(name) + " can't be played: " + repr(rules))
+        self.name = name
+        self.rules = rules
+        self.hand_size = rules.hand_size
+        self.set_size = size
+        self.end_deck_size = rules.end_deck_size
+        self.going_out_bonus = rules.going_out_bonus
+        self.layoffs = rules.layoffs
+        
+        # Points: card id -> points (the card backing is worth 0), and the bitboard of the cards worth each amount
+        self.card_points = [rules.rank_points[card_ranks[card]] for card in range(52)] + [0]
+        if numpy is not None:
+            self.card_point_table = numpy.array(self.card_points, dtype=numpy.int32)
+        point_masks = {}
+        for rank, points in enumerate(rules.rank_points):
+            point_masks[points] = point_masks.get(points, 0) | rank_column << rank
+        self.point_masks = list(point_masks.items())
+        
+        # Suit sets: the ranks an Ace-low run can use, and the bits of every suit that a run of exactly
+        # the smallest size (or one card shorter) can start at. Ace-high runs are listed one by one, as
+        # bitboards of the Ace and the top ranks, since in a bitboard the Ace is below the 2 rather than
+        # above the King. The windows are the Ace-high runs of exactly the smallest size.
+        first_rank = 0 if rules.ace_low else 1
+        self.low_run_ranks = suit_mask if rules.ace_low else suit_mask & ~1
+        self.run_start_bits = sum(rank_column << rank for rank in range(first_rank, 14 - size))
+        self.run_shifts = tuple(range(1, size))         # The bits of a run after its lowest one
+        self.short_run_start_bits = sum(rank_column << rank for rank in range(first_rank, 15 - size))
+        self.short_run_shifts = tuple(range(1, size - 1))
+        self.short_run_bits = (1 << (size - 1)) - 1     # A run one card short of the smallest set
+        self.completing_shifts = [(missing, tuple(shift for shift in range(size) if shift != missing))
+                                  for missing in range(size)]
+        high_runs = []
+        if rules.ace_high:
+            for length in range(size, 13 if rules.ace_low else 14): # Every card of a suit is already an Ace-low run
+                high_runs.append(1 | ((1 << (length - 1)) - 1) << (14 - length))
+        self.high_runs = [high_run << (suit * 13) for suit in range(4) for high_run in high_runs]
+        self.high_windows = [high_runs[0] << (suit * 13) for suit in range(4)] if high_runs else []
+        
+        # Rank sets: how many suits a rank needs to be in for a set, or to be one card short of one.
+        # There are only 4 suits, so 5 means a rank set can never be made (see get_rank_counts).
+        self.rank_set_size = min(size, 5)
+        self.completing_rank_count = min(size - 1, 5)
+
+    @functools.cached_property
+    def melds_by_lowest_bit(self) -> list[list[int]]:
+        """ Every set that can be made from the whole deck, grouped by the lowest card (bit) in the
+            set. Built the first time it is needed instead of when the rules are compiled.
+        Returns:
+            list[list[int]]: The bitboards of the sets, indexed by the bit of their lowest card
+        """
+        melds_by_lowest_bit = [[] for bit in range(52)]
+        for meld_mask in enumerate_meld_masks((1 << 52) - 1, self):
+            melds_by_lowest_bit[(meld_mask & -meld_mask).bit_length() - 1].append(meld_mask)
+        return melds_by_lowest_bit
+
+    @functools.cached_property
+    def set_masks(self) -> frozenset[int]:
+        """ Every set that can be made from the whole deck, so checking selected cards is one lookup
+        Returns:
+            frozenset[int]: The bitboards of the sets
+        """
+        return frozenset(enumerate_meld_masks((1 << 52) - 1, self))
+
+    def __repr__(self) -> str:
+        return "CompiledRules(" + repr(self.name) + ", " + repr(self.rules) + ")"
+
+
+standard_rules = CompiledRules("Standard", Rules())
+
+# The variants that can be picked on the main page. Saved games store their variant's place in
+# this list, so new variants go at the end.
+rule_variants = {
+    "Standard": standard_rules,
+    "Aces high or low": CompiledRules("Aces high or low", Rules(ace_high=True)),
+    "Ten cards": CompiledRules("Ten cards", Rules(hand_size=10, rank_points=(1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10),
+                                                  end_deck_size=2, going_out_bonus=25)),
+    "Sets of four": CompiledRules("Sets of four", Rules(min_set_size=4)),
+    "No lay-offs": CompiledRules("No lay-offs", Rules(layoffs=False)),
+}
+rule_variant_names = list(rule_variants)
+
+# --------------------- END OF RULE VARIANT FUNCTIONS -----------------------
+
+@dataclass
+class MeldTracker:
+    """ Keeps a copy of a player's hand as a bitboard (see the RULE VARIANT FUNCTIONS), updated one
+        card at a time, so questions about the sets in the hand take a few bit operations instead
+        of a pass over the hand.
+    """
+    hand_mask : int = 0
+
+    def add(self, card : int) -> None:
+        """ Adds a card that went into the hand
+        Args:
+            card (int): The card id
+        """
+        self.hand_mask |= card_bits[card]
+
+    def remove(self, card : int) -> None:
+        """ Removes a card that left the hand
+        Args:
+            card (int): The card id
+        """
+        self.hand_mask &= ~card_bits[card]
+
+    def get_members_mask(self, rules : CompiledRules = standard_rules) -> int:
+        """ Args:
+                rules (CompiledRules): The rules being played
+            Returns:
+                int: The bitboard of the hand's cards that are part of some set
+        """
+        return get_meld_members_mask(self.hand_mask, rules)
+
+    def get_completing_mask(self, rules : CompiledRules = standard_rules) -> int:
+        """ Args:
+                rules (CompiledRules): The rules being played
+            Returns:
+                int: The bitboard of the cards not in the hand that would make a new set with it
+        """
+        return get_completing_mask(self.hand_mask, rules)
+
+    def get_completing_cards(self, rules : CompiledRules = standard_rules) -> list[int]:
+        """ Args:
+                rules (CompiledRules): The rules being played
+            Returns:
+                list[int]: The ids of the cards not in the hand that would make a new set with it
+        """
+        return get_mask_cards(self.get_completing_mask(rules))
+
+@dataclass
+class LayoffIndex:
+    """ Keeps, for one player's sets on the table, which cards could be laid off on each of them:
+        the cards just past either end of a suit set and the missing suits of a rank set. Each card
+        maps to a bitmask of the indexes of the sets it is next to, so whether a card can be laid
+        off is one list lookup however many sets there are. Whether the longer set is allowed
+        by the rules being played is then one lookup in their table of sets (see CompiledRules).
+    """
+    set_masks : list[int] = field(default_factory=list)       # The bitboard of each set, in the order of Player.sets
+    extensions : list[int] = field(default_factory=lambda: [0] * 52) # Card id -> bitmask of the indexes of the sets it is next to
+
+    def add_set(self, set_mask : int) -> None:
+        """ Adds a set that was just put on the table
+        Args:
+            set_mask (int): The bitboard of the set
+        """
+        self.set_masks.append(set_mask)
+        set_bit = 1 << (len(self.set_masks) - 1)
+        for card in get_mask_cards(get_set_ends(set_mask)):
+            self.extensions[card] |= set_bit
+
+    def extend_set(self, set_index : int, card : int) -> None:
+        """ Adds a card that was laid off on a set. Only that set's ends change.
+        Args:
+            set_index (int): The index of the set
+            card (int): The card id
+        """
+        set_bit = 1 << set_index
+        for end_card in get_mask_cards(get_set_ends(self.set_masks[set_index])):
+            self.extensions[end_card] &= ~set_bit
+        self.set_masks[set_index] |= card_bits[card]
+        for end_card in get_mask_cards(get_set_ends(self.set_masks[set_index])):
+            self.extensions[end_card] |= set_bit
+
+    def get_targets(self, card : int) -> int:
+        """ Args:
+                card (int): The card id
+            Returns:
+                int: A bitmask of the indexes of the sets the card is next to
+        """
+        return self.extensions[card]
+
+    def copy_from(self, other : "LayoffIndex") -> None:
+        """ Makes this index the same as another without making a new object (see copy_state_into)
+        Args:
+            other (LayoffIndex): The index to copy
+        """
+        self.set_masks[:] = other.set_masks
+        self.extensions[:] = other.extensions
 
 @dataclass
 class Player:
     """ Dataclass to store information about a player """
     name : str
-    hand : list[str]
-    sets : list[list[str]]
+    hand : list[int]
+    sets : list[list[int]]
     points : int
+    tracker : MeldTracker = None # The hand as a bitboard, made from the hand if it isn't given
+    laid_off : list[int] = field(default_factory=list) # Cards this player laid off on the other player's sets.
+                                                        # They are shown in those sets but are scored for this player.
+    layoffs : LayoffIndex = None # The cards that could be laid off on this player's sets, made from the sets
+
+    def __post_init__(self):
+        if self.tracker is None:
+            self.tracker = MeldTracker(get_hand_mask(self.hand))
+        if self.layoffs is None:
+            self.layoffs = LayoffIndex()
+            for card_set in self.sets:
+                self.layoffs.add_set(get_hand_mask(card_set))
   
 
 @dataclass
 class State:
     """ The State which stores data while the game is in play """
-    deck: list[str]            # The randomized deck
+    deck: Deck                 # The randomized deck
     players : list[Player]     # List of two players. Index 0 is Player 1 and index 1 is Player 2
     current_player : bool      # True and False will represent indexes 1 and 0 of the Player list
-    discard_pile : list[str] 
+    discard_pile : list[int] 
     current_phase : str        # Either 'Pick' Phase and 'Discard' Phase as explained in the instructions
     selected_cards : list[int] # The indexes of cards the user currently has selected to make a set
+    auto_meld : bool = False   # Whether the leftover cards in each hand are made into the best sets when scoring
+    seed : int = 0             # The seed the deck was shuffled with
+    action_log : list[int] = field(default_factory=list) # Every move made so far (see encode_action)
+    pickup_index : int = 0     # Bit i is set if the current player may pick up from spot i of the discard pile
+    public_masks : list[int] = field(default_factory=lambda: [0, 0]) # Bitboards of the cards in each hand that
+                                                                      # were picked up from the discard pile
+    computer_player : int = -1 # The index of the player the computer plays for, or -1 for two people
+    game_id : str = ""         # The id the game is saved under in the game database, so it can be resumed
+    match_rounds : int = 1     # How many deals the match lasts. More than 1 is a tournament match.
+    match_round : int = 1      # Which deal of the match this is
+    match_points : list[int] = field(default_factory=lambda: [0, 0]) # Each player's points from the match's finished deals
+    finished : bool = False    # Whether this deal's points were added to the match and the leaderboard
+    rules_name : str = "Standard" # The name of the variant being played (see rule_variants). Only the name is kept
+                                  # so Drafter can save the State as JSON.
+
+    @property
+    def rules(self) -> CompiledRules:
+        """ Returns:
+                CompiledRules: The variant being played (see the RULE VARIANT FUNCTIONS)
+        """
+        return rule_variants[self.rules_name]
 
-def get_hand(state : State) -> list[str]:
+
+def get_hand(state : State) -> list[int]:
     """ Just a function to shorten the way to get the current player's hand
     Args:
         state (State): The state
     Returns:
-        list[str] : The current player's hand of cards
+        list[int] : The current player's hand of cards
     """
     return state.players[state.current_player].hand
     
-def display_pick_buttons(urls : list[str], route : str) -> Table:
+def display_pick_buttons(cards : list[int], route : str, legal : int = -1) -> Table:
     """ Displays a list of cards and the same number of buttons to pick one of the cards up
     Args:
-        urls (list[str]): The list of card PNGs as URLs
+        cards (list[int]): The list of card ids
         route (str): The route that is attached to the button that signifies which
         pile the selected card is added to
+        legal (int): A bitmask of the indexes that get a button (every index by default)
     Returns:
         Table: A 2-row table to be displayed in Drafter where the first row are the
                cards and the second row are the buttons
     """
-    cards_and_buttons = format_cards(urls)      
-    for card_index in range(len(urls)):
-        cards_and_buttons[1].append(Button("Pick"+str(card_index), route,
-                                          [Argument("card_index", card_index)]))
-    return Table(cards_and_buttons)
+    cards_rendered.inc(len(cards))
+    return render_pick_buttons(tuple(cards), route, legal)
 
 def display_select_buttons(state : State) -> Table:
     """ Displays a list of cards and the same number of buttons to select multiple cards
@@ -193,16 +644,8 @@ def display_select_buttons(state : State) -> Table:
                from the player's hand and the second row are the buttons to select multiple
                cards from the hand.
     """
-    cards_and_buttons = format_cards(get_hand(state))      
-    for card_index in range(len(get_hand(state))):
-        cards_and_buttons[1].append(Button("Select"+str(card_index), "/select_sets",
-                            [Argument("card_index", card_index), Argument("selected", True)]))
-    
-    for i in range(len(get_hand(state))):
-        if i in state.selected_cards:
-            cards_and_buttons[1][i] = Button("Unselect"+str(i), "/select_sets",
-                                [Argument("card_index", i), Argument("selected", False)])
-    return Table(cards_and_buttons)
+    cards_rendered.inc(len(get_hand(state)))
+    return render_select_buttons(tuple(get_hand(state)), frozenset(state.selected_cards))
 
 @route
 def index(state: State) -> Page:
@@ -210,9 +653,9 @@ def index(state: State) -> Page:
     Args:
         state (State): The State
     Returns:
-        Page: The main page of the site
+        Page: The main page of the site. Saved games can be resumed from here if there is a game database.
     """
-    return Page(state, [
+    content = [
         "Welcome to Gin Rummy!",
         "To view instructions, use the dropdown below.",
         Span(SelectBox("instructions", ["Game Setup", "Rules of Play", "Winning"]),
@@ -221,14 +664,30 @@ def index(state: State) -> Page:
         "To get started, enter your names",
         Span("Player 1's Name: ", TextBox("p1_name", "Player 1")),
         Span("Player 2's Name: ", TextBox("p2_name", "Player 2")),
-        Button("START GAME", "/deal_cards")
-    ])
+        Span("Score leftover cards as sets (auto-meld): ", CheckBox("auto_meld")),
+        Span("Play against the computer as Player 2: ", CheckBox("computer")),
+        Span("Deals in the match: ", SelectBox("rounds", ["1", "3", "5", "7"])),
+        Span("Rules: ", SelectBox("variant", rule_variant_names)),
+        Button("START GAME", "/deal_cards"),
+        Link("Leaderboard", "/leaderboard")
+    ]
+    if game_database is not None:
+        content.extend(["Or continue a saved game",
+                        Span("Game id: ", TextBox("game_id", ""), Button("RESUME GAME", "/resume"))])
+    return Page(state, content)
 @route
-def view_instructions(state : State, instructions : str, p1_name : str, p2_name :str) -> Page:
+def view_instructions(state : State, instructions : str, p1_name : str, p2_name :str,
+                      auto_meld : bool = False, computer : bool = False, game_id : str = "",
+                      rounds : int = 1, variant : str = "Standard") -> Page:
     """ The instructions page where the user can learn how the game is played.
     Args:
         state (State): The state
         instructions (str): Which category of instructions to show to the user
+        auto_meld (bool): Whether auto-meld scoring was checked on the main page (not used here)
+        computer (bool): Whether playing against the computer was checked on the main page (not used here)
+        game_id (str): The saved game id typed in on the main page (not used here)
+        rounds (int): The number of deals picked on the main page (not used here)
+        variant (str): The rules picked on the main page (not used here)
     Returns:
         Page: The page with the desired instruction category
     """
@@ -249,16 +708,18 @@ def view_instructions(state : State, instructions : str, p1_name : str, p2_name
         return Page(state, [
             "The goal of Gin Rummy is to build 'sets' of cards, of which there are two types.",
             "A 'Rank Set' is three or more cards which share the same rank. For example:",
-            display_cards([deck[0][0], deck[0][1], deck[0][2]]),
+            display_cards([get_card_id(0, 0), get_card_id(0, 1), get_card_id(0, 2)]),
             "A 'Suit Set' is three or more cards which share the same suit,"+
             "but must be in direct increasing rank order. For example,",
-            display_cards([deck[3][1], deck[4][1], deck[5][1]]),
+            display_cards([get_card_id(3, 1), get_card_id(4, 1), get_card_id(5, 1)]),
             "Each turn, a player may either pick up from the deck or pick up from the discard pile",
             "If a player picks up from the deck, then they have two options: Make a set or Discard",
             "If they are unable to make a valid set or do not wish to do so, they must discard a card from their hand",
             "If a player wants to pick up a card from the discard pile instead, they will only be allowed to if "
             "they can form a valid set with their desired card. It is also worth noting that every other card to the "
             "right of the desired card in the discard pile will be picked up as well.",
+            "Instead of making a set, a player may also 'lay off' a card by adding it to a set already on the "
+            "table, either their own or the other player's. Cards laid off count for the player who laid them off.",
             Span(Button("Back", "/view_instructions",
                 [Argument("instructions", "Game Setup"),
                 Argument("p1_name", "Player 1"), Argument("p2_name", "Player 2")]),
@@ -275,6 +736,7 @@ def view_instructions(state : State, instructions : str, p1_name : str, p2_name
             "The score is compiled for each player by calculating the "+
             "total number of points from each card in the player's sets "
             "minus the total number of points in the player's hand.",
+            "With auto-meld scoring, the cards left in each hand are first made into the best sets possible.",
             "The player with the most points at the end wins!",
             Span(Button("Back", "/view_instructions", [Argument("instructions", "Rules of Play"),
                                         Argument("p1_name", "Player 1"), Argument("p2_name", "Player 2")]),
@@ -291,32 +753,50 @@ def play_turn(state: State) -> Page:
     Returns:
         Page: The page that displays what's currently happening in the game
     """
-    if len(state.deck) <= 0 or len(get_hand(state)) <= 0: # Triggers win conditions if either the deck
-        return win_conditions(state)                      # or the current player's hand is empty
+    if game_engine.is_over(state): # Triggers win conditions if either the deck
+        return win_conditions(state) # or the current player's hand is empty
     
     # Pick Phase
     elif state.current_phase == "pick":
-        return Page(state, [
-            "Discard Pile (" + str(len(state.deck)) + " cards left in deck)",
-            display_pick_buttons(state.discard_pile, "/pick_up_card"),
+        content = [
+            region("counter", "Discard Pile (" + str(state.deck.remaining()) + " cards left in deck)"),
+            region("discard", display_pick_buttons(state.discard_pile, "/pick_up_card", state.pickup_index | 1)),
             state.players[state.current_player].name + "'s Hand",
-            display_cards(get_hand(state)),
+            region("hand", display_cards(get_hand(state))),
             "Sets",
-            display_sets(state.players[state.current_player].sets),
-        ])
+            region("sets", display_sets(state.players[state.current_player].sets)),
+        ]
+        if state.auto_meld: # Hint for which cards would make a new set with the hand
+            completing_cards = state.players[state.current_player].tracker.get_completing_cards(state.rules)
+            content.insert(4, region("completing", "Cards that would make a set: " +
+                                     (", ".join(card_names[card] for card in completing_cards) or "none")))
+        if game_database is not None:
+            content.append("Game id: " + state.game_id)
+        return Page(state, content)
     
     # Discard Phase
     elif state.current_phase == "discard":
-        return Page(state, [
-            "Discard Pile (" + str(len(state.deck)) + " cards left in deck)",
-            display_cards(state.discard_pile),
+        content = [
+            region("counter", "Discard Pile (" + str(state.deck.remaining()) + " cards left in deck)"),
+            region("discard", display_cards(state.discard_pile)),
             state.players[state.current_player].name + "'s Hand",
-            display_cards(get_hand(state)),
+            region("hand", display_cards(get_hand(state))),
             Button("Make set", "/make_set"),
             Button("Discard", "/pick_discard_card"),
             "Sets",
-            display_sets(state.players[state.current_player].sets) 
-    ])
+            region("sets", display_sets(state.players[state.current_player].sets)) 
+        ]
+        if game_engine.get_legal_layoffs(state):
+            content.insert(6, Button("Lay off", "/pick_layoff_card"))
+        if state.players[not state.current_player].sets:
+            content.extend([state.players[not state.current_player].name + "'s Sets",
+                            region("other-sets", display_sets(state.players[not state.current_player].sets))])
+        if state.auto_meld: # Hint for what the hand would be worth if the game ended now
+            content.insert(4, region("deadwood", "Cards not in a set are worth " +
+                           str(get_deadwood_points(get_hand(state), state.rules)) + " points right now"))
+        if game_database is not None:
+            content.append("Game id: " + state.game_id)
+        return Page(state, content)
     
 
 @route
@@ -329,13 +809,13 @@ def make_set(state : State) -> Page:
         Page: Displays cards that can be picked up
     """
     return Page(state, [
-            "Discard Pile (" + str(len(state.deck)) + " cards left in deck)",
-            display_cards(state.discard_pile),
+            region("counter", "Discard Pile (" + str(state.deck.remaining()) + " cards left in deck)"),
+            region("discard", display_cards(state.discard_pile)),
             state.players[state.current_player].name + "'s Hand",
-            display_select_buttons(state),
+            region("hand", display_select_buttons(state)),
             Button("Confirm Selection", "/confirm_sets"),
             "Sets",
-            display_sets(state.players[state.current_player].sets) 
+            region("sets", display_sets(state.players[state.current_player].sets)) 
     ])
 
 @route
@@ -348,14 +828,52 @@ def pick_discard_card(state: State) -> Page:
         Page: The page of 'pick' buttons so the user can pick a card to discard
     """
     return Page(state, [
-            "Discard Pile (" + str(len(state.deck)) + " cards left in deck)",
-            display_cards(state.discard_pile),
+            region("counter", "Discard Pile (" + str(state.deck.remaining()) + " cards left in deck)"),
+            region("discard", display_cards(state.discard_pile)),
             state.players[state.current_player].name + "'s Hand",
-            display_pick_buttons(get_hand(state), "/discard"),
+            region("hand", display_pick_buttons(get_hand(state), "/discard")),
             "Sets",
-            display_sets(state.players[state.current_player].sets)   
+            region("sets", display_sets(state.players[state.current_player].sets))   
     ])
 @route
+def pick_layoff_card(state : State) -> Page:
+    """ The route that handles when the user wants to lay off a card on a set that is already on the table
+    Args:
+        state (State): The state
+    Returns:
+        Page: The page of 'pick' buttons for the cards in the hand that can be laid off
+    """
+    legal = 0
+    for action in game_engine.get_legal_layoffs(state):
+        legal |= 1 << action.index
+    return Page(state, [
+            region("counter", "Discard Pile (" + str(state.deck.remaining()) + " cards left in deck)"),
+            region("discard", display_cards(state.discard_pile)),
+            state.players[state.current_player].name + "'s Hand",
+            region("hand", display_pick_buttons(get_hand(state), "/lay_off", legal)),
+            "Sets",
+            region("sets", display_sets(state.players[state.current_player].sets)),
+            state.players[not state.current_player].name + "'s Sets",
+            region("other-sets", display_sets(state.players[not state.current_player].sets))
+    ])
+
+@route
+def lay_off(state : State, card_index : int) -> Page:
+    """ The route that handles laying off a card. The card is added to the first set it extends,
+        the current player's own sets first, and the player stays in the discard phase.
+    Args:
+        state (State): The state
+        card_index (int): The index of the card from the player's hand to be laid off
+    Returns:
+        Page: Returns to the play_turn page, which ends the game if the hand is now empty
+    """
+    layoffs = [action for action in game_engine.get_legal_layoffs(state) if action.index == card_index]
+    layoffs.sort(key=lambda action: action.target & 1 != state.current_player)
+    if layoffs and game_engine.apply(state, layoffs[0]):
+        save_game(state)
+    return play_turn(state)
+
+@route
 def discard(state: State, card_index : int) -> Page:
     """ The route that handles discarding a card. The card is added to the discard pile
         and removed from the player's hand and the current player is changed.
@@ -366,54 +884,125 @@ def discard(state: State, card_index : int) -> Page:
     Returns:
         Page: Returns to the play_turn page for the next player's turn
     """
-    state.discard_pile.append(state.players[state.current_player].hand.pop(card_index))
-    state.current_player = not state.current_player # Changes current player
-    state.current_phase = "pick"
+    game_engine.apply(state, Action("discard", card_index))
+    play_computer_turn(state) # Does nothing unless it is now the computer's turn
+    save_game(state)
     return play_turn(state)
 
 
 @route
-def deal_cards(state: State, instructions : str, p1_name : str, p2_name : str) -> Page:
-    """ Deals 7 random cards to each player and removes them from the deck
+def deal_cards(state: State, instructions : str, p1_name : str, p2_name : str,
+               auto_meld : bool = False, computer : bool = False, game_id : str = "", rounds : int = 1,
+               variant : str = "Standard") -> Page:
+    """ Deals random cards to each player and removes them from the deck, starting a match
         Cannot be unit tested since the dealt cards are random
     Args:
         state (State): The State
         instructions (str): Which category of instructions to show the user (not used here)
         p1_name (str): Player 1's name
         p2_name (str): Player 2's name
+        auto_meld (bool): Whether to score the leftover cards in each hand as the best sets possible
+        computer (bool): Whether the computer plays as Player 2
+        game_id (str): The saved game id typed in on the main page (not used here)
+        rounds (int): How many deals the match lasts, with the points added up over all of them
+        variant (str): The name of the rules to play with (see rule_variants), or the standard rules if unknown
     Returns:
         Page: Will call the play_turn route for the game to begin
     """
-    state.players[0].name = p1_name
-    state.players[1].name = p2_name
-    state.deck = shuffle_deck(deck)
-    for i in range(7):
-        state.players[0].hand.append(state.deck.pop(0))
-        state.players[1].hand.append(state.deck.pop(0))
-    state.discard_pile.append(state.deck.pop(0))
+    if computer:
+        p2_name = "Computer"
+    state.match_rounds = max(1, rounds)
+    game_engine.deal(state, p1_name, p2_name, auto_meld, rules=rule_variants.get(variant, standard_rules))
+    state.computer_player = 1 if computer else -1
+    state.game_id = secrets.token_urlsafe(9)
+    save_game(state)
     return play_turn(state)
 
+@route
+def next_deal(state : State) -> Page:
+    """ Deals the next game of a tournament match to the same players, keeping their points
+        Cannot be unit tested since the dealt cards are random
+    Args:
+        state (State): The state of the deal that just finished
+    Returns:
+        Page: The first turn of the new deal, or the final scores if the match is over
+    """
+    if not state.finished or state.match_round >= state.match_rounds:
+        return win_conditions(state)
+    next_state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id],
+                       "pick", [], computer_player=state.computer_player, match_rounds=state.match_rounds,
+                       match_round=state.match_round + 1, match_points=state.match_points.copy())
+    game_engine.deal(next_state, state.players[0].name, state.players[1].name, state.auto_meld, rules=state.rules)
+    next_state.game_id = secrets.token_urlsafe(9)
+    save_game(next_state)
+    return play_turn(next_state)
+
+@route
+def resume(state : State, instructions : str, p1_name : str, p2_name : str, game_id : str,
+           auto_meld : bool = False, computer : bool = False, rounds : int = 1, variant : str = "Standard") -> Page:
+    """ Picks a saved game back up from the game database, right where it was left
+    Args:
+        state (State): The state, which is replaced by the saved game
+        instructions (str): Which category of instructions to show the user (not used here)
+        p1_name (str): Player 1's name (not used here, the saved game has its own names)
+        p2_name (str): Player 2's name (not used here)
+        game_id (str): The id of the saved game
+        auto_meld (bool): Whether auto-meld scoring was checked on the main page (not used here)
+        computer (bool): Whether playing against the computer was checked on the main page (not used here)
+        rounds (int): The number of deals picked on the main page (not used here)
+        variant (str): The rules picked on the main page (not used here, the saved game has its own rules)
+    Returns:
+        Page: The saved game's turn, or a message if there is no game with that id
+    """
+    snapshot = None if game_database is None else game_database.load(game_id.strip())
+    if snapshot is None:
+        return Page(state, ["There is no saved game with the id " + repr(game_id), Button("Back", "index")])
+    return play_turn(decode_state(snapshot))
+
 
 #  ---------------------- VALID SET FUNCTIONS --------------------------
 
-def get_card_coordinates(urls : list[str]) -> list[list[int]]:
-    """ Converts a list of urls of cards to their respective coordinates in the unshuffled
+def get_card_coordinates(cards : list[int]) -> list[list[int]]:
+    """ Converts a list of card ids to their respective coordinates in the unshuffled
         deck of cards so we can extract their suit and rank. Coordinates will be in the
         format of [Rank, Suit].
     Args:
-        urls (list[str]): The urls of the images of the cards
+        cards (list[int]): The ids of the cards
     Returns:
         list[list[int]]: A list of coordinates of each card's placement in the 2d list 
     """
     card_coordinates = []
-    for url in urls:
-        for row in range(13):
-            for col in range(4):
-                if url == deck[row][col]:
-                    card_coordinates.append([row, col])
+    for card in cards:
+        card_coordinates.append([card_ranks[card], card_suits[card]])
     return card_coordinates
 
-def check_standard_rank_set(selecting:bool, card_coordinates:list[list[int]], rank:int) -> bool:
+def get_hand_mask(cards : list[int]) -> int:
+    """ Converts a list of card ids into a bitboard of the four 13-bit suit masks
+    Args:
+        cards (list[int]): The ids of the cards
+    Returns:
+        int: The bitboard with one bit set for every card
+    """
+    hand_mask = 0
+    for card in cards:
+        hand_mask |= card_bits[card]
+    return hand_mask
+
+def get_mask_cards(hand_mask : int) -> list[int]:
+    """ Converts a bitboard back into a list of card ids, going suit by suit from Ace to King
+    Args:
+        hand_mask (int): The bitboard of cards
+    Returns:
+        list[int]: The ids of the cards in the bitboard
+    """
+    cards = []
+    while hand_mask:
+        lowest_bit = hand_mask & -hand_mask
+        cards.append(bit_cards[lowest_bit.bit_length() - 1])
+        hand_mask ^= lowest_bit
+    return cards
+
+def check_standard_rank_set(selecting : bool, hand_mask : int, rank : int) -> bool:
     """ Checks whether a user has a valid rank set. A rank set is 3 or more cards that
         share the same rank. For example {Ace of Spades, Ace of Hearts, Ace of Diamonds}
         would be a valid rank set.
@@ -421,99 +1010,1167 @@ def check_standard_rank_set(selecting:bool, card_coordinates:list[list[int]], ra
     Args:
         selecting (bool): Whether or not the user is selecting cards (True) to make a set or if
                           the user is trying to pick up a card from the discard pile to make a set (False)
-        card_coordinates (list[list[int]]): The coordinates of the cards to be tested to extract their
-                                            suit and rank
+        hand_mask (int): The bitboard of the cards to be tested
         rank (int): The specific rank to test other cards' ranks against to ensure a valid rank set.
     Returns:
         bool: Whether or not a list of cards is a valid rank set.
     """
+    rank_bits = hand_mask & (rank_column << rank)
     
     # If the user is selecting cards for a rank set, we need to make sure that they aren't selecting invalid cards
     # Namely, if the user selects a card with a rank that does not match, this should return False.
-    set_length = 0
-    for coordinate in card_coordinates:
-        if coordinate[0] == rank:
-            set_length += 1
-        elif selecting:
-            return False
-    
-    return set_length >= 3
+    if selecting and rank_bits != hand_mask:
+        return False
+    return rank_bits.bit_count() >= 3
 
-def check_standard_suit_set(selecting : bool, card_coordinates : list[list[int]],
-                            rank : int, suit : int) -> bool:
+def check_standard_suit_set(selecting : bool, hand_mask : int, rank : int, suit : int) -> bool:
     """ Checks whether a user has a valid suit set. A suit set is 3 or more cards that share the
         same suit, but must be in direct order with two other cards in terms of their ranks.
         For example: {Two of Clubs, Three of Clubs, and Four of Clubs} is a valid suit set.
-        Since these cards are in the form of URLs of their images, this function takes advantage
-        of their position in the ordered 2D list (deck) to determine their suit and rank.
+        Since the ranks of a suit are the bits of its 13-bit mask, the run through the target
+        rank is the block of 1 bits around that rank's bit.
         
-        Args: The same arguments as the next function (valid_set)
+        Args: The same arguments as the next function (valid_set), but with the cards as a bitboard
         Returns:
             bool: Whether or not a list of cards is a valid suit set
     """
+    suit_bits = (hand_mask >> (suit * 13)) & suit_mask
     
     # If the user is selecting cards for a suit set, we need to make sure that they aren't selecting invalid cards
-    # Namely, if the user selects a card with a suit that does not match, this should return False.       
-    ranks = []
-    set_length = 1
-    for coordinate in card_coordinates: 
-        if coordinate[1] == suit:       # If a card in the player's hand has the same suit,
-            ranks.append(coordinate[0]) # Then append the card's rank to a list for comparison
-        elif selecting:
-            return False
-    ranks.sort()                        # Then, sort this list in increasing order
-    
-    target_rank_index = 0
-    for i in range(len(ranks)):        
-        if ranks[i] == rank:            # Then find the index of the target rank in the list.
-            target_rank_index = i       # The reason for this is to ensure that any set that
-                                        # is found includes the card that is picked up
+    # Namely, if the user selects a card with a suit that does not match, this should return False.
+    if selecting and suit_bits << (suit * 13) != hand_mask:
+        return False
+    if not suit_bits >> rank & 1:       # Any set that is found must include the target card
+        return False
     
-    # This searches indexes to the LEFT of the target to see if the ranks are increasing by 1 exactly
-    left_search_index = target_rank_index - 1
-    while left_search_index >= 0:
-        if ranks[left_search_index] == ranks[left_search_index + 1] - 1:
-            set_length += 1
-            left_search_index -= 1
-        else:
-            break
-    
-    # This searches indexes to the RIGHT of the target to see if the ranks are increasing by 1 exactly
-    right_search_index = target_rank_index + 1
-    while right_search_index < len(ranks):
-        if ranks[right_search_index] == ranks[right_search_index - 1] + 1:
-            set_length += 1
-            right_search_index += 1
-        else:
-            break
+    # The 1 bits going UP from the target rank are the trailing 1s of the mask shifted down to it
+    upper_bits = suit_bits >> rank
+    set_length = (upper_bits ^ (upper_bits + 1)).bit_length() - 1
+    # The 1 bits going DOWN from the target rank end at the highest 0 bit below it
+    lower_gaps = ~suit_bits & ((1 << rank) - 1)
+    set_length += rank - lower_gaps.bit_length()
     
     # If the user is selecting cards to make a set, we need to make sure that every card that is selected
-    # is included in the set. We can do this by checking the length of the list and the length of the found set.
+    # is included in the set. We can do this by checking the number of cards and the length of the found set.
     # This step is not necessary if we're checking a player's entire hand to determine if they are ABLE to make a set.
-    if selecting:  
-        return len(card_coordinates) == set_length and set_length >= 3
+    if selecting:
+        return suit_bits.bit_count() == set_length and set_length >= 3
     return set_length >= 3
                 
     
-def valid_set(selecting : bool, urls : list[str], rank : int, suit : int) -> bool:
+valid_set_calls = Counter("gin_rummy_valid_set_calls_total", "How many times a set was checked with valid_set")
+
+def valid_set(selecting : bool, cards : list[int], rank : int, suit : int,
+              rules : CompiledRules = standard_rules) -> bool:
     """
     Args:
         selecting (bool): Whether or not the user is selecting cards (True) to make a set or if the user
                           is trying to pick up a card from the discard pile to make a set (False)
-        card_coordinates (list[list[int]]): The coordinates of the cards to be tested to extract their
-                                        suit and rank
-        rank (int): The specific rank to test other cards' ranks against to ensure that they are increasing
-                    by exactly 1
-        suit (int): The specific suit to test other cards' suits against to ensure that they are the same
+        cards (list[int]): The ids of the cards to be tested
+        rank (int): The rank of the card that must be in the set (the selected card or the one being picked up)
+        suit (int): The suit of the card that must be in the set
+        rules (CompiledRules): The rules being played
+    Returns:
+        bool: When selecting, whether the cards are exactly one rank set or suit set. Otherwise, whether
+              the card with the given rank and suit would be in a set made from it and the cards.
+    """
+    valid_set_calls.inc()
+    hand_mask = get_hand_mask(cards)
+    if selecting:
+        return hand_mask in rules.set_masks
+    card_bit = card_bits[get_card_id(rank, suit)]
+    return bool(get_meld_members_mask(hand_mask | card_bit, rules) & card_bit)
+
+def get_rank_counts(hand_mask : int) -> tuple[int, int, int, int, int, int]:
+    """ Finds the ranks that a bitboard has in at least 0, 1, 2, 3, 4 and 5 of the suits, so the
+        rules can pick the count they need by index instead of with ifs
+    Args:
+        hand_mask (int): The bitboard of cards
+    Returns:
+        tuple[int, int, int, int, int, int]: A 13-bit mask of ranks for each count of suits
+    """
+    hearts, diamonds = hand_mask & suit_mask, hand_mask >> 13 & suit_mask
+    clubs, spades = hand_mask >> 26 & suit_mask, hand_mask >> 39
+    red_pairs, black_pairs = hearts & diamonds, clubs & spades
+    red_cards, black_cards = hearts | diamonds, clubs | spades
+    return (suit_mask, red_cards | black_cards, red_pairs | black_pairs | (red_cards & black_cards),
+            (red_pairs & black_cards) | (black_pairs & red_cards), red_pairs & black_pairs, 0)
+
+def enumerate_meld_masks(hand_mask : int, rules : CompiledRules = standard_rules) -> list[int]:
+    """ Finds every legal set that can be made from a bitboard of cards in one pass.
+        Suit sets of every length are found by ANDing each suit's mask with itself shifted
+        down one more bit at a time, so a bit that is still set is the lowest rank of a run
+        of that length. Rank sets come from the ranks that enough suit masks share.
+    Args:
+        hand_mask (int): The bitboard of cards
+        rules (CompiledRules): The rules being played
+    Returns:
+        list[int]: The bitboard of every set, suit sets first (by suit, length, then rank) then
+                   Ace-high runs (by suit, then length) followed by rank sets (by rank, with the
+                   4-card set before its 3-card sets)
+    """
+    melds = []
+    # The runs one card short of the smallest set are found for every suit at once
+    short_run_starts = hand_mask & rules.short_run_start_bits
+    for shift in rules.short_run_shifts:
+        short_run_starts &= hand_mask >> shift
+    low_run_ranks = rules.low_run_ranks
+    for suit in range(4):
+        low_run_bits = (hand_mask >> (suit * 13)) & low_run_ranks
+        run_starts = (short_run_starts >> (suit * 13)) & suit_mask
+        run_bits = rules.short_run_bits
+        while run_starts:
+            run_starts &= low_run_bits >> run_bits.bit_length()
+            run_bits = run_bits << 1 | 1
+            starts = run_starts
+            while starts:
+                lowest_bit = starts & -starts
+                melds.append((run_bits * lowest_bit) << (suit * 13))
+                starts ^= lowest_bit
+    for high_run in rules.high_runs:
+        if hand_mask & high_run == high_run:
+            melds.append(high_run)
+    
+    rank_starts = get_rank_counts(hand_mask)[rules.rank_set_size]
+    while rank_starts:
+        lowest_bit = rank_starts & -rank_starts
+        rank_bits = hand_mask & (rank_column * lowest_bit)
+        melds.append(rank_bits)
+        if rank_bits.bit_count() > rules.set_size: # The smaller sets inside a 4-card set
+            for suit in range(4):
+                melds.append(rank_bits ^ (lowest_bit << (suit * 13)))
+        rank_starts ^= lowest_bit
+    return melds
+
+def enumerate_melds(hand : list[int], rules : CompiledRules = standard_rules) -> list[list[int]]:
+    """ Finds every legal rank set and suit set that can be made from a hand
+    Args:
+        hand (list[int]): The ids of the cards in the hand
+        rules (CompiledRules): The rules being played
+    Returns:
+        list[list[int]]: Every set that can be made, each as a list of card ids
+    """
+    melds = []
+    for meld_mask in enumerate_meld_masks(get_hand_mask(hand), rules):
+        melds.append(get_mask_cards(meld_mask))
+    return melds
+
+def get_set_ends(set_mask : int) -> int:
+    """ Finds the cards that might be laid off on a set: the other suits of a rank set's rank, or
+        the cards on either side of a suit set. An Ace next to a King counts as being on either
+        side, so an Ace-high run can be found; the rules decide which of the longer sets are allowed.
+    Args:
+        set_mask (int): The bitboard of the set
     Returns:
-        bool: Whether or not either a rank set or a suit set can be made from given cards
+        int: The bitboard of the cards next to the set
     """
-    card_coordinates = get_card_coordinates(urls)
-    return check_standard_rank_set(selecting, card_coordinates, rank) or \
-           check_standard_suit_set(selecting, card_coordinates, rank, suit)
+    ranks = get_rank_counts(set_mask)[1]
+    if ranks & (ranks - 1) == 0: # Only one rank, so it is a rank set
+        return ranks * rank_column & ~set_mask
+    ends = (set_mask << 1 & ~rank_column) | (set_mask >> 1 & ~(rank_column << 12)) | \
+           (set_mask & rank_column << 12) >> 12 | (set_mask & rank_column) << 12
+    return ends & ((1 << 52) - 1) & ~set_mask
 
 # --------------------- END OF VALID SET FUNCTIONS -----------------------
 
+#  ---------------------- AUTO-MELD FUNCTIONS --------------------------
+
+def get_meld_members_mask(hand_mask : int, rules : CompiledRules = standard_rules) -> int:
+    """ Finds every card that is part of at least one set that can be made from a bitboard of cards.
+        Any run at least as long as the smallest set is covered by runs of exactly that size, so
+        only those are looked for.
+    Args:
+        hand_mask (int): The bitboard of cards
+        rules (CompiledRules): The rules being played
+    Returns:
+        int: The bitboard of the cards that are in some rank set or suit set
+    """
+    run_starts = hand_mask & rules.run_start_bits
+    for shift in rules.run_shifts:
+        run_starts &= hand_mask >> shift
+    members = run_starts
+    for shift in rules.run_shifts:
+        members |= run_starts << shift
+    for high_window in rules.high_windows:
+        if hand_mask & high_window == high_window:
+            members |= high_window
+    return members | (hand_mask & get_rank_counts(hand_mask)[rules.rank_set_size] * rank_column)
+
+def get_completing_mask(hand_mask : int, rules : CompiledRules = standard_rules) -> int:
+    """ Finds every card that isn't in a bitboard but would make a new set with its cards. A card
+        finishes a run if every other card of a smallest-size run through it is there, and
+        finishes a rank set if it is the only card of the set missing.
+    Args:
+        hand_mask (int): The bitboard of cards
+        rules (CompiledRules): The rules being played
+    Returns:
+        int: The bitboard of the cards that would complete a set
+    """
+    runs = 0
+    for missing, shifts in rules.completing_shifts:
+        run_starts = rules.run_start_bits
+        for shift in shifts:
+            run_starts &= hand_mask >> shift
+        runs |= run_starts << missing
+    for high_window in rules.high_windows:
+        if (hand_mask & high_window).bit_count() == rules.set_size - 1:
+            runs |= high_window
+    pairs = get_rank_counts(hand_mask)[rules.completing_rank_count]
+    return (runs | pairs * rank_column) & ~hand_mask
+
+def get_mask_points(hand_mask : int, rules : CompiledRules = standard_rules) -> int:
+    """ Adds up the points of every card in a bitboard, one count for each amount of points
+    Args:
+        hand_mask (int): The bitboard of cards
+        rules (CompiledRules): The rules being played
+    Returns:
+        int: The points of the cards. With the standard rules, 5 points for every card ranked
+             A - 9 and 10 points for every card ranked 10 - K.
+    """
+    points = 0
+    for rank_points, point_mask in rules.point_masks:
+        points += rank_points * (hand_mask & point_mask).bit_count()
+    return points
+
+def find_best_melds(hand_mask : int, rules : CompiledRules = standard_rules) -> tuple[int, tuple[int, ...]]:
+    """ Finds the sets that are worth the most points when no card can be in two sets.
+        Cards that can't be in any set are always left over, so they are taken out first.
+    Args:
+        hand_mask (int): The bitboard of the cards in the hand
+        rules (CompiledRules): The rules being played
+    Returns:
+        tuple[int, tuple[int, ...]]: The total points of the best sets and the bitboards of those sets
+    """
+    return find_best_member_melds(get_meld_members_mask(hand_mask, rules), rules)
+
+@functools.lru_cache(maxsize=65536)
+def find_best_member_melds(hand_mask : int, rules : CompiledRules = standard_rules) -> tuple[int, tuple[int, ...]]:
+    """ Finds the best sets for a bitboard where every card is in at least one set. The lowest
+        card is either left over, or is the lowest card of one of the sets that fit in the hand;
+        the rest of the hand is then solved the same way. Answers are remembered by bitboard
+        and rules, so hands that come up again (even across turns and players) are free.
+    Args:
+        hand_mask (int): The bitboard of the cards, all of which are in some set
+        rules (CompiledRules): The rules being played
+    Returns:
+        tuple[int, tuple[int, ...]]: The total points of the best sets and the bitboards of those sets
+    """
+    if not hand_mask:
+        return 0, ()
+    lowest_bit = hand_mask & -hand_mask
+    best = find_best_melds(hand_mask ^ lowest_bit, rules)  # The lowest card is left over
+    for meld_mask in rules.melds_by_lowest_bit[lowest_bit.bit_length() - 1]:
+        if meld_mask & hand_mask == meld_mask:
+            points, melds = find_best_melds(hand_mask ^ meld_mask, rules)
+            points += get_mask_points(meld_mask, rules)
+            if points > best[0]:
+                best = (points, (meld_mask,) + melds)
+    return best
+
+def auto_meld(hand : list[int], rules : CompiledRules = standard_rules) -> tuple[list[list[int]], list[int]]:
+    """ Splits a hand into the sets worth the most points and the cards left over (deadwood)
+    Args:
+        hand (list[int]): The ids of the cards in the hand
+        rules (CompiledRules): The rules being played
+    Returns:
+        tuple[list[list[int]], list[int]]: The best sets, and the leftover cards in their original order
+    """
+    points, melds = find_best_melds(get_hand_mask(hand), rules)
+    sets = []
+    melded_mask = 0
+    for meld_mask in melds:
+        sets.append(get_mask_cards(meld_mask))
+        melded_mask |= meld_mask
+    deadwood = []
+    for card in hand:
+        if not card_bits[card] & melded_mask:
+            deadwood.append(card)
+    return sets, deadwood
+
+def get_deadwood_points(hand : list[int], rules : CompiledRules = standard_rules) -> int:
+    """ Gets the points of the cards that would be left over after making the best sets from a hand
+    Args:
+        hand (list[int]): The ids of the cards in the hand
+        rules (CompiledRules): The rules being played
+    Returns:
+        int: The points of the leftover cards
+    """
+    hand_mask = get_hand_mask(hand)
+    return get_mask_points(hand_mask, rules) - find_best_melds(hand_mask, rules)[0]
+
+# --------------------- END OF AUTO-MELD FUNCTIONS -----------------------
+
+#  ---------------------- SCORING FUNCTIONS --------------------------
+
+# Every card id's points come from the rules' card_points table (see CompiledRules). The card backing
+# is worth 0 points, so it is used to pad out hands and sets that are shorter than the others.
+
+def encode_final_states(states : list[State]) -> tuple[list[list[list[int]]], list[list[list[int]]]]:
+    """ Encodes finished games as rectangular lists of card ids, ready to be scored together.
+        With auto-meld scoring, the best sets are taken out of each hand first. Cards laid off
+        on the other player's sets count for the player who laid them off. The states are not changed.
+    Args:
+        states (list[State]): The finished games, which may be playing different variants
+    Returns:
+        tuple[list[list[list[int]]], list[list[list[int]]]]: The hand cards and the set cards of
+            each game, indexed by [game][player][card], both padded with the card backing
+    """
+    hands, sets = [], []
+    for state in states:
+        hands.append([])
+        sets.append([])
+        for player, other in zip(state.players, state.players[::-1]):
+            hand = player.hand.copy()
+            set_cards = [card for card_set in player.sets for card in card_set if card not in other.laid_off]
+            set_cards.extend(player.laid_off)
+            if state.auto_meld:
+                best_sets, hand = auto_meld(hand, state.rules)
+                set_cards.extend(card for card_set in best_sets for card in card_set)
+            hands[-1].append(hand)
+            sets[-1].append(set_cards)
+    for cards in (hands, sets):
+        width = max([len(player_cards) for game in cards for player_cards in game] + [0])
+        for game in cards:
+            for player_cards in game:
+                player_cards.extend([card_backing_id] * (width - len(player_cards)))
+    return hands, sets
+
+def score_games(hands, sets, rules : CompiledRules = standard_rules):
+    """ Scores a batch of finished games at once: each player gets the points of the cards in
+        their sets minus the points of the cards left in their hand. This does not change anything,
+        so scoring the same game twice gives the same answer.
+    Args:
+        hands: The hand cards of N games as card ids, shaped [N][2][cards] and padded with the card backing
+        sets: The set cards of N games as card ids, shaped [N][2][cards] and padded with the card backing
+        rules (CompiledRules): The rules every game in the batch was played with
+    Returns:
+        The scores shaped [N][2]; a numpy array when numpy is installed, otherwise a list of lists
+    """
+    card_points = rules.card_points
+    if numpy is not None:
+        hand_points = rules.card_point_table[numpy.asarray(hands, dtype=numpy.intp)].sum(axis=-1)
+        set_points = rules.card_point_table[numpy.asarray(sets, dtype=numpy.intp)].sum(axis=-1)
+        return set_points - hand_points
+    scores = []
+    for game_hands, game_sets in zip(hands, sets):
+        scores.append([sum(card_points[card] for card in player_sets) -
+                       sum(card_points[card] for card in player_hand)
+                       for player_hand, player_sets in zip(game_hands, game_sets)])
+    return scores
+
+# --------------------- END OF SCORING FUNCTIONS -----------------------
+
+#  ---------------------- GAME ENGINE --------------------------
+
+# The rules of the game without any pages, so whole games can be played by bots and
+# simulations as fast as possible. The routes below just apply an Action and draw the result.
+
+@dataclass(frozen=True)
+class Action:
+    """ Dataclass for one move of the game """
+    kind : str                    # 'pick', 'meld', 'discard' or 'layoff'
+    index : int = 0               # 'pick': index in the discard pile (0 is the deck), 'discard' and 'layoff': index in the hand
+    selected : tuple[int, ...] = () # 'meld': the indexes of the cards in the hand that make the set
+    target : int = 0              # 'layoff': the index of the set shifted left 1, with the index of the player who owns it
+
+
+# Each move is stored in a game's action log as one int. The lowest 2 bits are the kind of move
+# and the rest is the index for 'pick' and 'discard', or a bitmask of the selected hand indexes for 'meld'.
+# For 'layoff' the lowest 6 bits of the rest are the hand index and the bits above them are the target.
+action_kinds = ["pick", "discard", "meld", "layoff"]
+
+def encode_action(action : Action) -> int:
+    """ Packs a move into one int for the action log
+    Args:
+        action (Action): The move
+    Returns:
+        int: The move as an int
+    """
+    if action.kind == "meld":
+        payload = 0
+        for card_index in action.selected:
+            payload |= 1 << card_index
+    elif action.kind == "layoff":
+        payload = action.target << 6 | action.index
+    else:
+        payload = action.index
+    return payload << 2 | action_kinds.index(action.kind)
+
+def decode_action(code : int) -> Action:
+    """ Unpacks a move from the action log
+    Args:
+        code (int): The move as an int
+    Returns:
+        Action: The move
+    """
+    kind = action_kinds[code & 0b11]
+    payload = code >> 2
+    if kind == "meld":
+        return Action(kind, selected=tuple(card_index for card_index in range(payload.bit_length())
+                                           if payload >> card_index & 1))
+    if kind == "layoff":
+        return Action(kind, payload & 0b111111, target=payload >> 6)
+    return Action(kind, payload)
+
+
+# Counted for /metrics (see metrics.py)
+rejected_pickups = Counter("gin_rummy_rejected_pickups_total",
+                           "How many times a card was picked from the discard pile without making a set")
+
+class GameEngine:
+    """ Plays the rules of the game on a State. Nothing here builds a Page. """
+    
+    def deal(self, state : State, p1_name : str, p2_name : str, auto_meld : bool = False,
+             seed : int | None = None, rules : CompiledRules = standard_rules) -> None:
+        """ Shuffles the deck, deals each player their hand and starts the discard pile
+        Args:
+            state (State): The state
+            p1_name (str): Player 1's name
+            p2_name (str): Player 2's name
+            auto_meld (bool): Whether to score the leftover cards in each hand as the best sets possible
+            seed (int | None): The seed to shuffle the deck with. A random seed is picked if None.
+            rules (CompiledRules): The variant to play, which sets how many cards are dealt. It must be
+                                   one of the rule_variants, since the State only keeps its name.
+        Raises:
+            ValueError: If the rules are not one of the rule_variants
+        """
+        if rule_variants.get(rules.name) is not rules:
+            raise ValueError("The rules " + repr(rules.name) + " are not one of the rule_variants")
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        state.players[0].name = p1_name
+        state.players[1].name = p2_name
+        state.auto_meld = auto_meld
+        state.seed = seed
+        state.rules_name = rules.name
+        state.deck = shuffle_deck(deck, seed)
+        for i in range(rules.hand_size):
+            for player in state.players:
+                card = state.deck.draw()
+                player.hand.append(card)
+                player.tracker.add(card)
+        state.discard_pile.append(state.deck.draw())
+        self.index_pickups(state)
+    
+    def is_over(self, state : State) -> bool:
+        """ The game ends when either the deck is down to the rules' last cards (empty with the
+            standard rules) or the current player's hand is empty
+        Args:
+            state (State): The state
+        Returns:
+            bool: Whether or not the game is over
+        """
+        return state.deck.remaining() <= state.rules.end_deck_size or len(get_hand(state)) <= 0
+    
+    def index_pickups(self, state : State) -> None:
+        """ Works out every spot in the discard pile that the current player may pick up from and
+            stores them in state.pickup_index. A card can only be picked up if it makes a valid set
+            with the player's hand and the cards to its right, so one pass from the right end of the
+            pile builds up those cards as a bitboard. Only a discard changes the pile or whose turn it
+            is, so this is run once per turn instead of on every pick.
+        Args:
+            state (State): The state, which is changed in place
+        """
+        hand_mask = state.players[state.current_player].tracker.hand_mask
+        rules = state.rules
+        pickup_index = 0
+        for card_index in range(len(state.discard_pile) - 1, 0, -1):
+            card = state.discard_pile[card_index]
+            hand_mask |= card_bits[card]
+            if get_meld_members_mask(hand_mask, rules) & card_bits[card]: # The card is in a rank set or suit set
+                pickup_index |= 1 << card_index
+        state.pickup_index = pickup_index
+    
+    def get_legal_pickups(self, state : State) -> list[int]:
+        """ Lists every spot in the discard pile that the current player may pick up from
+        Args:
+            state (State): The state
+        Returns:
+            list[int]: The indexes of the discard pile that can be picked up, from left to right (not the deck)
+        """
+        return [card_index for card_index in range(1, len(state.discard_pile))
+                if state.pickup_index >> card_index & 1]
+    
+    def get_legal_layoffs(self, state : State) -> list[Action]:
+        """ Lists every card in the current player's hand that can be laid off, and on which set.
+            Each player's LayoffIndex gives the sets a card is next to in one lookup, and the
+            rules' table of sets says whether the longer set is allowed.
+        Args:
+            state (State): The state
+        Returns:
+            list[Action]: The lay-offs on Player 1's sets and then on Player 2's, in hand order
+        """
+        if not state.rules.layoffs:
+            return []
+        hand = get_hand(state)
+        set_masks = state.rules.set_masks
+        actions = []
+        for owner_index, owner in enumerate(state.players):
+            layoffs = owner.layoffs
+            if not layoffs.set_masks:
+                continue
+            for card_index, card in enumerate(hand):
+                targets = layoffs.extensions[card]
+                while targets:
+                    set_index = (targets & -targets).bit_length() - 1
+                    targets &= targets - 1
+                    if (layoffs.set_masks[set_index] | card_bits[card]) in set_masks:
+                        actions.append(Action("layoff", card_index, target=set_index << 1 | owner_index))
+        return actions
+    
+    def legal_actions(self, state : State) -> list[Action]:
+        """ Lists every move the current player can make
+        Args:
+            state (State): The state
+        Returns:
+            list[Action]: Picking up from the deck or the discard pile in the pick phase, and
+                          every set that can be made, every card that can be laid off and every card that
+                          can be discarded in the discard phase
+        """
+        if self.is_over(state):
+            return []
+        if state.current_phase == "pick":
+            actions = [Action("pick", 0)]
+            for card_index in self.get_legal_pickups(state):
+                actions.append(Action("pick", card_index))
+            return actions
+        hand = get_hand(state)
+        actions = []
+        for meld in enumerate_melds(hand, state.rules):
+            actions.append(Action("meld", selected=tuple(hand.index(card) for card in meld)))
+        actions.extend(self.get_legal_layoffs(state))
+        for card_index in range(len(hand)):
+            actions.append(Action("discard", card_index))
+        return actions
+    
+    def apply(self, state : State, action : Action) -> bool:
+        """ Makes a move for the current player if it is allowed
+        Args:
+            state (State): The state, which is changed in place
+            action (Action): The move to make
+        Returns:
+            bool: Whether or not the move was made. The state is not changed if it wasn't.
+        """
+        player = state.players[state.current_player]
+        if action.kind == "pick" and state.current_phase == "pick":
+            if action.index == 0: # If picking up from the deck then take the first card from the deck
+                card = state.deck.draw()
+                player.hand.append(card)
+                player.tracker.add(card)
+            elif 0 < action.index < len(state.discard_pile) and state.pickup_index >> action.index & 1:
+                # Every card in the discard pile from the selected card to the end goes to the player's hand
+                for card in state.discard_pile[action.index:]:
+                    player.tracker.add(card)
+                    state.public_masks[state.current_player] |= card_bits[card]
+                player.hand.extend(state.discard_pile[action.index:])
+                del state.discard_pile[action.index:]
+            else:
+                rejected_pickups.inc()
+                return False
+            state.current_phase = "discard"
+            state.action_log.append(encode_action(action))
+            return True
+        
+        if action.kind == "meld" and state.current_phase == "discard":
+            if not action.selected or len(set(action.selected)) != len(action.selected) or \
+               not all(0 <= card_index < len(player.hand) for card_index in action.selected):
+                return False
+            # The cards go into the set in the order they are in the hand, so the log can store them as a bitmask
+            selected = [player.hand[card_index] for card_index in sorted(action.selected)]
+            # The rank and suit designations for this set are to be compared to the first selected card
+            if not valid_set(True, selected, card_ranks[selected[0]], card_suits[selected[0]], state.rules):
+                return False
+            player.sets.append(selected)
+            player.layoffs.add_set(get_hand_mask(selected))
+            for card in selected:
+                player.hand.remove(card)
+                player.tracker.remove(card)
+                state.public_masks[state.current_player] &= ~card_bits[card]
+            state.action_log.append(encode_action(action))
+            return True
+        
+        if action.kind == "layoff" and state.current_phase == "discard":
+            owner = state.players[action.target & 1]
+            set_index = action.target >> 1
+            if not state.rules.layoffs or not 0 <= action.index < len(player.hand) or set_index >= len(owner.sets):
+                return False
+            card = player.hand[action.index]
+            extended_mask = owner.layoffs.set_masks[set_index] | card_bits[card]
+            if not owner.layoffs.get_targets(card) >> set_index & 1 or extended_mask not in state.rules.set_masks:
+                return False
+            # A new list rather than adding to the old one, since copies of the game share their sets (see copy_state_into)
+            owner.sets[set_index] = get_mask_cards(extended_mask)
+            owner.layoffs.extend_set(set_index, card)
+            del player.hand[action.index]
+            player.tracker.remove(card)
+            state.public_masks[state.current_player] &= ~card_bits[card]
+            if owner is not player:
+                player.laid_off.append(card)
+            state.action_log.append(encode_action(action))
+            return True
+        
+        if action.kind == "discard" and state.current_phase == "discard":
+            if not 0 <= action.index < len(player.hand):
+                return False
+            card = player.hand.pop(action.index)
+            player.tracker.remove(card)
+            state.public_masks[state.current_player] &= ~card_bits[card]
+            state.discard_pile.append(card)
+            state.current_player = not state.current_player # Changes current player
+            state.current_phase = "pick"
+            self.index_pickups(state)
+            state.action_log.append(encode_action(action))
+            return True
+        return False
+    
+    def replay(self, seed : int, action_log : list[int], p1_name : str = "Player 1",
+               p2_name : str = "Player 2", auto_meld : bool = False, rules : CompiledRules = standard_rules) -> State:
+        """ Rebuilds a game exactly from its seed and action log, without any pages
+        Args:
+            seed (int): The seed the game's deck was shuffled with
+            action_log (list[int]): The game's moves (see encode_action)
+            p1_name (str): Player 1's name
+            p2_name (str): Player 2's name
+            auto_meld (bool): Whether the game used auto-meld scoring
+            rules (CompiledRules): The variant the game was played with
+        Returns:
+            State: The state of the game after every move in the log
+        """
+        state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False,
+                      [card_backing_id], "pick", [])
+        self.deal(state, p1_name, p2_name, auto_meld, seed, rules)
+        for code in action_log:
+            if not self.apply(state, decode_action(code)):
+                raise ValueError("Move " + str(len(state.action_log)) + " of the action log is not allowed")
+        return state
+    
+    def score(self, state : State) -> None:
+        """ Works out each player's points at the end of the game. With auto-meld scoring, the best
+            sets left in each hand are laid down first so they are shown with the player's sets.
+            If the game ended with the deck still going, the current player emptied their hand and
+            gets the rules' bonus for going out. The points are set rather than added to, so scoring
+            a game again changes nothing.
+        Args:
+            state (State): The state, whose players' points are updated
+        """
+        if state.auto_meld:
+            for player in state.players:
+                sets, player.hand = auto_meld(player.hand, state.rules)
+                player.sets.extend(sets)
+                for card_set in sets:
+                    player.layoffs.add_set(get_hand_mask(card_set))
+                player.tracker = MeldTracker(get_hand_mask(player.hand))
+        scores = score_games(*encode_final_states([state]), state.rules)[0]
+        for player, points in zip(state.players, scores):
+            player.points = int(points)
+        if len(state.deck) > state.rules.end_deck_size:
+            state.players[state.current_player].points += state.rules.going_out_bonus
+
+
+game_engine = GameEngine()
+
+# --------------------- END OF GAME ENGINE -----------------------
+
+#  ---------------------- STATE ENCODING FUNCTIONS --------------------------
+
+# A State packed into a few dozen bytes, so the server can keep many more games in memory. Cards
+# are one byte each (their id) and every list is written as its length and then its items. The
+# other numbers are varints: 7 bits per byte, lowest bits first, with the top bit set on every
+# byte but the last. The phase, the current player, auto-meld and the computer's player share one
+# byte of flags, and the selected cards are one bitmask of hand indexes. A deck that has only been
+# drawn from since it was shuffled with the game's seed is stored as just the number of cards
+# drawn, since drawing that many again from a deck shuffled with the same seed gives it back.
+# Version 2 added the variant being played, as its place in rule_variant_names. Every game saved
+# with version 1 was played with the standard rules. Version 3 added the cards each player laid off
+# on the other player's sets, written at the end only when the laid-off flag is set, since most
+# games have none. Games saved before then never had any.
+
+state_format_version = 3
+state_phases = ["pick", "discard"]
+seeded_deck_flag = 1 << 5
+finished_flag = 1 << 6
+laid_off_flag = 1 << 7
+
+def write_varint(data : bytearray, value : int) -> None:
+    """ Adds a number that isn't negative to the end of some bytes
+    Args:
+        data (bytearray): The bytes, which are changed in place
+        value (int): The number
+    """
+    while value > 0x7F:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+
+def read_varint(data : bytes, offset : int) -> tuple[int, int]:
+    """ Reads a number written by write_varint
+    Args:
+        data (bytes): The bytes
+        offset (int): Where the number starts
+    Returns:
+        tuple[int, int]: The number and where the next thing starts
+    """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def write_signed(data : bytearray, value : int) -> None:
+    """ Adds a number that may be negative, such as a player's points, to the end of some bytes.
+        0, -1, 1, -2, 2... are written as 0, 1, 2, 3, 4... so small numbers stay small.
+    Args:
+        data (bytearray): The bytes, which are changed in place
+        value (int): The number
+    """
+    write_varint(data, value << 1 if value >= 0 else ~value << 1 | 1)
+
+def read_signed(data : bytes, offset : int) -> tuple[int, int]:
+    """ Reads a number written by write_signed
+    Args:
+        data (bytes): The bytes
+        offset (int): Where the number starts
+    Returns:
+        tuple[int, int]: The number and where the next thing starts
+    """
+    value, offset = read_varint(data, offset)
+    return (~(value >> 1) if value & 1 else value >> 1), offset
+
+def write_cards(data : bytearray, cards : list[int]) -> None:
+    """ Adds a list of card ids to the end of some bytes
+    Args:
+        data (bytearray): The bytes, which are changed in place
+        cards (list[int]): The card ids
+    """
+    write_varint(data, len(cards))
+    data.extend(cards)
+
+def read_cards(data : bytes, offset : int) -> tuple[list[int], int]:
+    """ Reads a list of card ids written by write_cards
+    Args:
+        data (bytes): The bytes
+        offset (int): Where the list starts
+    Returns:
+        tuple[list[int], int]: The card ids and where the next thing starts
+    """
+    length, offset = read_varint(data, offset)
+    return list(data[offset:offset + length]), offset + length
+
+def write_text(data : bytearray, text : str) -> None:
+    """ Adds some text, such as a player's name, to the end of some bytes
+    Args:
+        data (bytearray): The bytes, which are changed in place
+        text (str): The text
+    """
+    encoded = text.encode("utf-8")
+    write_varint(data, len(encoded))
+    data.extend(encoded)
+
+def read_text(data : bytes, offset : int) -> tuple[str, int]:
+    """ Reads some text written by write_text
+    Args:
+        data (bytes): The bytes
+        offset (int): Where the text starts
+    Returns:
+        tuple[str, int]: The text and where the next thing starts
+    """
+    length, offset = read_varint(data, offset)
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+def deal_seeded_deck(seed : int, top : int) -> Deck:
+    """ Shuffles a deck with a game's seed and draws from it
+    Args:
+        seed (int): The game's seed
+        top (int): How many cards to draw
+    Returns:
+        Deck: The deck after the cards are drawn
+    """
+    seeded_deck = shuffle_deck(deck, seed)
+    for i in range(top):
+        seeded_deck.draw()
+    return seeded_deck
+
+def encode_state(state : State) -> bytes:
+    """ Packs a State into bytes. decode_state gives back an equal State.
+    Args:
+        state (State): The state, which is not changed
+    Returns:
+        bytes: The state as bytes
+    """
+    data = bytearray([state_format_version])
+    flags = int(state.current_player) | state_phases.index(state.current_phase) << 1 | \
+            int(state.auto_meld) << 2 | (state.computer_player + 1) << 3
+    seeded = len(state.deck.cards) == card_backing_id and 0 <= state.deck.top <= card_backing_id and \
+             deal_seeded_deck(state.seed, state.deck.top) == state.deck
+    if state.finished:
+        flags |= finished_flag
+    laid_off = state.players[0].laid_off or state.players[1].laid_off
+    if laid_off:
+        flags |= laid_off_flag
+    data.append(flags | seeded_deck_flag if seeded else flags)
+    write_signed(data, state.seed)
+    if not seeded:
+        write_cards(data, state.deck.cards)
+        write_varint(data, state.deck.rng_state)
+    write_varint(data, state.deck.top)
+    write_cards(data, state.discard_pile)
+    for player_index, player in enumerate(state.players):
+        write_text(data, player.name)
+        write_signed(data, player.points)
+        write_cards(data, player.hand)
+        write_varint(data, len(player.sets))
+        for card_set in player.sets:
+            write_cards(data, card_set)
+        write_varint(data, state.public_masks[player_index])
+    selection = 0
+    for card_index in state.selected_cards:
+        selection |= 1 << card_index
+    write_varint(data, selection)
+    write_varint(data, state.pickup_index)
+    write_varint(data, len(state.action_log))
+    for code in state.action_log:
+        write_varint(data, code)
+    write_text(data, state.game_id)
+    write_varint(data, state.match_rounds)
+    write_varint(data, state.match_round)
+    for points in state.match_points:
+        write_signed(data, points)
+    write_varint(data, rule_variant_names.index(state.rules_name))
+    if laid_off:
+        for player in state.players:
+            write_cards(data, player.laid_off)
+    return bytes(data)
+
+def decode_state(data : bytes) -> State:
+    """ Unpacks a State from the bytes made by encode_state. The selected cards come back in order.
+    Args:
+        data (bytes): The state as bytes
+    Returns:
+        State: The state
+    """
+    if not 1 <= data[0] <= state_format_version:
+        raise ValueError("Unknown state format version " + str(data[0]))
+    flags = data[1]
+    seed, offset = read_signed(data, 2)
+    if flags & seeded_deck_flag:
+        top, offset = read_varint(data, offset)
+        state_deck = deal_seeded_deck(seed, top)
+    else:
+        cards, offset = read_cards(data, offset)
+        rng_state, offset = read_varint(data, offset)
+        top, offset = read_varint(data, offset)
+        state_deck = Deck(cards, top, rng_state)
+    discard_pile, offset = read_cards(data, offset)
+    players = []
+    public_masks = []
+    for player_index in range(2):
+        name, offset = read_text(data, offset)
+        points, offset = read_signed(data, offset)
+        hand, offset = read_cards(data, offset)
+        set_count, offset = read_varint(data, offset)
+        sets = []
+        for set_index in range(set_count):
+            card_set, offset = read_cards(data, offset)
+            sets.append(card_set)
+        public_mask, offset = read_varint(data, offset)
+        players.append(Player(name, hand, sets, points))
+        public_masks.append(public_mask)
+    selection, offset = read_varint(data, offset)
+    pickup_index, offset = read_varint(data, offset)
+    log_length, offset = read_varint(data, offset)
+    action_log = []
+    for move in range(log_length):
+        code, offset = read_varint(data, offset)
+        action_log.append(code)
+    game_id, offset = read_text(data, offset)
+    match_rounds, offset = read_varint(data, offset)
+    match_round, offset = read_varint(data, offset)
+    match_points = []
+    for player_index in range(2):
+        points, offset = read_signed(data, offset)
+        match_points.append(points)
+    rules_name = "Standard"
+    if data[0] >= 2:
+        variant_index, offset = read_varint(data, offset)
+        rules_name = rule_variant_names[variant_index]
+    if flags & laid_off_flag:
+        for player in players:
+            player.laid_off, offset = read_cards(data, offset)
+    return State(state_deck, players, bool(flags & 1), discard_pile, state_phases[flags >> 1 & 1],
+                 [card_index for card_index in range(selection.bit_length()) if selection >> card_index & 1],
+                 bool(flags >> 2 & 1), seed, action_log, pickup_index, public_masks, (flags >> 3 & 0b11) - 1,
+                 game_id, match_rounds, match_round, match_points, bool(flags & finished_flag), rules_name)
+
+# Every browser plays its own game, kept packed into bytes between clicks. Games are evicted
+# after sitting idle for a while, or when there are too many and they are the least recently played.
+session_store = SessionStore(int(os.environ.get("GIN_RUMMY_MAX_GAMES", 1000)),
+                             float(os.environ.get("GIN_RUMMY_IDLE_SECONDS", 3600)),
+                             pack=encode_state, unpack=decode_state)
+
+# Games are also saved to a SQLite database when GIN_RUMMY_DATABASE is set to its path, so
+# they can be resumed after the server restarts (see storage.py)
+game_database = None
+
+# Every finished deal updates the players' ratings, so each deal of a match is rated on its own. They
+# are kept in the game database's file when there is one, and only until the server stops otherwise.
+player_ratings = Leaderboard()
+
+live_games = Gauge("gin_rummy_live_games", "How many games are kept in memory", lambda: len(session_store))
+
+def save_game(state : State) -> None:
+    """ Queues a game to be written to the game database, if there is one. Routes call this
+        after every move. It doesn't wait for the disk.
+    Args:
+        state (State): The state
+    """
+    if game_database is not None and state.game_id:
+        game_database.save(state.game_id, encode_state(state), state.action_log)
+
+# --------------------- END OF STATE ENCODING FUNCTIONS -----------------------
+
+#  ---------------------- COMPUTER PLAYER FUNCTIONS --------------------------
+
+# The computer plays with information-set Monte Carlo tree search (IS-MCTS). It can't see the other
+# player's hand (apart from cards it watched them pick up) or the order of the deck, so each pass of
+# the search starts by dealing the unseen cards out at random ("determinizing"). It then walks down
+# one shared tree of moves, plays the game on for a few turns with the greedy strategy, and scores
+# the result. Moves are stored in the tree by card rather than by hand index so the same move means
+# the same thing in every determinization. The search stops when its time is up and makes the move
+# that was tried the most.
+computer_move_seconds = 0.05 # The time the computer gets to think about each move
+rollout_turns = 4            # How many turns each playout looks ahead before the hands are scored
+exploration = 0.7            # How much the search favours moves it hasn't tried much
+max_tree_nodes = 1 << 20     # Tree edges are looked up by (move key << 20 | node)
+
+def greedy_policy(engine : GameEngine, state : State, rng : random.Random) -> Action:
+    """ Picks up from the discard pile whenever it is allowed (taking as few cards as possible),
+        lays down the sets that are worth the most points, lays off every card it can, and then
+        discards the card worth the most points that isn't part of any set.
+    Args:
+        engine (GameEngine): The rules being played
+        state (State): The state
+        rng (random.Random): The game's random number generator (used to break ties)
+    Returns:
+        Action: The move to make
+    """
+    hand = get_hand(state)
+    if state.current_phase == "pick":
+        legal_pickups = engine.get_legal_pickups(state)
+        if legal_pickups:
+            return Action("pick", legal_pickups[-1])
+        return Action("pick", 0)
+
+    tracker = state.players[state.current_player].tracker
+    points, melds = find_best_melds(tracker.hand_mask, state.rules)
+    if melds:
+        return Action("meld", selected=tuple(card_index for card_index, card in enumerate(hand)
+                                             if card_bits[card] & melds[0]))
+    layoffs = engine.get_legal_layoffs(state)
+    if layoffs:
+        return layoffs[0]
+
+    members_mask = tracker.get_members_mask(state.rules)
+    best_index, best_value = 0, -1.0
+    for card_index, card in enumerate(hand):
+        value = card_ranks[card] + rng.random() # Higher ranks are worth more points
+        if card_bits[card] & members_mask:
+            value -= 100                        # Keep cards that are close to making a set
+        if value > best_value:
+            best_index, best_value = card_index, value
+    return Action("discard", best_index)
+
+def get_move_key(state : State, action : Action) -> int:
+    """ Gets a number for a move that names the cards it uses instead of their spots in the hand
+    Args:
+        state (State): The state the move is made in
+        action (Action): The move
+    Returns:
+        int: The discard pile index, the card id, the bitboard of the set, or the target and the card id
+             of a lay-off, shifted left 2 with the kind
+    """
+    if action.kind == "pick":
+        return action.index << 2
+    hand = get_hand(state)
+    if action.kind == "discard":
+        return hand[action.index] << 2 | 1
+    if action.kind == "layoff":
+        return (action.target << 6 | hand[action.index]) << 2 | 3
+    meld_mask = 0
+    for card_index in action.selected:
+        meld_mask |= card_bits[hand[card_index]]
+    return meld_mask << 2 | 2
+
+def get_estimated_score(player : Player, auto_meld : bool, rules : CompiledRules = standard_rules,
+                        given_mask : int = 0) -> int:
+    """ Scores a player as if the game ended now, without changing anything
+    Args:
+        player (Player): The player
+        auto_meld (bool): Whether the leftover cards are scored as the best sets possible
+        rules (CompiledRules): The rules being played
+        given_mask (int): The bitboard of the cards the other player laid off on this player's sets,
+                          which count for the other player
+    Returns:
+        int: The points of the player's sets (and the cards they laid off) minus the points of their hand
+    """
+    sets_mask = get_hand_mask(player.laid_off)
+    for card_set in player.sets:
+        for card in card_set:
+            sets_mask |= card_bits[card]
+    sets_mask &= ~given_mask
+    score = get_mask_points(sets_mask, rules) - get_mask_points(player.tracker.hand_mask, rules)
+    if auto_meld: # The best sets move from the minus side to the plus side
+        score += 2 * find_best_melds(player.tracker.hand_mask, rules)[0]
+    return score
+
+def copy_state_into(target : State, source : State) -> None:
+    """ Copies one game into another without making new State, Player or Deck objects, so the
+        search can reuse the same scratch game for every pass. The sets are shared, since moves
+        only ever add new sets or replace a set that was laid off on.
+    Args:
+        target (State): The game to overwrite
+        source (State): The game to copy
+    """
+    target.deck.cards[:] = source.deck.cards
+    target.deck.top = source.deck.top
+    target.deck.rng_state = source.deck.rng_state
+    for target_player, source_player in zip(target.players, source.players):
+        target_player.hand[:] = source_player.hand
+        target_player.sets[:] = source_player.sets
+        target_player.tracker.hand_mask = source_player.tracker.hand_mask
+        target_player.laid_off[:] = source_player.laid_off
+        target_player.layoffs.copy_from(source_player.layoffs)
+    target.current_player = source.current_player
+    target.discard_pile[:] = source.discard_pile
+    target.current_phase = source.current_phase
+    target.auto_meld = source.auto_meld
+    target.rules_name = source.rules_name
+    target.pickup_index = source.pickup_index
+    target.public_masks[:] = source.public_masks
+    target.action_log.clear()
+
+def determinize(target : State, state : State, observer : int, rng : random.Random, unseen : list[int]) -> None:
+    """ Copies a game into target, but with every card the observer can't see dealt out again at random
+    Args:
+        target (State): The game to overwrite
+        state (State): The real game
+        observer (int): The index of the player who is searching
+        rng (random.Random): The random number generator
+        unseen (list[int]): The cards the observer can't see, reused as scratch space
+    """
+    copy_state_into(target, state)
+    opponent = target.players[1 - observer]
+    known_mask = state.public_masks[1 - observer]
+    hidden_count = len(opponent.hand) - known_mask.bit_count()
+    rng.shuffle(unseen)
+    opponent.hand[:] = get_mask_cards(known_mask)
+    opponent.hand.extend(unseen[:hidden_count])
+    opponent.tracker.hand_mask = get_hand_mask(opponent.hand)
+    # The deck shuffles itself as it is drawn from, so the rest only needs a new random seed
+    target.deck.cards[:] = unseen[hidden_count:]
+    target.deck.top = 0
+    target.deck.rng_state = rng.getrandbits(64)
+    game_engine.index_pickups(target)
+
+def choose_computer_move(engine : GameEngine, state : State, rng : random.Random,
+                         seconds : float = computer_move_seconds) -> Action:
+    """ Picks a move for the current player with IS-MCTS, stopping after the time budget
+    Args:
+        engine (GameEngine): The rules being played
+        state (State): The real game, which is not changed
+        rng (random.Random): The random number generator
+        seconds (float): How long to search for
+    Returns:
+        Action: The move that was tried the most
+    """
+    root_actions = engine.legal_actions(state)
+    if len(root_actions) == 1:
+        return root_actions[0]
+    deadline = time.perf_counter() + seconds
+    observer = int(state.current_player)
+
+    # Everything the observer can't see: the deck and the part of the opponent's hand they didn't pick up
+    visible_mask = get_hand_mask(get_hand(state)) | get_hand_mask(state.discard_pile[1:]) | \
+                   state.public_masks[1 - observer]
+    for player in state.players:
+        for card_set in player.sets:
+            visible_mask |= get_hand_mask(card_set)
+    unseen = get_mask_cards(((1 << 52) - 1) & ~visible_mask)
+
+    # The tree is kept in flat lists indexed by node number, and one scratch game is reused for every pass
+    visits, wins, available = [0], [0.0], [0]
+    edges = {}
+    path = []
+    scratch = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [], "pick", [])
+    while time.perf_counter() < deadline and len(visits) < max_tree_nodes:
+        determinize(scratch, state, observer, rng, unseen)
+        node = 0
+        path.clear()
+        expanded = False
+        # Selection and expansion: follow the tree until a move that hasn't been tried comes up
+        while not expanded and not engine.is_over(scratch):
+            actions = engine.legal_actions(scratch)
+            best_action, best_child, best_value = None, 0, -1.0
+            untried = []
+            for action in actions:
+                child = edges.get(get_move_key(scratch, action) << 20 | node)
+                if child is None:
+                    untried.append(action)
+                    continue
+                available[child] += 1
+                value = wins[child] / visits[child] + \
+                        exploration * (math.log(available[child]) / visits[child]) ** 0.5
+                if value > best_value:
+                    best_action, best_child, best_value = action, child, value
+            if untried:
+                best_action = rng.choice(untried)
+                best_child = len(visits)
+                edges[get_move_key(scratch, best_action) << 20 | node] = best_child
+                visits.append(0)
+                wins.append(0.0)
+                available.append(1)
+                expanded = True
+            path.append((best_child, int(scratch.current_player)))
+            engine.apply(scratch, best_action)
+            node = best_child
+
+        # Playout: a few turns of greedy play, then the hands are scored as they stand
+        turns = 0
+        while turns < rollout_turns and not engine.is_over(scratch):
+            action = greedy_policy(engine, scratch, rng)
+            engine.apply(scratch, action)
+            if action.kind == "discard":
+                turns += 1
+        observer_player, opponent = scratch.players[observer], scratch.players[1 - observer]
+        margin = get_estimated_score(observer_player, scratch.auto_meld, scratch.rules, get_hand_mask(opponent.laid_off)) - \
+                 get_estimated_score(opponent, scratch.auto_meld, scratch.rules, get_hand_mask(observer_player.laid_off))
+        reward = 0.5 + 0.5 * math.tanh(margin / 40)
+
+        # Backpropagation: each move is rated from the side of the player who made it
+        for child, mover in path:
+            visits[child] += 1
+            wins[child] += reward if mover == observer else 1 - reward
+
+    best_action, best_visits = root_actions[0], -1
+    for action in root_actions:
+        child = edges.get(get_move_key(state, action) << 20)
+        if child is not None and visits[child] > best_visits:
+            best_action, best_visits = action, visits[child]
+    return best_action
+
+def play_computer_turn(state : State) -> None:
+    """ Lets the computer play until it is the other player's turn or the game is over
+    Args:
+        state (State): The state, which is changed in place
+    """
+    rng = random.Random(state.seed ^ len(state.action_log))
+    while not game_engine.is_over(state) and int(state.current_player) == state.computer_player:
+        game_engine.apply(state, choose_computer_move(game_engine, state, rng))
+
+# --------------------- END OF COMPUTER PLAYER FUNCTIONS -----------------------
+
 @route
 def pick_up_card(state: State, card_index : int) -> Page:
     """ This route handles what to do when a player wants to pick up a
@@ -525,31 +2182,12 @@ def pick_up_card(state: State, card_index : int) -> Page:
     Returns:
         Page: Returns to the play_turn route to display the changes that were made from picking up a card
     """
-    if card_index > 0: # If picking up from the discard pile...
-        # check if this card would make a valid set with other cards in the player's hand
-        selected_card_coordinates = get_card_coordinates([state.discard_pile[card_index]])
-        rank = selected_card_coordinates[0][0]
-        suit = selected_card_coordinates[0][1]
- 
-        # Making copies of the hand and discard pile
-        temporary_discard_pile = state.discard_pile.copy() 
-        temporary_hand = get_hand(state).copy()
-        # This will append every card in the discard pile from the selected card to the end to the player's hand
-        for j in range(card_index, len(temporary_discard_pile)):
-            temporary_hand.append(temporary_discard_pile.pop(card_index))
-        # If a valid set can be made with the selected card,
-        # then the hand with the cards from the discard pile becomes the new hand.
-        if valid_set(False, temporary_hand, rank, suit):
-            state.players[state.current_player].hand = temporary_hand.copy()
-            state.discard_pile = temporary_discard_pile.copy()
-            state.current_phase = "discard"
-            return make_set(state)
-        
+    # A card from the discard pile can only be picked up if it makes a valid set
+    if not game_engine.apply(state, Action("pick", card_index)):
         return play_turn(state)
-        
-    # If picking up from the deck then append the first card from the deck to the player's hand.
-    state.current_phase = "discard"
-    state.players[state.current_player].hand.append(state.deck.pop(0))
+    save_game(state)
+    if card_index > 0: # If it was picked up from the discard pile, the player goes straight to making a set
+        return make_set(state)
     return play_turn(state)
 
 
@@ -567,7 +2205,9 @@ def select_sets(state : State, card_index: int, selected : bool) -> Page:
         Page: Returns to the make_set route to display changes to the text on the buttons
     """
     if selected:
-        state.selected_cards.append(card_index)
+        if card_index not in state.selected_cards:
+            # Kept in order so the selection can be stored as a bitmask (see encode_state)
+            bisect.insort(state.selected_cards, card_index)
     else:
         for index in state.selected_cards:
             if index == card_index:
@@ -587,61 +2227,43 @@ def confirm_sets(state : State) -> Page:
     """
     if not state.selected_cards:
         return play_turn(state)
-    # Converts indexes of selected cards from the hand back into URLs
-    card_urls = []
-    for card_index in state.selected_cards:
-        card_urls.append(get_hand(state)[card_index])
-    # The rank and suit designations for this set are to be compared to the first selected card  
-    rank = get_card_coordinates(card_urls)[0][0]      
-    suit = get_card_coordinates(card_urls)[0][1]
-    
-    if valid_set(True, card_urls, rank, suit):
-        state.players[state.current_player].sets.append(card_urls)
-        for url in card_urls:
-            state.players[state.current_player].hand.remove(url)
-        state.selected_cards = []
+    made_set = game_engine.apply(state, Action("meld", selected=tuple(state.selected_cards)))
+    state.selected_cards = []
+    if made_set:
+        save_game(state)
         return play_turn(state)
-    else:
-        state.selected_cards = []
-        return make_set(state)
+    return make_set(state)
     
+def finish_game(state : State) -> None:
+    """ Scores a finished deal, adds the points to the match and records the game on the
+        leaderboard. Only the first call for a deal that is over does anything, so showing the
+        final page again doesn't count the game twice and a deal still being played isn't scored.
+    Args:
+        state (State): The state, which is changed in place
+    """
+    if state.finished or not game_engine.is_over(state):
+        return
+    game_engine.score(state)
+    state.finished = True
+    for player_index, player in enumerate(state.players):
+        state.match_points[player_index] += player.points
+    player_ratings.record_game(state.players[0].name, state.players[0].points,
+                               state.players[1].name, state.players[1].points)
+    save_game(state)
+
 @route
 def win_conditions(state : State) -> Page:
-    """ Route that gets called when the game is over to display scoring information
-        Cannot be unit tested since the scoring is based on what the user is dealt
-        from the randomized deck.
+    """ Route that gets called when the game is over to display scoring information.
+        Like any route it can be opened by its URL, so a deal that isn't over goes back to play_turn.
     Args:
         state (State): The state
     Returns:
-        Page: The page with scoring information
-    """
-    # Converts 5 and 10 point cards into 1D lists of their URLs
-    five_point_cards = []
-    ten_point_cards = []
-    for rank in deck[:9]:               # Ace to 9
-        for card in rank:
-            five_point_cards.append(card)
-    for rank in deck[9:]:               # 10 to King
-        for card in rank:
-            ten_point_cards.append(card)
-    
-    # Checks to see if a card in the player's hand or pairs is worth 5 or 10 points
-    for player in state.players:
-        for card_set in player.sets:
-            for card in card_set:
-                if card in five_point_cards:
-                    player.points += 5
-                if card in ten_point_cards:
-                    player.points += 10
-                    
-        for card in player.hand:
-            if card in five_point_cards:
-                player.points -= 5
-            if card in ten_point_cards:
-                player.points -= 10
-    
-    
-    return Page(state, [
+        Page: The page with scoring information, or the current turn if the deal isn't over
+    """
+    if not game_engine.is_over(state):
+        return play_turn(state)
+    finish_game(state)
+    content = [
         "Game OVER",
         state.players[0].name + " has " + str(state.players[0].points) + " points.",
         "Hand",
@@ -653,8 +2275,64 @@ def win_conditions(state : State) -> Page:
         display_cards(state.players[1].hand),
         "Sets",
         display_sets(state.players[1].sets),
-        "Thanks for playing!"
+        "Thanks for playing!",
+        Link("Leaderboard", "/leaderboard")
+    ]
+    if state.match_rounds > 1:
+        match_score = (state.players[0].name + " " + str(state.match_points[0]) + ", " +
+                       state.players[1].name + " " + str(state.match_points[1]))
+        if state.match_round < state.match_rounds:
+            content[-2:-1] = ["Match score after deal " + str(state.match_round) + " of " + str(state.match_rounds) +
+                              ": " + match_score, Button("Next deal", "/next_deal")]
+        else:
+            winner = max(range(2), key=lambda player_index: state.match_points[player_index])
+            content.insert(-2, "Final match score: " + match_score + ". " + (
+                "The match is a draw!" if state.match_points[0] == state.match_points[1] else
+                state.players[winner].name + " wins the match!"))
+    return Page(state, content)
+
+@route
+def leaderboard(state : State) -> Page:
+    """ Route that shows the best rated players. Ratings are updated after every deal, not every match.
+    Args:
+        state (State): The state
+    Returns:
+        Page: The page with the leaderboard
+    """
+    rows = [["", "Player", "Rating", "Deals", "Win rate", "Average margin"]]
+    for place, player in enumerate(player_ratings.get_top(20), 1):
+        rows.append([str(place), player.name, str(round(player.rating)), str(player.games),
+                     str(round(player.get_win_rate() * 100)) + "%", str(round(player.get_average_margin(), 1))])
+    return Page(state, [
+        "Leaderboard",
+        Table(rows),
+        str(player_ratings.count_games()) + " deals played (each deal is rated)",
+        Button("Back", "index")
     ])
+
+@route
+def tables(state : State) -> Page:
+    """ Route that shows how many games the server is hosting and how much memory they use
+    Args:
+        state (State): The state
+    Returns:
+        Page: The page with the server's game information
+    """
+    session_store.evict_idle()
+    cache_info = get_render_cache_info()
+    content = [
+        "Live games: " + str(len(session_store)) + " of " + str(session_store.max_games),
+        "Games evicted: " + str(session_store.evicted),
+        "Memory per game between moves: about " + str(session_store.get_memory_per_game()) +
+        " bytes (packed into bytes)",
+        "Memory of a game while a move is made: about " + str(get_deep_size(state)) + " bytes (this game's State)",
+        "Render cache: " + str(cache_info[0]) + " hits, " + str(cache_info[1]) + " misses",
+        Button("Back", "index")
+    ]
+    if game_database is not None:
+        content.insert(5, "Saved games: " + str(game_database.count()) + " (" + str(len(game_database.pending)) +
+                          " waiting to be written)")
+    return Page(state, content)
         
 
 # ------------------------------------------------------------------------------------------------------
@@ -662,216 +2340,505 @@ def win_conditions(state : State) -> Page:
 
 # I've tried to make these assert_equal lines as short as possible
 # but some of them are inherently long and cannot be broken up.
+# They are skipped in production mode, since they would run every time the module is imported.
+if not production_mode:
+    assert_equal(display_sets([[0, 1, 2],[3, 4, 5]]),
+        Table(rows=[["<img src='https://tinyurl.com/26navyx5'  style='width: 82; height: 140'>", \
+            "<img src='https://tinyurl.com/25ok22e9'  style='width: 82; height: 140'>", \
+            "<img src='https://tinyurl.com/234sluca'  style='width: 82; height: 140'>"],
+            ["<img src='https://tinyurl.com/2b8ccqbs'  style='width: 82; height: 140'>", \
+            "<img src='https://tinyurl.com/2d2cvtto'  style='width: 82; height: 140'>", \
+            "<img src='https://tinyurl.com/29vgmnrc'  style='width: 82; height: 140'>"]]))
 
-assert_equal(display_sets([["url1","url2","url3"],["url4","url5","url6"]]),
-    Table(rows=[["<img src='/__images/url1'  style='width: 82; height: 140'>", \
-        "<img src='/__images/url2'  style='width: 82; height: 140'>", \
-        "<img src='/__images/url3'  style='width: 82; height: 140'>"],
-        ["<img src='/__images/url4'  style='width: 82; height: 140'>", \
-        "<img src='/__images/url5'  style='width: 82; height: 140'>", \
-        "<img src='/__images/url6'  style='width: 82; height: 140'>"]]))
-
-assert_equal(format_cards(["url1", "url2", "url3"]),
-    [[Image(url='url1', width=82, height=140), Image(url='url2', width=82, height=140),
-      Image(url='url3', width=82, height=140)], []])
-
-assert_equal(display_cards(["url1", "url2", "url3"]),
-    Table(rows=[["<img src='/__images/url1'  style='width: 82; height: 140'>", \
-                 "<img src='/__images/url2'  style='width: 82; height: 140'>", \
-                 "<img src='/__images/url3'  style='width: 82; height: 140'>"], []]))
-
-assert_equal(get_hand(State([],[Player("",["card1", "card2"],[],0),
-    Player("",["card3", "card4"],[],0)],False,[card_backing],"pick",[])),
-        ["card1", "card2"])
-
-assert_equal(get_hand(State([],[Player("",["card1", "card2"],[],0),
-    Player("",["card3", "card4"],[],0)],True,[card_backing],"pick",[])),
-        ["card3", "card4"])
-
-assert_equal(display_pick_buttons(["url1", "url2"], "/pick_up_card"),
-    Table(rows=[["<img src='/__images/url1'  style='width: 82; height: 140'>",
-                 "<img src='/__images/url2'  style='width: 82; height: 140'>"],
-                ["<input type='hidden' name='&quot;Pick0&quot;$@~@$card_index'"+
-                 " value='0' /><button type='submit' name='--submit-button' "+
-                 "value='&quot;Pick0&quot;' formaction='/pick_up_card?--"+
-                 "submit-button=Pick0' >Pick0</button>",
-                 "<input type='hidden' name='&quot;Pick1&quot;$@~@$card_index'"+
-                 " value='1' /><button type='submit' name='--submit-button' va"+
-                 "lue='&quot;Pick1&quot;' formaction='/pick_up_card?--"+
-                 "submit-button=Pick1' >Pick1</button>"]]))
-
-
-assert_equal(display_pick_buttons(["url1"], "/discard"),
-    Table(rows=[["<img src='/__images/url1'  style='width: 82; height: 140'>"],
-                ["<input type='hidden' name='&quot;Pick0&quot;$@~@$card_index"+
-                 "' value='0' /><button type='submit' name='--submit-button' "+
-                 "value='&quot;Pick0&quot;' formaction='/discard?--submit-"+
-                 "button=Pick0' >Pick0</button>"]]))
-
-assert_equal(display_select_buttons(State([],[Player("",["card1", "card2"],[],0),
-        Player("",[],[],0)],False,[card_backing],"pick",[])),
-    Table(rows=[["<img src='/__images/card1'  style='width: 82; height: 140'>",
-                 "<img src='/__images/card2'  style='width: 82; height: 140'>"],
-                ["<input type='hidden' name='&quot;Select0&quot;$@~@$card_"+
-                 "index' value='0' />\n<input type='hidden' name='&quot;"+
-                 "Select0&quot;$@~@$selected' value='true' /><button type="+
-                 "'submit' name='--submit-button' value='&quot;Select0&quo"+
-                 "t;' formaction='/select_sets?--submit-button=Select0' >Select0</button>",
-                 "<input type='hidden' name='&quot;Select1&quot;$@~@$card_"+
-                 "index' value='1' />\n<input type='hidden' name='&quot;Se"+
-                 "lect1&quot;$@~@$selected' value='true' /><button type="+
-                 "'submit' name='--submit-button' value='&quot;Select1&q"+
-                 "uot;' formaction='/select_sets?--submit-button=Select1' >Select1</button>"]]))
-
-assert_equal(
- index(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
-    Player(name='', hand=[], sets=[], points=0)], current_player=False, \
-    discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'], \
-    current_phase='pick', selected_cards=[])),
- Page(state=State(deck=[],
-                 players=[Player(name='', hand=[], sets=[], points=0),
-                Player(name='', hand=[], sets=[], points=0)],
-                 current_player=False,
-                 discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'],
-                 current_phase='pick',
-                 selected_cards=[]),
- content=['Welcome to Gin Rummy!',
-          'To view instructions, use the dropdown below.',
-          Span(SelectBox(name='instructions',
-                         options=['Game Setup', 'Rules of Play', 'Winning'], default_value=''),
-               Button(text='View Instructions', url='/view_instructions',
-                      arguments=[Argument(name='p1_name', value='Player 1'),
-                        Argument(name='p2_name', value='Player 2')])),
-          'To get started, enter your names',
-          Span("Player 1's Name: ", TextBox(name='p1_name', kind='text', default_value='Player 1')),
-          Span("Player 2's Name: ", TextBox(name='p2_name', kind='text', default_value='Player 2')),
-          Button(text='START GAME', url='/deal_cards')]))
-
-assert_equal(
- view_instructions(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
-        Player(name='', hand=[], sets=[], points=0)], 
-        current_player=False,
-                discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'], 
-                current_phase='pick', selected_cards=[]), 'Game Setup', 'Player 1', 'Player 2'),
- Page(state=State(deck=[],
-                 players=[Player(name='', hand=[], sets=[], points=0),
+    assert_equal(format_cards([0, 1, 2]),
+        [[Image(url='https://tinyurl.com/26navyx5', width=82, height=140), Image(url='https://tinyurl.com/25ok22e9', width=82, height=140),
+          Image(url='https://tinyurl.com/234sluca', width=82, height=140)], []])
+
+    assert_equal(display_cards([0, 1, 2]),
+        Table(rows=[["<img src='https://tinyurl.com/26navyx5'  style='width: 82; height: 140'>", \
+                     "<img src='https://tinyurl.com/25ok22e9'  style='width: 82; height: 140'>", \
+                     "<img src='https://tinyurl.com/234sluca'  style='width: 82; height: 140'>"], []]))
+
+    assert_equal(get_hand(State([],[Player("",[0, 1],[],0),
+        Player("",[2, 3],[],0)],False,[card_backing_id],"pick",[])),
+            [0, 1])
+
+    assert_equal(get_hand(State([],[Player("",[0, 1],[],0),
+        Player("",[2, 3],[],0)],True,[card_backing_id],"pick",[])),
+            [2, 3])
+
+    assert_equal(display_pick_buttons([0, 1], "/pick_up_card"),
+        Table(rows=[["<img src='https://tinyurl.com/26navyx5'  style='width: 82; height: 140'>",
+                     "<img src='https://tinyurl.com/25ok22e9'  style='width: 82; height: 140'>"],
+                    ["<input type='hidden' name='&quot;Pick0&quot;$@~@$card_index'"+
+                     " value='0' /><button type='submit' name='--submit-button' "+
+                     "value='&quot;Pick0&quot;' formaction='/pick_up_card?--"+
+                     "submit-button=Pick0' >Pick0</button>",
+                     "<input type='hidden' name='&quot;Pick1&quot;$@~@$card_index'"+
+                     " value='1' /><button type='submit' name='--submit-button' va"+
+                     "lue='&quot;Pick1&quot;' formaction='/pick_up_card?--"+
+                     "submit-button=Pick1' >Pick1</button>"]]))
+
+
+    assert_equal(display_pick_buttons([0], "/discard"),
+        Table(rows=[["<img src='https://tinyurl.com/26navyx5'  style='width: 82; height: 140'>"],
+                    ["<input type='hidden' name='&quot;Pick0&quot;$@~@$card_index"+
+                     "' value='0' /><button type='submit' name='--submit-button' "+
+                     "value='&quot;Pick0&quot;' formaction='/discard?--submit-"+
+                     "button=Pick0' >Pick0</button>"]]))
+
+    assert_equal(display_select_buttons(State([],[Player("",[0, 1],[],0),
+            Player("",[],[],0)],False,[card_backing_id],"pick",[])),
+        Table(rows=[["<img src='https://tinyurl.com/26navyx5'  style='width: 82; height: 140'>",
+                     "<img src='https://tinyurl.com/25ok22e9'  style='width: 82; height: 140'>"],
+                    ["<input type='hidden' name='&quot;Select0&quot;$@~@$card_"+
+                     "index' value='0' />\n<input type='hidden' name='&quot;"+
+                     "Select0&quot;$@~@$selected' value='true' /><button type="+
+                     "'submit' name='--submit-button' value='&quot;Select0&quo"+
+                     "t;' formaction='/select_sets?--submit-button=Select0' >Select0</button>",
+                     "<input type='hidden' name='&quot;Select1&quot;$@~@$card_"+
+                     "index' value='1' />\n<input type='hidden' name='&quot;Se"+
+                     "lect1&quot;$@~@$selected' value='true' /><button type="+
+                     "'submit' name='--submit-button' value='&quot;Select1&q"+
+                     "uot;' formaction='/select_sets?--submit-button=Select1' >Select1</button>"]]))
+
+    # Showing the same cards again reuses the cached Table
+    assert_equal(display_cards([0, 1, 2]) is display_cards([0, 1, 2]), True)
+    assert_equal(display_sets([[0, 1, 2]]) is display_sets([[0, 1, 2]]), True)
+
+    assert_equal(
+     index(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
+        Player(name='', hand=[], sets=[], points=0)], current_player=False, \
+        discard_pile=[card_backing_id], \
+        current_phase='pick', selected_cards=[])),
+     Page(state=State(deck=[],
+                     players=[Player(name='', hand=[], sets=[], points=0),
                     Player(name='', hand=[], sets=[], points=0)],
+                     current_player=False,
+                     discard_pile=[card_backing_id],
+                     current_phase='pick',
+                     selected_cards=[]),
+     content=['Welcome to Gin Rummy!',
+              'To view instructions, use the dropdown below.',
+              Span(SelectBox(name='instructions',
+                             options=['Game Setup', 'Rules of Play', 'Winning'], default_value=''),
+                   Button(text='View Instructions', url='/view_instructions',
+                          arguments=[Argument(name='p1_name', value='Player 1'),
+                            Argument(name='p2_name', value='Player 2')])),
+              'To get started, enter your names',
+              Span("Player 1's Name: ", TextBox(name='p1_name', kind='text', default_value='Player 1')),
+              Span("Player 2's Name: ", TextBox(name='p2_name', kind='text', default_value='Player 2')),
+              Span("Score leftover cards as sets (auto-meld): ", CheckBox(name='auto_meld', default_value=False)),
+              Span("Play against the computer as Player 2: ", CheckBox(name='computer', default_value=False)),
+              Span("Deals in the match: ", SelectBox(name='rounds', options=['1', '3', '5', '7'], default_value='')),
+              Span("Rules: ", SelectBox(name='variant', options=['Standard', 'Aces high or low', 'Ten cards', 'Sets of four',
+                                                                 'No lay-offs'],
+                                              default_value='')),
+              Button(text='START GAME', url='/deal_cards'),
+              Link(text='Leaderboard', url='/leaderboard')]))
+
+    assert_equal(
+     view_instructions(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
+            Player(name='', hand=[], sets=[], points=0)], 
+            current_player=False,
+                    discard_pile=[card_backing_id], 
+                    current_phase='pick', selected_cards=[]), 'Game Setup', 'Player 1', 'Player 2'),
+     Page(state=State(deck=[],
+                     players=[Player(name='', hand=[], sets=[], points=0),
+                        Player(name='', hand=[], sets=[], points=0)],
+                     current_player=False,
+                     discard_pile=[card_backing_id],
+                     current_phase='pick',
+                     selected_cards=[]),
+     content=['Gin Rummy is a two-player game with alternating turns',
+              'Each player is first dealt 7 random cards',
+              'The remaining cards in the deck shall be available face down in a stack',
+              'The top card from the deck is placed face up next to the deck; this is the start of the discard pile.',
+              'At the end of each turn, a player MUST discard a card from their hand which gets placed face-up next to '
+              'the previously discarded card.',
+              Span(Button(text='Back', url='/'), Button(text='Next', url='/view_instructions', 
+                        arguments=[Argument(name='instructions', value='Rules of Play'),
+                            Argument(name='p1_name', value='Player 1'),
+                                Argument(name='p2_name', value='Player 2')]))]))
+    assert_equal(
+     index(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
+        Player(name='', hand=[], sets=[], points=0)], current_player=False, \
+        discard_pile=[card_backing_id], \
+        current_phase='pick', selected_cards=[])),
+     Page(state=State(deck=[],
+                 players=[Player(name='', hand=[], sets=[], points=0),
+                          Player(name='', hand=[], sets=[], points=0)],
                  current_player=False,
-                 discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'],
+                 discard_pile=[card_backing_id],
                  current_phase='pick',
                  selected_cards=[]),
- content=['Gin Rummy is a two-player game with alternating turns',
-          'Each player is first dealt 7 random cards',
-          'The remaining cards in the deck shall be available face down in a stack',
-          'The top card from the deck is placed face up next to the deck; this is the start of the discard pile.',
-          'At the end of each turn, a player MUST discard a card from their hand which gets placed face-up next to '
-          'the previously discarded card.',
-          Span(Button(text='Back', url='/'), Button(text='Next', url='/view_instructions', 
-                    arguments=[Argument(name='instructions', value='Rules of Play'),
-                        Argument(name='p1_name', value='Player 1'),
-                            Argument(name='p2_name', value='Player 2')]))]))
-assert_equal(
- index(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
-    Player(name='', hand=[], sets=[], points=0)], current_player=False, \
-    discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'], \
-    current_phase='pick', selected_cards=[])),
- Page(state=State(deck=[],
+         content=['Welcome to Gin Rummy!',
+                  'To view instructions, use the dropdown below.',
+                  Span(SelectBox(name='instructions',
+                    options=['Game Setup', 'Rules of Play', 'Winning'], default_value=''),
+                    Button(text='View Instructions', url='/view_instructions',
+                           arguments=[Argument(name='p1_name', value='Player 1'),
+                                Argument(name='p2_name', value='Player 2')])),
+                  'To get started, enter your names',
+                  Span("Player 1's Name: ", TextBox(name='p1_name',
+                                kind='text', default_value='Player 1')),
+                  Span("Player 2's Name: ", TextBox(name='p2_name',
+                                kind='text', default_value='Player 2')),
+                  Span("Score leftover cards as sets (auto-meld): ", CheckBox(name='auto_meld', default_value=False)),
+              Span("Play against the computer as Player 2: ", CheckBox(name='computer', default_value=False)),
+                  Span("Deals in the match: ", SelectBox(name='rounds', options=['1', '3', '5', '7'], default_value='')),
+                  Span("Rules: ", SelectBox(name='variant', options=['Standard', 'Aces high or low', 'Ten cards', 'Sets of four',
+                                                                     'No lay-offs'],
+                                                  default_value='')),
+                  Button(text='START GAME', url='/deal_cards'),
+                  Link(text='Leaderboard', url='/leaderboard')]))
+    assert_equal(
+     view_instructions(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
+        Player(name='', hand=[], sets=[], points=0)], current_player=False, \
+        discard_pile=[card_backing_id], \
+        current_phase='pick', selected_cards=[]), 'Game Setup', 'Player 1', 'Player 2'),
+     Page(state=State(deck=[],
              players=[Player(name='', hand=[], sets=[], points=0),
                       Player(name='', hand=[], sets=[], points=0)],
              current_player=False,
-             discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'],
+             discard_pile=[card_backing_id],
              current_phase='pick',
              selected_cards=[]),
-     content=['Welcome to Gin Rummy!',
-              'To view instructions, use the dropdown below.',
-              Span(SelectBox(name='instructions',
-                options=['Game Setup', 'Rules of Play', 'Winning'], default_value=''),
-                Button(text='View Instructions', url='/view_instructions',
-                       arguments=[Argument(name='p1_name', value='Player 1'),
-                            Argument(name='p2_name', value='Player 2')])),
-              'To get started, enter your names',
-              Span("Player 1's Name: ", TextBox(name='p1_name',
-                            kind='text', default_value='Player 1')),
-              Span("Player 2's Name: ", TextBox(name='p2_name',
-                            kind='text', default_value='Player 2')),
-              Button(text='START GAME', url='/deal_cards')]))
-assert_equal(
- view_instructions(State(deck=[], players=[Player(name='', hand=[], sets=[], points=0), \
-    Player(name='', hand=[], sets=[], points=0)], current_player=False, \
-    discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'], \
-    current_phase='pick', selected_cards=[]), 'Game Setup', 'Player 1', 'Player 2'),
- Page(state=State(deck=[],
+     content=['Gin Rummy is a two-player game with alternating turns',
+          'Each player is first dealt 7 random cards',
+          'The remaining cards in the deck shall be available face down in a stack',
+          'The top card from the deck is placed face up next to the deck; this is the start of the discard pile.',
+          'At the end of each turn, a player MUST discard a card from their hand which gets placed face-up next to '
+          'the previously discarded card.',
+          Span(Button(text='Back', url='/'), Button(text='Next', url='/view_instructions',
+            arguments=[Argument(name='instructions', value='Rules of Play'),
+                       Argument(name='p1_name', value='Player 1'),
+                       Argument(name='p2_name', value='Player 2')]))]))
+
+    assert_equal(
+     view_instructions(State(deck=[],
+        players=[Player(name='', hand=[], sets=[], points=0),
+        Player(name='', hand=[], sets=[], points=0)], current_player=False,
+        discard_pile=[card_backing_id],
+        current_phase='pick', selected_cards=[]), 'Winning', 'Player 1', 'Player 2'),
+     Page(state=State(deck=[],
          players=[Player(name='', hand=[], sets=[], points=0),
-                  Player(name='', hand=[], sets=[], points=0)],
+            Player(name='', hand=[], sets=[], points=0)],
          current_player=False,
-         discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'],
+         discard_pile=[card_backing_id],
          current_phase='pick',
          selected_cards=[]),
- content=['Gin Rummy is a two-player game with alternating turns',
-      'Each player is first dealt 7 random cards',
-      'The remaining cards in the deck shall be available face down in a stack',
-      'The top card from the deck is placed face up next to the deck; this is the start of the discard pile.',
-      'At the end of each turn, a player MUST discard a card from their hand which gets placed face-up next to '
-      'the previously discarded card.',
-      Span(Button(text='Back', url='/'), Button(text='Next', url='/view_instructions',
-        arguments=[Argument(name='instructions', value='Rules of Play'),
-                   Argument(name='p1_name', value='Player 1'),
-                   Argument(name='p2_name', value='Player 2')]))]))
-
-assert_equal(
- view_instructions(State(deck=[],
-    players=[Player(name='', hand=[], sets=[], points=0),
-    Player(name='', hand=[], sets=[], points=0)], current_player=False,
-    discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'],
-    current_phase='pick', selected_cards=[]), 'Winning', 'Player 1', 'Player 2'),
- Page(state=State(deck=[],
-     players=[Player(name='', hand=[], sets=[], points=0),
-        Player(name='', hand=[], sets=[], points=0)],
-     current_player=False,
-     discard_pile=['https://m.media-amazon.com/images/I/614IlbYs76L._AC_UF1000,1000_QL80_.jpg'],
-     current_phase='pick',
-     selected_cards=[]),
-     content=["Play continues until either a player's hand is empty or the deck is depleted",
-      'Scoring will commence in this format:',
-      'Ranks A - 9 will be worth 5 points.',
-      'Ranks 10 - K will be worth 10 points.',
-      'The score is compiled for each player by calculating the total number of points from each card in the '
-      "player's sets minus the total number of points in the player's hand.",
-      'The player with the most points at the end wins!',
-      Span(Button(text='Back', url='/view_instructions',
-        arguments=[Argument(name='instructions', value='Rules of Play'),
-            Argument(name='p1_name', value='Player 1'),
-            Argument(name='p2_name', value='Player 2')]),
-            Button(text='Next', url='/'))]))
-
-assert_equal(get_card_coordinates(
-    ['https://tinyurl.com/2d2cvtto',
-     'https://tinyurl.com/29vgmnrc']),
-     [[1, 0],[1,1]])
-
-assert_equal(check_standard_rank_set(False, [[1, 0],[1,1],[1, 3],[2, 5]], 1), True)
-assert_equal(check_standard_rank_set(True, [[5, 2],[5,1],[5, 3],[2, 5]], 5), False)
-assert_equal(check_standard_rank_set(False, [[2, 0],[2,1],[2, 3],[2, 5]], 2), True)
-
-assert_equal(check_standard_suit_set(False, [[1, 0],[2,0],[3, 0],[6, 3]], 1, 0), True)
-assert_equal(check_standard_suit_set(True, [[5, 2],[4,2],[6, 2]], 1, 0), False)
-assert_equal(check_standard_suit_set(True, [[1, 0],[2,0],[3, 0],[2, 5]], 1, 0), False)
-assert_equal(check_standard_suit_set(True, [[7,0],[8,0],[9,0]], 7, 0), True)
-
-assert_equal(valid_set(True,
-    ['https://tinyurl.com/2d2cvtto',
-     'https://tinyurl.com/279kzacw',
-     'https://tinyurl.com/27vu6za6'],
-        1, 0), True)
-assert_equal(valid_set(False,
-    ['https://tinyurl.com/2bp8eyzv',
-     'https://tinyurl.com/27quodmz',
-     'https://tinyurl.com/2cn4x9ws',
-     'https://tinyurl.com/2yvs9gh6'],
-        8, 1), True)
-
-
-#hide_debug_information()
-set_website_framed(False)
-set_website_title("Gin Rummy")
-start_server(State([],[Player("",[],[],0), Player("",[],[],0)],False,[card_backing],"pick",[]))
+         content=["Play continues until either a player's hand is empty or the deck is depleted",
+          'Scoring will commence in this format:',
+          'Ranks A - 9 will be worth 5 points.',
+          'Ranks 10 - K will be worth 10 points.',
+          'The score is compiled for each player by calculating the total number of points from each card in the '
+          "player's sets minus the total number of points in the player's hand.",
+          'With auto-meld scoring, the cards left in each hand are first made into the best sets possible.',
+          'The player with the most points at the end wins!',
+          Span(Button(text='Back', url='/view_instructions',
+            arguments=[Argument(name='instructions', value='Rules of Play'),
+                Argument(name='p1_name', value='Player 1'),
+                Argument(name='p2_name', value='Player 2')]),
+                Button(text='Next', url='/'))]))
+
+    assert_equal(get_card_coordinates([4, 5]), [[1, 0],[1,1]])
+
+    assert_equal(get_hand_mask([get_card_id(0, 0), get_card_id(1, 0), get_card_id(0, 1)]), 0b11 | 1 << 13)
+    assert_equal(get_mask_cards(0b11 | 1 << 13), [get_card_id(0, 0), get_card_id(1, 0), get_card_id(0, 1)])
+
+    assert_equal(check_standard_rank_set(False, get_hand_mask([get_card_id(1, 0), get_card_id(1, 1),
+                                                               get_card_id(1, 3), get_card_id(2, 2)]), 1), True)
+    assert_equal(check_standard_rank_set(True, get_hand_mask([get_card_id(5, 2), get_card_id(5, 1),
+                                                              get_card_id(5, 3), get_card_id(2, 3)]), 5), False)
+    assert_equal(check_standard_rank_set(False, get_hand_mask([get_card_id(2, 0), get_card_id(2, 1),
+                                                               get_card_id(2, 3), get_card_id(4, 0)]), 2), True)
+
+    assert_equal(check_standard_suit_set(False, get_hand_mask([get_card_id(1, 0), get_card_id(2, 0),
+                                                               get_card_id(3, 0), get_card_id(6, 3)]), 1, 0), True)
+    assert_equal(check_standard_suit_set(True, get_hand_mask([get_card_id(5, 2), get_card_id(4, 2),
+                                                              get_card_id(6, 2)]), 1, 0), False)
+    assert_equal(check_standard_suit_set(True, get_hand_mask([get_card_id(1, 0), get_card_id(2, 0),
+                                                              get_card_id(3, 0), get_card_id(2, 3)]), 1, 0), False)
+    assert_equal(check_standard_suit_set(True, get_hand_mask([get_card_id(7, 0), get_card_id(8, 0),
+                                                              get_card_id(9, 0)]), 7, 0), True)
+    assert_equal(check_standard_suit_set(True, get_hand_mask([get_card_id(7, 0), get_card_id(8, 0),
+                                                              get_card_id(10, 0)]), 7, 0), False)
+    assert_equal(check_standard_suit_set(False, get_hand_mask([get_card_id(7, 0), get_card_id(8, 0),
+                                                               get_card_id(10, 0), get_card_id(11, 0)]), 10, 0), False)
+
+    assert_equal(valid_set(True, [get_card_id(1, 0), get_card_id(2, 0), get_card_id(3, 0)], 1, 0), True)
+    assert_equal(valid_set(False, [get_card_id(8, 0), get_card_id(8, 1), get_card_id(8, 2), get_card_id(5, 0)],
+            8, 1), True)
+
+    assert_equal(enumerate_melds([get_card_id(0, 0), get_card_id(1, 0), get_card_id(2, 0), get_card_id(3, 0),
+                                  get_card_id(6, 0), get_card_id(6, 1), get_card_id(6, 2)]),
+        [[get_card_id(0, 0), get_card_id(1, 0), get_card_id(2, 0)],
+         [get_card_id(1, 0), get_card_id(2, 0), get_card_id(3, 0)],
+         [get_card_id(0, 0), get_card_id(1, 0), get_card_id(2, 0), get_card_id(3, 0)],
+         [get_card_id(6, 0), get_card_id(6, 1), get_card_id(6, 2)]])
+    assert_equal(len(enumerate_melds([get_card_id(12, 0), get_card_id(12, 1), get_card_id(12, 2),
+                                      get_card_id(12, 3)])), 5)
+    assert_equal(enumerate_melds([get_card_id(11, 0), get_card_id(12, 0), get_card_id(0, 0)]), [])
+
+    assert_equal(get_mask_points(get_hand_mask([get_card_id(0, 0), get_card_id(8, 1), get_card_id(9, 2),
+                                                get_card_id(12, 3)])), 30)
+    assert_equal(get_meld_members_mask(get_hand_mask([get_card_id(4, 2), get_card_id(5, 2), get_card_id(6, 2),
+                                                      get_card_id(9, 0), get_card_id(9, 1), get_card_id(9, 3),
+                                                      get_card_id(2, 2)])),
+                 get_hand_mask([get_card_id(4, 2), get_card_id(5, 2), get_card_id(6, 2),
+                                get_card_id(9, 0), get_card_id(9, 1), get_card_id(9, 3)]))
+    # The 8 of Hearts is worth more in the run of 8 - 10 of Hearts than in the rank set of 8s
+    assert_equal(auto_meld([get_card_id(7, 0), get_card_id(7, 1), get_card_id(7, 2), get_card_id(7, 3),
+                            get_card_id(8, 0), get_card_id(9, 0), get_card_id(1, 2)]),
+        ([[get_card_id(7, 0), get_card_id(8, 0), get_card_id(9, 0)],
+          [get_card_id(7, 1), get_card_id(7, 2), get_card_id(7, 3)]], [get_card_id(1, 2)]))
+    assert_equal(get_deadwood_points([get_card_id(0, 0), get_card_id(1, 0), get_card_id(2, 0), get_card_id(11, 3)]), 10)
+    assert_equal(get_deadwood_points([]), 0)
+
+    scoring_state = State([], [Player("", [get_card_id(12, 0)], [[get_card_id(0, 0), get_card_id(0, 1), get_card_id(0, 2)]], 0),
+                               Player("", [get_card_id(3, 1), get_card_id(4, 1), get_card_id(5, 1)], [], 0)],
+                          False, [card_backing_id], "pick", [])
+    assert_equal(encode_final_states([scoring_state]),
+        ([[[get_card_id(12, 0), card_backing_id, card_backing_id],
+           [get_card_id(3, 1), get_card_id(4, 1), get_card_id(5, 1)]]],
+         [[[get_card_id(0, 0), get_card_id(0, 1), get_card_id(0, 2)],
+           [card_backing_id, card_backing_id, card_backing_id]]]))
+    assert_equal([[int(points) for points in game] for game in score_games(*encode_final_states([scoring_state]))],
+                 [[5, -15]])
+    assert_equal([[int(points) for points in game] for game in
+                  score_games([[[card_backing_id], [get_card_id(9, 3)]], [[get_card_id(0, 0)], [card_backing_id]]],
+                              [[[get_card_id(9, 0)], [card_backing_id]], [[card_backing_id], [get_card_id(1, 1)]]])],
+                 [[10, -10], [-5, 5]])
+    game_engine.score(scoring_state)
+    game_engine.score(scoring_state) # Scoring again doesn't add the points twice
+    assert_equal([scoring_state.players[0].points, scoring_state.players[1].points], [5, -15])
+    scoring_state.auto_meld = True
+    game_engine.score(scoring_state)
+    assert_equal([scoring_state.players[0].points, scoring_state.players[1].points], [5, 15])
+    assert_equal(scoring_state.players[1].sets, [[get_card_id(3, 1), get_card_id(4, 1), get_card_id(5, 1)]])
+
+    # A short game played straight through the engine: Player 1 holds the Ace and 2 of Hearts,
+    # so the 3 of Hearts can be picked up from the discard pile (taking the Jack of Hearts with it)
+    engine_state = State(Deck([get_card_id(4, 1), get_card_id(5, 1)], 0, 0),
+        [Player("", [get_card_id(0, 0), get_card_id(1, 0), get_card_id(7, 2)], [], 0),
+         Player("", [get_card_id(0, 1), get_card_id(0, 2)], [], 0)],
+        False, [card_backing_id, get_card_id(2, 0), get_card_id(10, 0)], "pick", [])
+    game_engine.index_pickups(engine_state)
+    assert_equal(engine_state.pickup_index, 0b010)
+    assert_equal(game_engine.get_legal_pickups(engine_state), [1])
+    assert_equal(game_engine.legal_actions(engine_state), [Action("pick", 0), Action("pick", 1)])
+    assert_equal(game_engine.apply(engine_state, Action("pick", 2)), False)
+    assert_equal(game_engine.apply(engine_state, Action("discard", 0)), False)
+    assert_equal(game_engine.apply(engine_state, Action("pick", 1)), True)
+    assert_equal(get_hand(engine_state), [get_card_id(0, 0), get_card_id(1, 0), get_card_id(7, 2),
+                                          get_card_id(2, 0), get_card_id(10, 0)])
+    assert_equal(game_engine.legal_actions(engine_state),
+        [Action("meld", selected=(0, 1, 3)), Action("discard", 0), Action("discard", 1),
+         Action("discard", 2), Action("discard", 3), Action("discard", 4)])
+    assert_equal(game_engine.apply(engine_state, Action("meld", selected=(0, 2, 3))), False)
+    assert_equal(game_engine.apply(engine_state, Action("meld", selected=(0, 1, 3))), True)
+    assert_equal(engine_state.players[0].sets, [[get_card_id(0, 0), get_card_id(1, 0), get_card_id(2, 0)]])
+    assert_equal(game_engine.apply(engine_state, Action("discard", 1)), True)
+    assert_equal(engine_state.discard_pile, [card_backing_id, get_card_id(10, 0)])
+    assert_equal(engine_state.current_player, True)
+    assert_equal(engine_state.pickup_index, 0) # Player 2 can't use the Jack of Hearts
+    assert_equal(game_engine.apply(engine_state, Action("pick", 0)), True)
+    assert_equal(game_engine.is_over(engine_state), False)
+    assert_equal(game_engine.apply(engine_state, Action("discard", 0)), True)
+    assert_equal(game_engine.is_over(engine_state), False)
+    assert_equal(game_engine.apply(engine_state, Action("pick", 0)), True)
+    assert_equal(game_engine.is_over(engine_state), True)
+    assert_equal(engine_state.players[0].tracker.hand_mask, get_hand_mask(engine_state.players[0].hand))
+    assert_equal(engine_state.players[1].tracker.hand_mask, get_hand_mask(engine_state.players[1].hand))
+
+    # Ace and 2 of Hearts are finished by the 3 of Hearts, and the two Aces by either other Ace
+    tracker_test = Player("", [get_card_id(0, 0), get_card_id(1, 0), get_card_id(0, 1)], [], 0).tracker
+    assert_equal(tracker_test.get_completing_cards(), [get_card_id(2, 0), get_card_id(0, 2), get_card_id(0, 3)])
+    assert_equal(tracker_test.get_members_mask(), 0)
+    tracker_test.add(get_card_id(2, 0))
+    assert_equal(get_mask_cards(tracker_test.get_members_mask()), [get_card_id(0, 0), get_card_id(1, 0), get_card_id(2, 0)])
+    assert_equal(get_card_id(3, 0) in tracker_test.get_completing_cards(), True)
+    tracker_test.remove(get_card_id(1, 0))
+    assert_equal(tracker_test.get_completing_cards(), [get_card_id(1, 0), get_card_id(0, 2), get_card_id(0, 3)])
+    assert_equal(card_names[get_card_id(11, 0)], "QH")
+
+    # The computer player: moves are named by card, hidden cards are dealt out again without changing
+    # how many each player has, and a search always comes back with a legal move
+    computer_state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id], "pick", [])
+    game_engine.deal(computer_state, "Player 1", "Computer", False, 3)
+    computer_state.computer_player = 1
+    assert_equal(get_move_key(computer_state, Action("pick", 1)), 4)
+    assert_equal(get_move_key(computer_state, Action("discard", 2)), computer_state.players[0].hand[2] << 2 | 1)
+    assert_equal(get_estimated_score(scoring_state.players[1], True), 15)
+    determinized_state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [], "pick", [])
+    determinize(determinized_state, computer_state, 0, random.Random(1),
+                get_mask_cards(((1 << 52) - 1) & ~get_hand_mask(computer_state.players[0].hand + computer_state.discard_pile[1:])))
+    assert_equal(determinized_state.players[0].hand, computer_state.players[0].hand)
+    assert_equal(len(determinized_state.players[1].hand), 7)
+    assert_equal(determinized_state.deck.remaining(), computer_state.deck.remaining())
+    assert_equal(choose_computer_move(game_engine, computer_state, random.Random(1), 0.01) in
+                 game_engine.legal_actions(computer_state), True)
+    game_engine.apply(computer_state, Action("pick", 0))
+    game_engine.apply(computer_state, Action("discard", 0))
+    play_computer_turn(computer_state)
+    assert_equal([computer_state.current_player, computer_state.current_phase], [False, "pick"])
+    assert_equal(len(computer_state.action_log) >= 4, True)
+
+    assert_equal(next_random(0), (0x9E3779B97F4A7C15, 0xE220A8397B1DCDAF))
+    deck_test = shuffle_deck(deck, 7)
+    assert_equal(deck_test.remaining(), 52)
+    assert_equal(len(deck_test), 52)
+    deck_test_draws = [deck_test.draw() for i in range(52)]
+    assert_equal(sorted(deck_test_draws), list(range(52)))
+    assert_equal(deck_test.remaining(), 0)
+    # The same seed draws the same cards
+    assert_equal([shuffle_deck(deck, 7).draw() for i in range(3)], [deck_test_draws[0]] * 3)
+    assert_equal(shuffle_deck(deck, 7), shuffle_deck(deck, 7))
+    assert_equal(encode_action(Action("pick", 3)), 12)
+    assert_equal(encode_action(Action("discard", 1)), 5)
+    assert_equal(encode_action(Action("meld", selected=(5, 0, 2))), 0b100101 << 2 | 2)
+    assert_equal(decode_action(0b100101 << 2 | 2), Action("meld", selected=(0, 2, 5)))
+    assert_equal(decode_action(encode_action(Action("pick", 0))), Action("pick", 0))
+    assert_equal(engine_state.action_log, [encode_action(Action("pick", 1)), encode_action(Action("meld", selected=(0, 1, 3))),
+                                           encode_action(Action("discard", 1)), encode_action(Action("pick", 0)),
+                                           encode_action(Action("discard", 0)), encode_action(Action("pick", 0))])
+
+    # Any game can be rebuilt from its seed and action log
+    replay_state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False,
+                         [card_backing_id], "pick", [])
+    game_engine.deal(replay_state, "Player 1", "Player 2", False, 7)
+    for replay_action in [Action("pick", 0), Action("discard", 0), Action("pick", 0), Action("discard", 3)]:
+        game_engine.apply(replay_state, replay_action)
+    assert_equal(game_engine.replay(7, replay_state.action_log), replay_state)
+
+    # A State packed by encode_state comes back equal, and a game's seeded deck takes one byte
+    replay_state.selected_cards = [0, 2]
+    replay_state.computer_player = 1
+    assert_equal(decode_state(encode_state(replay_state)), replay_state)
+    assert_equal(len(encode_state(replay_state)) < 64, True)
+    assert_equal(read_signed(bytes([5]), 0), (-3, 1))
+    assert_equal(read_varint(bytes([0xAC, 0x02]), 0), (300, 2))
+    # A deck that wasn't shuffled from the seed is stored card by card
+    shuffled_state = State(Deck([5, 3, 9], 1, 12345), [Player("Ann", [1], [[4, 8, 12]], -15),
+                           Player("Bo", [], [], 20)], True, [card_backing_id, 7], "discard", [])
+    assert_equal(decode_state(encode_state(shuffled_state)), shuffled_state)
+    # Games saved before the variant was stored (version 1) were all played with the standard rules
+    assert_equal(decode_state(bytes([1]) + encode_state(shuffled_state)[1:-1]), shuffled_state)
+
+    # Rule variants: Aces can end a run, sets can need 4 cards, and Ten cards has its own hand size,
+    # points and end of the game. A game keeps its variant when it is saved.
+    aces_high = rule_variants["Aces high or low"]
+    sets_of_four = rule_variants["Sets of four"]
+    ten_cards = rule_variants["Ten cards"]
+    queen_king_ace = [get_card_id(11, 2), get_card_id(12, 2), get_card_id(0, 2)]
+    assert_equal(valid_set(True, queen_king_ace, 11, 2), False)
+    assert_equal(valid_set(True, queen_king_ace, 11, 2, aces_high), True)
+    assert_equal(enumerate_melds(queen_king_ace, aces_high), [[get_card_id(0, 2), get_card_id(11, 2), get_card_id(12, 2)]])
+    assert_equal(get_mask_cards(get_completing_mask(get_hand_mask(queen_king_ace[:2]), aces_high)),
+                 [get_card_id(0, 2), get_card_id(10, 2)])
+    assert_equal(enumerate_melds([get_card_id(6, suit) for suit in range(3)], sets_of_four), [])
+    assert_equal(len(enumerate_melds([get_card_id(6, suit) for suit in range(4)], sets_of_four)), 1)
+    assert_equal(get_mask_points(get_hand_mask([get_card_id(0, 0), get_card_id(6, 1), get_card_id(12, 3)]), ten_cards), 18)
+    variant_state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id], "pick", [])
+    game_engine.deal(variant_state, "Ann", "Bo", False, 5, ten_cards)
+    assert_equal([len(player.hand) for player in variant_state.players], [10, 10])
+    assert_equal(decode_state(encode_state(variant_state)).rules is ten_cards, True)
+    # Drafter saves the State as JSON before every page, so the variant is kept by name
+    assert_equal(rehydrate_json(json.loads(json.dumps(dehydrate_json(variant_state))), State), variant_state)
+    # Rules that aren't listed can't be dealt, since the State couldn't find them again by name
+    unlisted_error = ""
+    try:
+        game_engine.deal(State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id],
+                               "pick", []), "Ann", "Bo", False, 5, CompiledRules("Unlisted", Rules()))
+    except ValueError as error:
+        unlisted_error = str(error)
+    assert_equal(unlisted_error, "The rules 'Unlisted' are not one of the rule_variants")
+    variant_state.deck.top = card_backing_id - 2 # The game ends with 2 cards left in the deck
+    assert_equal(game_engine.is_over(variant_state), True)
+    # Player 1 went out with cards still in the deck, so they get the bonus
+    going_out_state = State(Deck([1, 2, 3, 5, 6], 0, 0), [Player("", [], [[0, 4, 8]], 0), Player("", [12], [], 0)],
+                            False, [card_backing_id], "pick", [], rules_name="Ten cards")
+    game_engine.score(going_out_state)
+    assert_equal([going_out_state.players[0].points, going_out_state.players[1].points], [31, -4])
+
+    # Lay-offs: the 6 of Hearts extends Player 1's run and the 7 of Hearts Player 2's own rank set. The
+    # index only changes at the set that was laid off on, and a card laid off on the other player's set
+    # counts for the player who laid it off.
+    three_to_five = [get_card_id(rank, 0) for rank in range(2, 5)]
+    layoff_state = State(Deck([], 0, 0), [Player("Ann", [get_card_id(9, 1)], [three_to_five], 0),
+                         Player("Bo", [get_card_id(5, 0), get_card_id(6, 0), get_card_id(12, 3)],
+                                [[get_card_id(6, suit) for suit in range(1, 4)]], 0)], True, [card_backing_id], "discard", [])
+    assert_equal(get_mask_cards(get_set_ends(get_hand_mask(three_to_five))), [get_card_id(1, 0), get_card_id(5, 0)])
+    assert_equal(get_mask_cards(get_set_ends(get_hand_mask([get_card_id(11, 2), get_card_id(12, 2), get_card_id(0, 2)]))),
+                 [get_card_id(1, 2), get_card_id(10, 2)])
+    assert_equal(layoff_state.players[1].layoffs.get_targets(get_card_id(6, 0)), 1)
+    assert_equal(game_engine.get_legal_layoffs(layoff_state), [Action("layoff", 0, target=0), Action("layoff", 1, target=1)])
+    assert_equal(game_engine.get_legal_layoffs(State(layoff_state.deck, layoff_state.players, True, [card_backing_id],
+                                                     "discard", [], rules_name="No lay-offs")), [])
+    assert_equal(decode_action(encode_action(Action("layoff", 2, target=5))), Action("layoff", 2, target=5))
+    assert_equal(get_move_key(layoff_state, Action("layoff", 0, target=0)), get_card_id(5, 0) << 2 | 3)
+    assert_equal(game_engine.apply(layoff_state, Action("layoff", 2, target=0)), False) # The King of Spades is not next to the run
+    assert_equal(game_engine.apply(layoff_state, Action("layoff", 0, target=0)), True)
+    assert_equal(layoff_state.players[0].sets, [three_to_five + [get_card_id(5, 0)]])
+    assert_equal(layoff_state.players[1].laid_off, [get_card_id(5, 0)])
+    assert_equal(game_engine.get_legal_layoffs(layoff_state), [Action("layoff", 0, target=0), Action("layoff", 0, target=1)])
+    assert_equal(game_engine.apply(layoff_state, Action("layoff", 0, target=1)), True)
+    assert_equal([card for card, targets in enumerate(layoff_state.players[0].layoffs.extensions) if targets],
+                 [get_card_id(1, 0), get_card_id(6, 0)])
+    assert_equal(layoff_state.players[1].layoffs, Player("", [], layoff_state.players[1].sets, 0).layoffs)
+    assert_equal(decode_state(encode_state(layoff_state)), layoff_state)
+    assert_equal(get_estimated_score(layoff_state.players[0], False, standard_rules,
+                                     get_hand_mask(layoff_state.players[1].laid_off)), 5)
+    game_engine.score(layoff_state)
+    assert_equal([layoff_state.players[0].points, layoff_state.players[1].points], [5, 15])
+
+    # The same lay-offs through the routes: the button is only offered while a lay-off is legal, only
+    # the cards that can be laid off get a button, and the state survives Drafter's round trip with sets
+    route_state = State(Deck([get_card_id(0, 1), get_card_id(0, 2)], 0, 0),
+                        [Player("Ann", [get_card_id(9, 1)], [three_to_five], 0),
+                         Player("Bo", [get_card_id(5, 0), get_card_id(6, 0), get_card_id(12, 3)],
+                                [[get_card_id(6, suit) for suit in range(1, 4)]], 0)], True, [card_backing_id], "discard", [])
+    assert_equal(Button("Lay off", "/pick_layoff_card") in play_turn(route_state).content, True)
+    assert_equal(pick_layoff_card(route_state).content[3], region("hand", display_pick_buttons(
+                 [get_card_id(5, 0), get_card_id(6, 0), get_card_id(12, 3)], "/lay_off", 0b011)))
+    lay_off(route_state, 2) # The King of Spades can't be laid off, so nothing happens
+    assert_equal(len(route_state.players[1].hand), 3)
+    lay_off(route_state, 1) # Goes on Bo's own set of sevens before Ann's run
+    assert_equal([get_card_id(6, 0) in route_state.players[1].sets[0], route_state.players[1].laid_off], [True, []])
+    lay_off(route_state, 0)
+    assert_equal([route_state.players[0].sets[0][-1], route_state.players[1].laid_off], [get_card_id(5, 0), [get_card_id(5, 0)]])
+    assert_equal(Button("Lay off", "/pick_layoff_card") in play_turn(route_state).content, False)
+    assert_equal(rehydrate_json(json.loads(json.dumps(dehydrate_json(route_state))), State), route_state)
+    # Opening the final scores by URL in the middle of the deal goes back to the game without scoring it
+    assert_equal(win_conditions(route_state).content[0] == "Game OVER", False)
+    assert_equal([route_state.finished, route_state.match_points, route_state.players[0].points], [False, [0, 0], 0])
+    # The server page shows both the packed size kept between moves and the size of the State itself
+    assert_equal(tables(route_state).content[3], "Memory of a game while a move is made: about " +
+                 str(get_deep_size(route_state)) + " bytes (this game's State)")
+    discard(route_state, 0)
+    assert_equal([route_state.discard_pile[-1], int(route_state.current_player), route_state.current_phase],
+                 [get_card_id(12, 3), 0, "pick"])
+
+
+import_seconds = time.perf_counter() - import_started
+
+# The server is only started when this file is run, so the game engine can be imported by the simulator
+if __name__ == "__main__":
+    if production_mode:
+        hide_debug_information()
+    set_website_framed(False)
+    set_website_title("Gin Rummy")
+    if os.environ.get("GIN_RUMMY_DATABASE"):
+        game_database = GameDatabase(os.environ["GIN_RUMMY_DATABASE"])
+        game_database.start()
+        player_ratings = Leaderboard(os.environ["GIN_RUMMY_DATABASE"])
+    enable_sessions(get_main_server(), session_store)
+    enable_metrics(get_main_server())
+    enable_deltas(get_main_server())
+    if os.path.exists(sprite_sheet_path):
+        use_sprite_sheet(get_main_server())
+    print("Imported in " + str(round(import_seconds * 1000)) + " ms" +
+          (" (self-tests skipped)" if production_mode else "") + ", ready to start the server after " +
+          str(round((time.perf_counter() - import_started) * 1000)) + " ms")
+    start_server(State(Deck([], 0, 0),[Player("",[],[],0), Player("",[],[],0)],False,[card_backing_id],"pick",[]))
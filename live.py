@@ -0,0 +1,382 @@
+"""
+Real-time play between two browsers. Each player opens the same room from their own browser
+and the game is played over a WebSocket: every move is sent to the server, checked with the
+same GameEngine as the website, and the new position is pushed straight to both browsers.
+Each browser is only ever sent its own hand (the other player's is just a number of cards).
+There is no polling and the page is never reloaded.
+
+One asyncio process handles every room. A connection that is waiting for the other player
+only costs its socket and a small buffer, and per-message compression is turned off since
+its buffers would be most of the memory of an idle connection. Finished games are scored
+with finish_game, so they count on the leaderboard like games on the website.
+
+Needs the websockets package. Example:
+    python live.py --port 8765              # Then open http://localhost:8765/?room=abc in two browsers
+    python live.py --test-clients 2000      # Plays 1000 games between bots on localhost and reports how it went
+"""
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import time
+
+# The self-tests are skipped when importing the game (see production_mode)
+os.environ.setdefault("GIN_RUMMY_PRODUCTION", "1")
+from gin_rummy import (Action, Deck, Player, State, card_backing_id, card_names, card_urls, finish_game,
+                       game_engine, save_game)
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+# Moves are a few bytes of JSON, so anything much bigger is not from the page
+max_message_bytes = 4096
+
+
+@dataclass
+class Room:
+    """ Dataclass for one live game and the browsers playing it """
+    state : State
+    seats : list = field(default_factory=lambda: [None, None]) # Each player's connection, or None if they're not here
+    names : list[str] = field(default_factory=lambda: ["", ""])
+    dealt : bool = False
+
+rooms = {} # Room id -> Room
+
+
+def new_room() -> Room:
+    """ Returns:
+            Room: A room whose game hasn't been dealt yet
+    """
+    return Room(State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id],
+                      "pick", []))
+
+def get_player_view(room : Room, seat : int) -> dict:
+    """ Gets what one player is allowed to see of the game
+    Args:
+        room (Room): The room
+        seat (int): The player's index (0 or 1)
+    Returns:
+        dict: The view sent to the player's browser as JSON
+    """
+    state = room.state
+    over = room.dealt and game_engine.is_over(state)
+    your_turn = room.dealt and not over and int(state.current_player) == seat
+    return {
+        "seat": seat,
+        "names": room.names,
+        "connected": [connection is not None for connection in room.seats],
+        "dealt": room.dealt,
+        "hand": state.players[seat].hand,
+        "opponent_cards": len(state.players[1 - seat].hand),
+        "sets": [player.sets for player in state.players],
+        "discard_pile": state.discard_pile,
+        "deck": state.deck.remaining(),
+        "turn": int(state.current_player),
+        "phase": state.current_phase,
+        "pickups": game_engine.get_legal_pickups(state) if your_turn and state.current_phase == "pick" else [],
+        "layoffs": [[action.index, action.target] for action in game_engine.get_legal_layoffs(state)]
+                   if your_turn and state.current_phase == "discard" else [],
+        "over": over,
+        "points": [player.points for player in state.players] if over else None,
+    }
+
+async def send_views(room : Room) -> None:
+    """ Pushes the game to every browser in the room, each with only their own hand
+    Args:
+        room (Room): The room
+    """
+    for seat, connection in enumerate(room.seats):
+        if connection is not None:
+            try:
+                await connection.send(json.dumps(get_player_view(room, seat)))
+            except ConnectionClosed:
+                pass
+
+def read_move(message : str) -> Action:
+    """ Turns a move sent by a browser, like {"kind": "pick", "index": 0}, into an Action. A lay-off
+        also has the "target" set it goes on (see Action).
+    Args:
+        message (str): The move as JSON
+    Returns:
+        Action: The move
+    """
+    move = json.loads(message)
+    if move.get("kind") not in ("pick", "meld", "discard", "layoff"):
+        raise ValueError("unknown move")
+    return Action(move["kind"], int(move.get("index", 0)),
+                  tuple(int(card_index) for card_index in move.get("selected", [])), int(move.get("target", 0)))
+
+async def play(connection) -> None:
+    """ Handles one browser for as long as it is connected: seats it in its room, deals the game
+        once both players are there, and makes the moves it sends when it is that player's turn
+    Args:
+        connection: The browser's WebSocket connection
+    """
+    query = parse_qs(urlsplit(connection.request.path).query)
+    room_id = query.get("room", [""])[0][:64]
+    name = query.get("name", ["Player"])[0][:32] or "Player"
+    room = rooms.get(room_id)
+    if room is None:
+        room = rooms[room_id] = new_room()
+    # Once the game is dealt, a seat can only be taken back by the player who left it
+    seats = [seat for seat in range(2) if room.seats[seat] is None and (not room.dealt or room.names[seat] == name)]
+    if not seats:
+        await connection.send(json.dumps({"error": "This room already has two players"}))
+        return
+    seat = seats[0]
+    room.seats[seat] = connection
+    if not room.dealt:
+        room.names[seat] = name
+        if None not in room.seats:
+            game_engine.deal(room.state, room.names[0], room.names[1])
+            room.dealt = True
+    await send_views(room)
+    try:
+        async for message in connection:
+            try:
+                action = read_move(message)
+            except (ValueError, TypeError, AttributeError):
+                await connection.send(json.dumps({"error": "That isn't a move"}))
+                continue
+            state = room.state
+            if not room.dealt or game_engine.is_over(state) or int(state.current_player) != seat or \
+               not game_engine.apply(state, action):
+                await connection.send(json.dumps({"error": "That move isn't allowed right now"}))
+                continue
+            if game_engine.is_over(state):
+                finish_game(state)
+            else:
+                save_game(state)
+            await send_views(room)
+    except ConnectionClosed:
+        pass
+    finally:
+        room.seats[seat] = None
+        if room.seats == [None, None]:
+            rooms.pop(room_id, None)
+        else:
+            await send_views(room)
+
+
+def serve_page(connection, request):
+    """ Answers plain HTTP requests with the game's page, and lets WebSocket requests through
+    Args:
+        connection: The connection
+        request: The HTTP request
+    Returns:
+        The page, or None to carry on with the WebSocket handshake
+    """
+    if urlsplit(request.path).path == "/ws":
+        return None
+    response = connection.respond(HTTPStatus.OK, page_html)
+    del response.headers["Content-Type"]
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    return response
+
+page_html = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Gin Rummy</title>
+<style>img {width: 60px; margin: 2px; border: 2px solid transparent} img.selected {border-color: orange}
+button {margin: 2px}</style></head>
+<body><h1>Gin Rummy</h1>
+<form id="join" hidden>Room: <input name="room"> Name: <input name="name"> <button>Join</button></form>
+<p id="status">Connecting...</p>
+<div id="game" hidden>
+<p id="opponent"></p>
+<p>Discard pile (<span id="deck"></span> cards left in the deck)</p><div id="pile"></div>
+<p>Your hand</p><div id="hand"></div>
+<p id="actions"></p>
+<p>Sets</p><div id="sets"></div>
+</div>
+<script>
+var CARDS = %s, NAMES = %s;
+var params = new URLSearchParams(location.search);
+var room = params.get("room"), name = params.get("name");
+var view = null, selected = [];
+function card(id) {
+    var image = document.createElement("img");
+    image.src = CARDS[id]; image.alt = image.title = NAMES[id] || "deck";
+    return image;
+}
+function button(text, onclick) {
+    var element = document.createElement("button");
+    element.textContent = text; element.onclick = onclick;
+    return element;
+}
+function send(move) { socket.send(JSON.stringify(move)); }
+function draw() {
+    var yourTurn = view.dealt && !view.over && view.turn === view.seat;
+    var opponent = view.names[1 - view.seat] || "your opponent";
+    document.getElementById("game").hidden = !view.dealt;
+    document.getElementById("status").textContent =
+        view.over ? "Game over: " + view.names[0] + " has " + view.points[0] + " points, " +
+                    view.names[1] + " has " + view.points[1] + " points" :
+        !view.dealt ? "Waiting for the other player to join room " + room :
+        !view.connected[1 - view.seat] ? opponent + " left the game" :
+        yourTurn ? (view.phase === "pick" ? "Your turn: pick up a card" : "Your turn: make sets, lay off or discard") :
+        opponent + "'s turn";
+    document.getElementById("opponent").textContent = opponent + " has " + view.opponent_cards + " cards";
+    document.getElementById("deck").textContent = view.deck;
+    var pile = document.getElementById("pile"), hand = document.getElementById("hand");
+    var actions = document.getElementById("actions"), sets = document.getElementById("sets");
+    pile.replaceChildren(); hand.replaceChildren(); actions.replaceChildren(); sets.replaceChildren();
+    view.discard_pile.forEach(function (id, index) {
+        var image = pile.appendChild(card(id));
+        if (yourTurn && view.phase === "pick" && (index === 0 || view.pickups.indexOf(index) !== -1)) {
+            image.style.cursor = "pointer";
+            image.title = index === 0 ? "Draw from the deck" : "Pick up from here";
+            image.onclick = function () { send({kind: "pick", index: index}); };
+        }
+    });
+    view.hand.forEach(function (id, index) {
+        var image = hand.appendChild(card(id));
+        if (selected.indexOf(index) !== -1) { image.className = "selected"; }
+        image.onclick = function () {
+            var at = selected.indexOf(index);
+            if (at === -1) { selected.push(index); } else { selected.splice(at, 1); }
+            draw();
+        };
+    });
+    if (yourTurn && view.phase === "discard") {
+        actions.appendChild(button("Make set", function () { send({kind: "meld", selected: selected}); }));
+        actions.appendChild(button("Discard", function () {
+            if (selected.length === 1) { send({kind: "discard", index: selected[0]}); }
+        }));
+        var layoff = view.layoffs.filter(function (move) { return selected.length === 1 && move[0] === selected[0]; })[0];
+        if (layoff) {
+            actions.appendChild(button("Lay off", function () { send({kind: "layoff", index: layoff[0], target: layoff[1]}); }));
+        }
+    }
+    view.sets.forEach(function (playerSets, seat) {
+        var line = sets.appendChild(document.createElement("div"));
+        line.textContent = (view.names[seat] || "") + ": ";
+        playerSets.forEach(function (set) { set.forEach(function (id) { line.appendChild(card(id)); }); });
+    });
+}
+if (!room || !name) {
+    document.getElementById("join").hidden = false;
+    document.getElementById("status").textContent = "Pick a room to join, and share it with the other player";
+} else {
+    var socket = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host +
+                               "/ws?room=" + encodeURIComponent(room) + "&name=" + encodeURIComponent(name));
+    socket.onmessage = function (event) {
+        var message = JSON.parse(event.data);
+        if (message.error) { document.getElementById("status").textContent = message.error; return; }
+        view = message; selected = [];
+        draw();
+    };
+    socket.onclose = function () { document.getElementById("status").textContent = "Disconnected"; };
+}
+</script></body></html>""" % (json.dumps(card_urls), json.dumps(card_names))
+
+
+def start_server(host : str, port : int):
+    """ Starts accepting browsers
+    Args:
+        host (str): The address to listen on
+        port (int): The port to listen on
+    Returns:
+        The websockets server, used as an async context manager
+    """
+    return serve(play, host, port, process_request=serve_page, compression=None, max_size=max_message_bytes)
+
+
+async def test_client(port : int, room_id : str, name : str, seed : int, handshakes : asyncio.Semaphore,
+                      connected : asyncio.Queue, start : asyncio.Event, round_trips : list[float]) -> int:
+    """ A bot that plays one game through the WebSocket like a browser would, for testing
+    Args:
+        port (int): The server's port on localhost
+        room_id (str): The room to join
+        name (str): The bot's name
+        seed (int): The seed for the bot's random choices
+        handshakes (asyncio.Semaphore): Limits how many bots connect at the same moment
+        connected (asyncio.Queue): Gets an item once the bot's game has been dealt
+        start (asyncio.Event): Set when every bot is connected and they should start playing
+        round_trips (list[float]): Gets the seconds between sending each move and hearing back
+    Returns:
+        int: How many moves the bot made
+    """
+    rng = random.Random(seed)
+    moves = 0
+    async with handshakes:
+        connection = await connect("ws://localhost:" + str(port) + "/ws?room=" + room_id + "&name=" + name,
+                                   compression=None, max_size=None, open_timeout=60)
+    async with connection:
+        view = json.loads(await connection.recv())
+        while not view["dealt"]:
+            view = json.loads(await connection.recv())
+        await connected.put(name)
+        await start.wait()
+        while not view["over"]:
+            if view["turn"] != view["seat"] or not view["connected"][1 - view["seat"]]:
+                view = json.loads(await connection.recv())
+                continue
+            if view["phase"] == "pick":
+                move = {"kind": "pick", "index": view["pickups"][-1] if view["pickups"] else 0}
+            elif view["layoffs"]:
+                move = {"kind": "layoff", "index": view["layoffs"][0][0], "target": view["layoffs"][0][1]}
+            else:
+                move = {"kind": "discard", "index": rng.randrange(len(view["hand"]))}
+            sent = time.perf_counter()
+            await connection.send(json.dumps(move))
+            view = json.loads(await connection.recv())
+            round_trips.append(time.perf_counter() - sent)
+            moves += 1
+    return moves
+
+async def run_test_clients(count : int, port : int) -> None:
+    """ Starts the server and connects bots to it on localhost, two to a room. Once they are all
+        connected (and idle) the memory is measured, then every game is played at once.
+    Args:
+        count (int): How many bots to connect
+        port (int): The port to use
+    """
+    async with start_server("localhost", port):
+        memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        connected = asyncio.Queue()
+        start = asyncio.Event()
+        round_trips = []
+        # Connecting thousands at once would overflow the server's queue of connections waiting to be accepted
+        handshakes = asyncio.Semaphore(64)
+        clients = [asyncio.create_task(test_client(port, "room" + str(bot // 2), "bot" + str(bot), bot, handshakes,
+                                                   connected, start, round_trips)) for bot in range(count)]
+        for bot in range(count):
+            await connected.get()
+        memory_per_connection = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_before) * 1024 / count
+        print(f"{count} connections open in {len(rooms)} rooms, about {memory_per_connection / 1024:.0f} KB each "
+              f"(counting both the server's and the bot's side)")
+        started = time.perf_counter()
+        start.set()
+        moves = sum(await asyncio.gather(*clients))
+        elapsed = time.perf_counter() - started
+        round_trips.sort()
+        print(f"{moves} moves in {elapsed:.1f} s ({moves / elapsed:.0f} a second), move to update "
+              f"median {statistics.median(round_trips) * 1000:.2f} ms, "
+              f"99th percentile {round_trips[int(len(round_trips) * 0.99)] * 1000:.2f} ms, {len(rooms)} rooms left")
+
+
+async def run_server(host : str, port : int) -> None:
+    async with start_server(host, port) as server:
+        print(f"Open http://{host}:{port}/?room=<any name>&name=<your name> in two browsers")
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Gin Rummy between two browsers over WebSockets.")
+    parser.add_argument("--host", default="localhost", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="the port to listen on")
+    parser.add_argument("--test-clients", type=int, default=0,
+                        help="connect this many bots on localhost, play their games and report the timings")
+    args = parser.parse_args()
+    if args.test_clients:
+        asyncio.run(run_test_clients(args.test_clients, args.port))
+    else:
+        asyncio.run(run_server(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
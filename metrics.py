@@ -0,0 +1,211 @@
+"""
+Counts and times what the server does, and shows it at /metrics in the Prometheus text format
+so it can be scraped and graphed. Every route gets a latency histogram (whose count is the
+number of calls) and an error counter. The game adds its own counters, such as how many times
+a set was checked. Counting is just adding to an attribute, and timing a route is one bucket
+lookup, so it costs about a microsecond per request.
+"""
+from bisect import bisect_left
+from functools import wraps
+import os
+import time
+
+from bakery import assert_equal
+from bottle import response
+from drafter.server import Server
+
+default_registry = []   # Every metric, in the order they are shown
+# Route times in seconds. Prometheus buckets count every value up to and including their bound.
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Counter:
+    """ A number that only goes up, like how many times something happened """
+    kind = "counter"
+
+    def __init__(self, name : str, documentation : str, labels : str = "", registry : list = default_registry):
+        """
+        Args:
+            name (str): The metric's name, ending in _total
+            documentation (str): What is being counted
+            labels (str): The labels that tell this counter apart from others with the same name,
+                          like 'route="play_turn"'
+            registry (list): Where the metric is kept to be shown
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.value = 0
+        registry.append(self)
+
+    def inc(self, amount : int = 1) -> None:
+        """ Adds to the count
+        Args:
+            amount (int): How much to add
+        """
+        self.value += amount
+
+    def get_samples(self) -> list[str]:
+        """ Returns:
+                list[str]: The metric's lines in the Prometheus text format
+        """
+        labels = "{" + self.labels + "}" if self.labels else ""
+        return [self.name + labels + " " + str(self.value)]
+
+
+class Gauge:
+    """ A number that is read when the metrics are shown, like how many games are live """
+    kind = "gauge"
+
+    def __init__(self, name : str, documentation : str, read, registry : list = default_registry):
+        """
+        Args:
+            name (str): The metric's name
+            documentation (str): What is being measured
+            read: A function that gives the current value
+            registry (list): Where the metric is kept to be shown
+        """
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        registry.append(self)
+
+    def get_samples(self) -> list[str]:
+        """ Returns:
+                list[str]: The metric's lines in the Prometheus text format
+        """
+        return [self.name + " " + str(self.read())]
+
+
+class Histogram:
+    """ Counts how many values fell into each of a set of buckets, like how long a route took """
+    kind = "histogram"
+
+    def __init__(self, name : str, documentation : str, buckets : tuple = latency_buckets, labels : str = "",
+                 counted : Counter | None = None, registry : list = default_registry):
+        """
+        Args:
+            name (str): The metric's name
+            documentation (str): What is being measured
+            buckets (tuple): The upper bound of each bucket, smallest first
+            labels (str): The labels that tell this histogram apart from others with the same name
+            counted (Counter | None): A counter whose increase during each request is observed
+                                      by the route timing (see enable_metrics), or None
+            registry (list): Where the metric is kept to be shown
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.counted = counted
+        self.counts = [0] * (len(buckets) + 1)  # The last count is for values above every bucket
+        self.sum = 0
+        registry.append(self)
+
+    def observe(self, value) -> None:
+        """ Adds a value to its bucket
+        Args:
+            value: The value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def get_samples(self) -> list[str]:
+        """ Returns:
+                list[str]: The metric's lines in the Prometheus text format, with the buckets
+                           added up from the smallest
+        """
+        labels = self.labels + "," if self.labels else ""
+        samples = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            samples.append(self.name + "_bucket{" + labels + 'le="' + str(bound) + '"} ' + str(total))
+        suffix = "{" + self.labels + "}" if self.labels else ""
+        samples.append(self.name + "_sum" + suffix + " " + str(self.sum))
+        samples.append(self.name + "_count" + suffix + " " + str(total))
+        return samples
+
+
+def render_metrics(registry : list = default_registry) -> str:
+    """ Shows every metric in the Prometheus text format
+    Args:
+        registry (list): The metrics
+    Returns:
+        str: The text, with the metrics that share a name (like every route's histogram) together
+             under one help and type line
+    """
+    families = {}
+    for metric in registry:
+        families.setdefault(metric.name, []).append(metric)
+    lines = []
+    for name, family in families.items():
+        lines.append("# HELP " + name + " " + family[0].documentation)
+        lines.append("# TYPE " + name + " " + family[0].kind)
+        for metric in family:
+            lines.extend(metric.get_samples())
+    return "\n".join(lines) + "\n"
+
+
+def enable_metrics(server : Server, prefix : str = "gin_rummy", url : str = "/metrics",
+                   registry : list = default_registry) -> None:
+    """ Times every route of a Drafter server and adds a route that shows the metrics.
+        Must be called after all of the routes are added (and after enable_sessions, so the
+        time spent loading and saving the game is counted) and before the server is started.
+    Args:
+        server (Server): The Drafter server
+        prefix (str): What the route metrics' names start with
+        url (str): Where the metrics are shown
+        registry (list): The metrics to show, which the route metrics are added to
+    """
+    per_request = [metric for metric in registry if isinstance(metric, Histogram) and metric.counted is not None]
+
+    def time_route(bottle_page):
+        labels = 'route="' + bottle_page.__name__ + '"'
+        seconds = Histogram(prefix + "_route_seconds", "How long each route took, in seconds",
+                            labels=labels, registry=registry)
+        errors = Counter(prefix + "_route_errors_total", "How many times each route failed",
+                         labels=labels, registry=registry)
+        @wraps(bottle_page)
+        def timed_page(*args, **kwargs):
+            counted_before = [histogram.counted.value for histogram in per_request]
+            start = time.perf_counter()
+            try:
+                return bottle_page(*args, **kwargs)
+            except Exception: # Including the HTTPError that Drafter raises to show its error page
+                errors.inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - start)
+                for histogram, before in zip(per_request, counted_before):
+                    histogram.observe(histogram.counted.value - before)
+        return timed_page
+
+    for route_url, bottle_page in list(server.routes.items()):
+        server.routes[route_url] = time_route(bottle_page)
+
+    def show_metrics():
+        response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        return render_metrics(registry)
+    server.routes[url] = show_metrics
+
+
+# Tests use their own registry so they don't show up at /metrics (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    test_registry = []
+    test_counter = Counter("test_calls_total", "Calls", registry=test_registry)
+    test_counter.inc()
+    test_counter.inc(2)
+    test_histogram = Histogram("test_seconds", "Time", (0.1, 1.0), 'route="a"', registry=test_registry)
+    test_histogram.observe(0.1)     # Goes in the 0.1 bucket, since the bounds are included
+    test_histogram.observe(5)
+    Gauge("test_games", "Games", lambda: 4, registry=test_registry)
+    Counter("test_calls_total", "Calls", 'route="b"', registry=test_registry)
+    assert_equal(render_metrics(test_registry).splitlines(), [
+        "# HELP test_calls_total Calls", "# TYPE test_calls_total counter", "test_calls_total 3",
+        'test_calls_total{route="b"} 0',
+        "# HELP test_seconds Time", "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="a",le="0.1"} 1', 'test_seconds_bucket{route="a",le="1.0"} 1',
+        'test_seconds_bucket{route="a",le="+Inf"} 2', 'test_seconds_sum{route="a"} 5.1',
+        'test_seconds_count{route="a"} 2',
+        "# HELP test_games Games", "# TYPE test_games gauge", "test_games 4"])
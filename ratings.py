@@ -0,0 +1,166 @@
+"""
+A leaderboard of everyone who has played, by name. Each player has an Elo rating and running
+totals (deals, wins, draws and the points they won by), which are updated when each deal finishes,
+so every deal of a match is rated on its own, instead of being worked out again from every deal
+played. The finished deals are kept in an archive table, but the leaderboard never reads it, and
+the best players are found through an index on the rating, so the leaderboard loads just as fast
+with hundreds of thousands of deals.
+"""
+from dataclasses import dataclass
+import os
+import sqlite3
+import threading
+import time
+
+from bakery import assert_equal
+
+default_rating = 1500.0
+k_factor = 32.0         # The most a rating can change after one deal
+
+
+def get_expected_score(rating : float, opponent_rating : float) -> float:
+    """ Works out how likely a player is to beat another, by their ratings
+    Args:
+        rating (float): The player's rating
+        opponent_rating (float): The other player's rating
+    Returns:
+        float: The player's expected score, from 0 (always loses) to 1 (always wins)
+    """
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+def get_new_ratings(rating : float, opponent_rating : float, score : float) -> tuple[float, float]:
+    """ Updates two players' ratings after a game between them
+    Args:
+        rating (float): The first player's rating
+        opponent_rating (float): The second player's rating
+        score (float): 1 if the first player won, 0.5 for a draw and 0 if they lost
+    Returns:
+        tuple[float, float]: The two players' new ratings
+    """
+    change = k_factor * (score - get_expected_score(rating, opponent_rating))
+    return rating + change, opponent_rating - change
+
+
+@dataclass
+class PlayerRating:
+    """ Dataclass for one row of the leaderboard """
+    name : str
+    rating : float = default_rating
+    games : int = 0
+    wins : int = 0
+    draws : int = 0
+    margin : int = 0    # The points the player won by, added up over every deal (negative for losses)
+
+    def get_win_rate(self) -> float:
+        """ Returns:
+                float: The fraction of deals the player won, counting draws as half
+        """
+        return (self.wins + self.draws / 2) / self.games if self.games else 0.0
+
+    def get_average_margin(self) -> float:
+        """ Returns:
+                float: The average number of points the player won or lost by
+        """
+        return self.margin / self.games if self.games else 0.0
+
+
+class Leaderboard:
+    """ Keeps every player's rating and totals in SQLite, updated after every deal """
+
+    def __init__(self, path : str = ":memory:"):
+        """
+        Args:
+            path (str): Where the SQLite database is (it can be the same one the games are saved in),
+                        or ":memory:" for a leaderboard that is lost when the server stops
+        """
+        # Opened like GameDatabase's connection to the same file: it can be used from any thread, but only with lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS ratings (name TEXT PRIMARY KEY, rating REAL NOT NULL, "
+                                "games INTEGER NOT NULL, wins INTEGER NOT NULL, draws INTEGER NOT NULL, "
+                                "margin INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ratings_by_rating ON ratings (rating DESC)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, finished REAL NOT NULL, "
+                                "player_1 TEXT NOT NULL, player_2 TEXT NOT NULL, points_1 INTEGER NOT NULL, "
+                                "points_2 INTEGER NOT NULL)")
+        self.connection.commit()
+
+    def get_player(self, name : str) -> PlayerRating:
+        """ Gets a player's row, or a new one if they haven't played yet
+        Args:
+            name (str): The player's name
+        Returns:
+            PlayerRating: The player's rating and totals
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM ratings WHERE name = ?", (name,)).fetchone()
+        return PlayerRating(name) if row is None else PlayerRating(*row)
+
+    def record_game(self, name_1 : str, points_1 : int, name_2 : str, points_2 : int) -> None:
+        """ Adds a finished deal to the archive and updates both players' rows, so a match is
+            rated one deal at a time. The player with more points in the deal wins it. Deals a
+            name plays against itself are not counted.
+        Args:
+            name_1 (str): Player 1's name
+            points_1 (int): Player 1's points
+            name_2 (str): Player 2's name
+            points_2 (int): Player 2's points
+        """
+        if name_1 == name_2:
+            return
+        with self.lock, self.connection:
+            player_1, player_2 = self.get_player(name_1), self.get_player(name_2)
+            score = 1.0 if points_1 > points_2 else 0.5 if points_1 == points_2 else 0.0
+            player_1.rating, player_2.rating = get_new_ratings(player_1.rating, player_2.rating, score)
+            for player, won, margin in ((player_1, score, points_1 - points_2), (player_2, 1 - score, points_2 - points_1)):
+                player.games += 1
+                player.wins += won == 1.0
+                player.draws += won == 0.5
+                player.margin += margin
+                self.connection.execute("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?)",
+                                        (player.name, player.rating, player.games, player.wins, player.draws,
+                                         player.margin))
+            self.connection.execute("INSERT INTO results (finished, player_1, player_2, points_1, points_2) "
+                                    "VALUES (?, ?, ?, ?, ?)", (time.time(), name_1, name_2, points_1, points_2))
+
+    def get_top(self, count : int = 20) -> list[PlayerRating]:
+        """ Gets the best rated players
+        Args:
+            count (int): How many players to get
+        Returns:
+            list[PlayerRating]: The players, best first
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM ratings ORDER BY rating DESC LIMIT ?", (count,)).fetchall()
+        return [PlayerRating(*row) for row in rows]
+
+    def count_games(self) -> int:
+        """ Returns:
+                int: How many deals are in the archive. Deals are never deleted, so this is the
+                     highest id, which SQLite finds without counting every row.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT MAX(id) FROM results").fetchone()[0] or 0
+
+
+# Tests (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    assert_equal(get_expected_score(1500, 1500), 0.5)
+    assert_equal(get_new_ratings(1500, 1500, 1.0), (1516.0, 1484.0))
+    test_leaderboard = Leaderboard()
+    test_leaderboard.record_game("Ann", 40, "Bo", -10)
+    test_leaderboard.record_game("Ann", 5, "Cy", 5)
+    test_leaderboard.record_game("Ann", 0, "Ann", 100)   # Not counted
+    assert_equal([player.name for player in test_leaderboard.get_top()], ["Ann", "Cy", "Bo"])
+    assert_equal(test_leaderboard.get_player("Ann").games, 2)
+    assert_equal(test_leaderboard.get_player("Ann").get_win_rate(), 0.75)
+    assert_equal(test_leaderboard.get_player("Bo").get_average_margin(), -50.0)
+    assert_equal(test_leaderboard.get_player("Dee"), PlayerRating("Dee"))
+    assert_equal(test_leaderboard.count_games(), 2)
+    # The server can finish a deal on another thread than the one that opened the leaderboard
+    test_thread = threading.Thread(target=test_leaderboard.record_game, args=("Bo", 10, "Cy", 0))
+    test_thread.start()
+    test_thread.join()
+    assert_equal(test_leaderboard.count_games(), 3)
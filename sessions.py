@@ -0,0 +1,205 @@
+"""
+Lets one Drafter server host many games at once. Drafter normally keeps a single State for
+the whole server, so every browser would be playing the same game. Here each browser gets a
+session cookie and its own State from a SessionStore. Games that haven't been touched for a
+while are evicted, and so is the least recently used game when there are too many.
+"""
+from collections import OrderedDict
+from dataclasses import fields, is_dataclass
+from functools import wraps
+import os
+import secrets
+import sys
+import time
+
+from bakery import assert_equal
+from bottle import request, response
+from drafter.server import Server
+
+
+def get_deep_size(value, seen : set[int] | None = None) -> int:
+    """ Adds up the memory used by a value and everything inside of it
+    Args:
+        value: A State, or any of the lists, dataclasses and numbers inside of one
+        seen (set[int] | None): The ids of the objects that were already counted
+    Returns:
+        int: The number of bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if is_dataclass(value):
+        if hasattr(value, "__dict__"):
+            size += sys.getsizeof(value.__dict__)
+        for field in fields(value):
+            size += get_deep_size(getattr(value, field.name), seen)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            size += get_deep_size(key, seen) + get_deep_size(item, seen)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            size += get_deep_size(item, seen)
+    return size
+
+
+class SessionStore:
+    """ Keeps one game per session id, in least recently used order """
+
+    def __init__(self, max_games : int = 1000, idle_seconds : float = 3600.0, clock=time.monotonic,
+                 pack=None, unpack=None):
+        """
+        Args:
+            max_games (int): The most games that can be live at once
+            idle_seconds (float): How long a game can go untouched before it is evicted
+            clock: A function that gives the current time in seconds
+            pack: A function that turns a State into something smaller to keep, such as bytes,
+                  or None to keep the State itself
+            unpack: A function that turns what pack made back into a State
+        """
+        self.max_games = max_games
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self.pack = pack
+        self.unpack = unpack
+        self.games = OrderedDict() # Session id -> [state, last time it was used], oldest first
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    def evict_idle(self) -> None:
+        """ Evicts every game that has been idle for too long. The oldest games are always at the
+            front, so this stops at the first game that is still in use.
+        """
+        oldest_allowed = self.clock() - self.idle_seconds
+        while self.games:
+            session_id, (state, last_used) = next(iter(self.games.items()))
+            if last_used >= oldest_allowed:
+                break
+            del self.games[session_id]
+            self.evicted += 1
+
+    def get(self, session_id : str, new_game):
+        """ Gets a session's game, starting a new one if it doesn't have one
+        Args:
+            session_id (str): The session id
+            new_game: A function that makes a new State
+        Returns:
+            The session's State
+        """
+        self.evict_idle()
+        if session_id in self.games:
+            self.games.move_to_end(session_id)
+            entry = self.games[session_id]
+            entry[1] = self.clock()
+            return entry[0] if self.unpack is None else self.unpack(entry[0])
+        state = new_game()
+        self.put(session_id, state)
+        return state
+
+    def put(self, session_id : str, state) -> None:
+        """ Saves a session's game and marks it as the most recently used, evicting the least
+            recently used game if there are too many
+        Args:
+            session_id (str): The session id
+            state: The session's State
+        """
+        self.games[session_id] = [state if self.pack is None else self.pack(state), self.clock()]
+        self.games.move_to_end(session_id)
+        while len(self.games) > self.max_games:
+            self.games.popitem(last=False)
+            self.evicted += 1
+
+    def discard(self, session_id : str) -> None:
+        """ Throws away a session's game, if it has one
+        Args:
+            session_id (str): The session id
+        """
+        self.games.pop(session_id, None)
+
+    def get_memory_per_game(self, sample_size : int = 100) -> int:
+        """ Estimates the memory used by each live game from the most recently used ones
+        Args:
+            sample_size (int): How many games to measure at most
+        Returns:
+            int: The average number of bytes per game, or 0 if there are no games
+        """
+        sizes = []
+        for entry in reversed(self.games.values()):
+            if len(sizes) >= sample_size:
+                break
+            sizes.append(get_deep_size(entry[0]))
+        if not sizes:
+            return 0
+        return sum(sizes) // len(sizes)
+
+
+def enable_sessions(server : Server, store : SessionStore, cookie_name : str = "gin_rummy_session") -> None:
+    """ Makes every route of a Drafter server use the State of the browser's own session.
+        Must be called after all of the routes are added and before the server is started.
+        Drafter's default server handles one request at a time, so the server's State can
+        be swapped for the session's State while a route runs.
+    Args:
+        server (Server): The Drafter server
+        store (SessionStore): Where the games are kept
+        cookie_name (str): The name of the session cookie
+    """
+    def new_game():
+        return server.load_from_state(server._initial_state, server._initial_state_type)
+
+    def get_session_id() -> str:
+        session_id = request.get_cookie(cookie_name)
+        if not session_id:
+            session_id = secrets.token_urlsafe(16)
+        response.set_cookie(cookie_name, session_id, path="/", httponly=True)
+        return session_id
+
+    def use_session(bottle_page):
+        @wraps(bottle_page)
+        def session_page(*args, **kwargs):
+            session_id = get_session_id()
+            server._state = store.get(session_id, new_game)
+            # The history is only kept for the current request so one player never sees another's game
+            server._state_history.clear()
+            server._state_frozen_history.clear()
+            server._page_history.clear()
+            try:
+                return bottle_page(*args, **kwargs)
+            finally:
+                store.put(session_id, server._state)
+        return session_page
+
+    for url, bottle_page in list(server.routes.items()):
+        server.routes[url] = use_session(bottle_page)
+
+    def reset():
+        store.discard(get_session_id())
+        return server.routes['/']()
+    server.reset = reset
+
+
+# Tests use a fake clock so eviction can be checked without waiting (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    fake_time = [0.0]
+    test_store = SessionStore(max_games=2, idle_seconds=10, clock=lambda: fake_time[0])
+    assert_equal(test_store.get("a", lambda: [1]), [1])
+    assert_equal(test_store.get("a", lambda: [2]), [1])
+    test_store.put("b", [3])
+    test_store.get("a", lambda: [4])
+    test_store.put("c", [5])           # Too many games, so "b" (the least recently used) is evicted
+    assert_equal(list(test_store.games), ["a", "c"])
+    fake_time[0] = 5.0
+    test_store.get("c", lambda: [6])
+    fake_time[0] = 12.0                # "a" has been idle for 12 seconds, "c" for 7
+    assert_equal(test_store.get("d", lambda: [7]), [7])
+    assert_equal(list(test_store.games), ["c", "d"])
+    assert_equal(test_store.evicted, 2)
+    assert_equal(get_deep_size([]) < get_deep_size([[1, 2], [3]]), True)
+    # Games can be kept packed, and are unpacked again when they are used
+    packed_store = SessionStore(pack=tuple, unpack=list)
+    packed_store.put("a", [1, 2])
+    assert_equal(packed_store.games["a"][0], (1, 2))
+    assert_equal(packed_store.get("a", lambda: [3]), [1, 2])
@@ -0,0 +1,190 @@
+"""
+Monte Carlo self-play for Gin Rummy. Plays lots of complete games with the same rules as the
+website (gin_rummy.py's GameEngine) between two bot strategies, spread over a pool of processes.
+Every game has its own seed, so any game can be played again exactly. Each worker sends its
+results back in batches and the totals are printed at the end along with how many games were
+played per second.
+
+Example:
+    python simulate.py --games 100000 --workers 8 --policies greedy random
+    python simulate.py --games 10000 --rules "Ten cards"
+"""
+from dataclasses import dataclass
+import argparse
+import multiprocessing
+import os
+import random
+import time
+
+# Every worker process imports the game, so the self-tests are skipped (see production_mode)
+os.environ.setdefault("GIN_RUMMY_PRODUCTION", "1")
+from gin_rummy import (Action, Deck, GameEngine, Player, State, card_backing_id, choose_computer_move,
+                       game_engine, greedy_policy, rule_variants)
+
+# A game is called off after this many turns, in case two bots keep passing the discard pile back and forth
+max_turns = 500
+
+
+@dataclass
+class GameResult:
+    """ Dataclass to store how one simulated game went """
+    seed : int
+    winner : int          # 0 for Player 1, 1 for Player 2 and -1 for a tie
+    margin : int          # How many more points the winner had
+    turns : int           # How many turns were played (a pick up and a discard each)
+    ending : str          # 'deck' if the deck ran out, 'hand' if a hand was emptied, or 'limit'
+    scores : tuple[int, int]
+
+
+def random_policy(engine : GameEngine, state : State, rng : random.Random) -> Action:
+    """ Plays any legal move at random
+    Args:
+        engine (GameEngine): The rules being played
+        state (State): The state
+        rng (random.Random): The game's random number generator
+    Returns:
+        Action: The move to make
+    """
+    return rng.choice(engine.legal_actions(state))
+
+policies = {"random": random_policy, "greedy": greedy_policy, "mcts": choose_computer_move}
+
+
+def play_game_state(seed : int, policy_names : tuple[str, str], auto_meld : bool = False,
+                    variant : str = "Standard") -> tuple[State, int]:
+    """ Plays one game between two bots until it is over or called off, without scoring it
+    Args:
+        seed (int): The seed for shuffling the deck and for the bots' random choices
+        policy_names (tuple[str, str]): The strategy for Player 1 and for Player 2
+        auto_meld (bool): Whether to score the leftover cards in each hand as the best sets possible
+        variant (str): The name of the rules to play with (see gin_rummy.rule_variants)
+    Returns:
+        tuple[State, int]: The game and how many turns were played
+    """
+    rng = random.Random(seed)
+    state = State(Deck([], 0, 0), [Player("", [], [], 0), Player("", [], [], 0)], False, [card_backing_id], "pick", [])
+    game_engine.deal(state, policy_names[0], policy_names[1], auto_meld, seed, rule_variants[variant])
+    players = (policies[policy_names[0]], policies[policy_names[1]])
+
+    turns = 0
+    while not game_engine.is_over(state) and turns < max_turns:
+        action = players[state.current_player](game_engine, state, rng)
+        game_engine.apply(state, action)
+        if action.kind == "discard":
+            turns += 1
+    return state, turns
+
+def play_game(seed : int, policy_names : tuple[str, str], auto_meld : bool = False,
+              variant : str = "Standard") -> GameResult:
+    """ Plays one complete game between two bots
+    Args:
+        seed (int): The seed for shuffling the deck and for the bots' random choices
+        policy_names (tuple[str, str]): The strategy for Player 1 and for Player 2
+        auto_meld (bool): Whether to score the leftover cards in each hand as the best sets possible
+        variant (str): The name of the rules to play with (see gin_rummy.rule_variants)
+    Returns:
+        GameResult: How the game went
+    """
+    state, turns = play_game_state(seed, policy_names, auto_meld, variant)
+    if turns >= max_turns:
+        ending = "limit"
+    elif state.deck.remaining() <= state.rules.end_deck_size:
+        ending = "deck"
+    else:
+        ending = "hand"
+    game_engine.score(state)
+    scores = (state.players[0].points, state.players[1].points)
+    if scores[0] == scores[1]:
+        winner = -1
+    else:
+        winner = int(scores[1] > scores[0])
+    return GameResult(seed, winner, abs(scores[0] - scores[1]), turns, ending, scores)
+
+def play_batch(task : tuple[int, int, tuple[str, str], bool, str]) -> list[GameResult]:
+    """ Plays a batch of games in a worker process
+    Args:
+        task (tuple[int, int, tuple[str, str], bool, str]): The first seed, the number of games, the two
+                                                             strategies, the auto-meld setting and the variant
+    Returns:
+        list[GameResult]: The results of every game in the batch
+    """
+    first_seed, count, policy_names, auto_meld, variant = task
+    return [play_game(seed, policy_names, auto_meld, variant) for seed in range(first_seed, first_seed + count)]
+
+
+def simulate(games : int, workers : int, seed : int = 0, batch_size : int = 500,
+             policy_names : tuple[str, str] = ("greedy", "greedy"), auto_meld : bool = False,
+             variant : str = "Standard"):
+    """ Spreads games over a pool of processes and yields each batch of results as soon as it is done.
+        Game number i always uses the seed (seed + i), no matter how many workers there are.
+    Args:
+        games (int): How many games to play
+        workers (int): How many processes to play them on
+        seed (int): The seed of the first game
+        batch_size (int): How many games each worker plays before sending its results back
+        policy_names (tuple[str, str]): The strategy for Player 1 and for Player 2
+        auto_meld (bool): Whether to score the leftover cards in each hand as the best sets possible
+        variant (str): The name of the rules to play with
+    Yields:
+        list[GameResult]: The results of one batch of games, in whatever order the batches finish
+    """
+    tasks = []
+    for first_seed in range(seed, seed + games, batch_size):
+        tasks.append((first_seed, min(batch_size, seed + games - first_seed), policy_names, auto_meld, variant))
+    if workers <= 1:
+        for task in tasks:
+            yield play_batch(task)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for results in pool.imap_unordered(play_batch, tasks):
+            yield results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Gin Rummy bots against each other.")
+    parser.add_argument("--games", type=int, default=10000, help="how many games to play")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="how many processes")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the first game")
+    parser.add_argument("--batch", type=int, default=500, help="how many games per batch")
+    parser.add_argument("--policies", nargs=2, default=["greedy", "greedy"], choices=sorted(policies),
+                        help="the strategies for Player 1 and Player 2")
+    parser.add_argument("--auto-meld", action="store_true", help="use auto-meld scoring")
+    parser.add_argument("--rules", default="Standard", choices=list(rule_variants), help="the variant to play")
+    parser.add_argument("--output", help="a CSV file to write every game's result to")
+    args = parser.parse_args()
+    if args.games < 1 or args.workers < 1 or args.batch < 1:
+        parser.error("--games, --workers and --batch must be at least 1")
+
+    output = open(args.output, "w") if args.output else None
+    if output:
+        output.write("seed,winner,margin,turns,ending,score1,score2\n")
+    wins = [0, 0, 0] # Player 1, Player 2, ties
+    endings = {"deck": 0, "hand": 0, "limit": 0}
+    total_margin = total_turns = played = 0
+
+    start = time.perf_counter()
+    for results in simulate(args.games, args.workers, args.seed, args.batch, tuple(args.policies), args.auto_meld,
+                            args.rules):
+        for result in results:
+            wins[result.winner] += 1
+            endings[result.ending] += 1
+            total_margin += result.margin
+            total_turns += result.turns
+            if output:
+                output.write(f"{result.seed},{result.winner},{result.margin},{result.turns},"
+                             f"{result.ending},{result.scores[0]},{result.scores[1]}\n")
+        played += len(results)
+    elapsed = time.perf_counter() - start
+    if output:
+        output.close()
+
+    print(f"Played {played} games on {args.workers} worker(s) in {elapsed:.2f}s "
+          f"({played / elapsed:.0f} games/second)")
+    print(f"Player 1 ({args.policies[0]}) won {wins[0]}, Player 2 ({args.policies[1]}) won {wins[1]}, "
+          f"{wins[-1]} ties")
+    print(f"Average margin {total_margin / played:.1f} points, average length {total_turns / played:.1f} turns")
+    print(f"Endings: {endings['deck']} deck depleted, {endings['hand']} empty hand, {endings['limit']} turn limit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Puts every card face and the card backing into one image (a sprite sheet) that the server hands
+out itself, so a hand of cards is one cached download instead of a redirect and a remote image
+per card. Cards are laid out in card id order, 13 to a row, so card id c is in column (c % 13)
+and row (c // 13), and the backing (id 52) starts the fifth row. Each card is shown with a
+<span> whose background is moved to the card's spot on the sheet.
+
+The sheet itself is made by build_sprites.py. Pillow is only needed for that, not by the server.
+"""
+from functools import wraps
+import hashlib
+import io
+import os
+import urllib.request
+
+from bakery import assert_equal
+from bottle import static_file
+from drafter.server import Server
+
+card_width = 82
+card_height = 140
+sheet_columns = 13
+sprite_sheet_name = "cards.png"
+sprite_sheet_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), sprite_sheet_name)
+# The sheet's URL changes whenever it is rebuilt, so browsers can keep it for a year
+cache_control = "public, max-age=31536000, immutable"
+
+
+def get_sprite_offset(card : int) -> tuple[int, int]:
+    """ Finds where a card is on the sprite sheet
+    Args:
+        card (int): The card id
+    Returns:
+        tuple[int, int]: The x and y of the card's top left corner, in pixels
+    """
+    return (card % sheet_columns) * card_width, (card // sheet_columns) * card_height
+
+def get_sprite_html(card : int) -> str:
+    """ Makes the HTML that shows one card from the sprite sheet
+    Args:
+        card (int): The card id
+    Returns:
+        str: A <span> showing the card
+    """
+    x, y = get_sprite_offset(card)
+    return "<span class='card-sprite' style='background-position: -" + str(x) + "px -" + str(y) + "px'></span>"
+
+def get_sprite_css(url : str) -> str:
+    """ Makes the style for the card <span>s
+    Args:
+        url (str): The URL of the sprite sheet
+    Returns:
+        str: A <style> tag
+    """
+    return ("<style>.card-sprite {display: inline-block; width: " + str(card_width) + "px; height: " +
+            str(card_height) + "px; background-image: url('" + url + "');}</style>")
+
+
+def render_card_face(label : str, red : bool):
+    """ Draws a plain card face, for when a card's image can't be downloaded
+    Args:
+        label (str): What to write on the card, such as "QH", or "" for the backing
+        red (bool): Whether the label is written in red
+    Returns:
+        PIL.Image.Image: The card
+    """
+    from PIL import Image, ImageDraw
+    card = Image.new("RGB", (card_width, card_height), "white" if label else "navy")
+    draw = ImageDraw.Draw(card)
+    draw.rectangle((0, 0, card_width - 1, card_height - 1), outline="black")
+    if label:
+        color = "firebrick" if red else "black"
+        draw.text((6, 4), label, fill=color)
+        draw.text((card_width // 2, card_height // 2), label, fill=color, anchor="mm")
+    return card
+
+def build_sprite_sheet(urls : list[str], labels : list[str], red : list[bool], path : str = sprite_sheet_path,
+                       download : bool = True) -> int:
+    """ Downloads every card's image, scales it to the size it is shown at, and packs them all into one PNG.
+        Any card that can't be downloaded is drawn instead.
+    Args:
+        urls (list[str]): The image URL of every card id
+        labels (list[str]): The name of every card id, for the ones that have to be drawn
+        red (list[bool]): Whether each card id is a red suit
+        path (str): Where to save the sprite sheet
+        download (bool): Whether to try downloading the images at all
+    Returns:
+        int: How many cards had to be drawn
+    """
+    from PIL import Image
+    rows = (len(urls) + sheet_columns - 1) // sheet_columns
+    sheet = Image.new("RGB", (sheet_columns * card_width, rows * card_height), "white")
+    drawn = 0
+    for card, url in enumerate(urls):
+        face = None
+        if download:
+            try:
+                with urllib.request.urlopen(url, timeout=10) as reply:
+                    face = Image.open(io.BytesIO(reply.read())).convert("RGB")
+                face = face.resize((card_width, card_height), Image.LANCZOS)
+            except (OSError, ValueError):
+                face = None
+        if face is None:
+            face = render_card_face(labels[card], red[card])
+            drawn += 1
+        sheet.paste(face, get_sprite_offset(card))
+    sheet.save(path, optimize=True)
+    return drawn
+
+
+def enable_sprite_sheet(server : Server, sheet_path : str = sprite_sheet_path) -> None:
+    """ Serves the sprite sheet with long-lived cache headers and adds the card style to every page.
+        Must be called before the server is started.
+    Args:
+        server (Server): The Drafter server
+        sheet_path (str): Where the sprite sheet is
+    """
+    with open(sheet_path, "rb") as sheet:
+        version = hashlib.blake2b(sheet.read(), digest_size=6).hexdigest()
+    sheet_folder, sheet_name = os.path.split(sheet_path)
+    url = "/" + server.configuration.deploy_image_path + "/" + sheet_name + "?v=" + version
+    server.configuration.additional_header_content.append(get_sprite_css(url))
+
+    serve_image = server.serve_image
+    @wraps(serve_image)
+    def serve_sprite_sheet(path):
+        if path != sheet_name:
+            return serve_image(path)
+        reply = static_file(sheet_name, root=sheet_folder, mimetype="image/png")
+        reply.set_header("Cache-Control", cache_control)
+        return reply
+    server.serve_image = serve_sprite_sheet
+
+
+# Tests (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    assert_equal(get_sprite_offset(0), (0, 0))
+    assert_equal(get_sprite_offset(14), (82, 140))
+    assert_equal(get_sprite_offset(52), (0, 560))
+    assert_equal(get_sprite_html(1), "<span class='card-sprite' style='background-position: -82px -0px'></span>")
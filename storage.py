@@ -0,0 +1,173 @@
+"""
+Keeps games in a SQLite database so they survive the server restarting. Each game is one row
+holding a snapshot of its State (as bytes) and its action log, under the game's id. Saving only
+puts the game in a dictionary of pending writes, so a route never waits for the disk. A
+background thread writes everything pending in one transaction every commit interval, and a
+game that was saved several times in between is only written once. The database is in WAL
+mode, so games can be read while a batch is being written.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+from bakery import assert_equal
+
+
+class GameDatabase:
+    """ Saves and loads game snapshots by game id, writing them in batches """
+
+    def __init__(self, path : str, commit_seconds : float = 1.0):
+        """
+        Args:
+            path (str): Where the SQLite database is, made if it doesn't exist
+            commit_seconds (float): How often the pending games are written
+        """
+        self.path = path
+        self.commit_seconds = commit_seconds
+        self.pending = {}           # Game id -> (snapshot, action log, time it was saved), waiting to be written
+        self.pending_lock = threading.Lock()
+        self.database_lock = threading.Lock()
+        self.written = 0
+        self.stopping = threading.Event()
+        self.writer = None
+        # The connection is shared by the writer thread and the routes, so it is only used with database_lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL") # WAL is still safe if the power goes out
+        self.connection.execute("CREATE TABLE IF NOT EXISTS games (game_id TEXT PRIMARY KEY, snapshot BLOB NOT NULL, "
+                                "action_log TEXT NOT NULL, moves INTEGER NOT NULL, updated REAL NOT NULL)")
+        self.connection.commit()
+
+    def save(self, game_id : str, snapshot : bytes, action_log : list[int]) -> None:
+        """ Queues a game to be written with the next batch
+        Args:
+            game_id (str): The game's id
+            snapshot (bytes): The game's State as bytes
+            action_log (list[int]): The game's moves, which are copied
+        """
+        with self.pending_lock:
+            self.pending[game_id] = (snapshot, action_log.copy(), time.time())
+
+    def load(self, game_id : str) -> bytes | None:
+        """ Gets the latest snapshot of a game, even if it hasn't been written yet
+        Args:
+            game_id (str): The game's id
+        Returns:
+            bytes | None: The game's State as bytes, or None if there is no game with that id
+        """
+        with self.pending_lock:
+            if game_id in self.pending:
+                return self.pending[game_id][0]
+        with self.database_lock:
+            row = self.connection.execute("SELECT snapshot FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def flush(self) -> int:
+        """ Writes every pending game in one transaction. The games stay pending until the write
+            is committed, so load() finds them the whole time, and a game saved again while it was
+            being written stays pending for the next batch.
+        Returns:
+            int: How many games were written
+        """
+        with self.pending_lock:
+            pending = self.pending.copy()
+        if not pending:
+            return 0
+        rows = [(game_id, snapshot, " ".join(map(str, action_log)), len(action_log), updated)
+                for game_id, (snapshot, action_log, updated) in pending.items()]
+        with self.database_lock:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?)", rows)
+        with self.pending_lock:
+            for game_id, entry in pending.items():
+                if self.pending.get(game_id) is entry: # Not saved again since it was copied
+                    del self.pending[game_id]
+        self.written += len(rows)
+        return len(rows)
+
+    def iter_games(self, batch_size : int = 500):
+        """ Reads every written game a batch at a time, in order of game id, so any number of games
+            can be gone through without loading them all at once. Games that are still pending
+            aren't included (see flush).
+        Args:
+            batch_size (int): How many games are read from the database at a time
+        Yields:
+            tuple[str, bytes, list[int]]: Each game's id, snapshot and action log
+        """
+        last_id = ""
+        while True:
+            # Starting after the last id read instead of at an offset, so each batch is one index lookup
+            with self.database_lock:
+                rows = self.connection.execute("SELECT game_id, snapshot, action_log FROM games WHERE game_id > ? "
+                                               "ORDER BY game_id LIMIT ?", (last_id, batch_size)).fetchall()
+            for game_id, snapshot, action_log in rows:
+                yield game_id, snapshot, [int(code) for code in action_log.split()]
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def count(self) -> int:
+        """ Returns:
+                int: How many games have been written to the database
+        """
+        with self.database_lock:
+            return self.connection.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def start(self) -> None:
+        """ Starts writing the pending games every commit interval in the background. Whatever is
+            still pending is written when the program exits.
+        """
+        def write_batches():
+            while not self.stopping.wait(self.commit_seconds):
+                self.flush()
+        self.writer = threading.Thread(target=write_batches, name="game-database-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """ Stops the background writer, writes whatever is pending and closes the database """
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        if self.writer is not None:
+            self.writer.join()
+        self.flush()
+        with self.database_lock:
+            self.connection.close()
+
+
+# Tests (skipped in production mode, see gin_rummy.py)
+if not os.environ.get("GIN_RUMMY_PRODUCTION"):
+    test_database = GameDatabase(":memory:")
+    test_database.save("a", b"first", [1, 2])
+    test_database.save("a", b"second", [1, 2, 3])   # Replaces the pending write instead of adding one
+    test_database.save("b", b"other", [])
+    assert_equal(test_database.load("a") == b"second", True)
+    assert_equal(test_database.count(), 0)
+    assert_equal(test_database.flush(), 2)
+    assert_equal(test_database.count(), 2)
+    assert_equal(test_database.load("a") == b"second", True)
+    assert_equal(test_database.load("missing"), None)
+    assert_equal(test_database.connection.execute("SELECT action_log, moves FROM games WHERE game_id = 'a'").fetchone(),
+                 ("1 2 3", 3))
+    # Read one game at a time (bakery can't compare bytes, so only the ids and logs are checked)
+    assert_equal([(game_id, action_log) for game_id, snapshot, action_log in test_database.iter_games(1)],
+                 [("a", [1, 2, 3]), ("b", [])])
+    # A game being written is still found by load(), which would otherwise wait for the database,
+    # and a save made during the write isn't dropped when the write finishes
+    test_database.save("c", b"third", [])
+    with test_database.database_lock:
+        test_flush = threading.Thread(target=test_database.flush)
+        test_flush.start()
+        time.sleep(0.05)
+        assert_equal(test_database.load("c") == b"third", True)
+        test_database.save("c", b"fourth", [])
+    test_flush.join()
+    assert_equal(test_database.load("c") == b"fourth", True)
+    test_database.flush()
+    assert_equal(test_database.pending, {})
+    assert_equal(test_database.connection.execute("SELECT snapshot FROM games WHERE game_id = 'c'").fetchone()[0] == b"fourth",
+                 True)
+    test_database.close()